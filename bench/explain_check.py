@@ -0,0 +1,155 @@
+from datetime import date, datetime, timedelta
+from share import sqlmng
+import argparse
+import json
+import os
+import overview_doc
+import recording_doc
+import sys
+
+__version__ = '1.0.0'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_RESULTS = f'{PATH_PRJ}/bench/results'
+
+# CHECK_*: valori dei record sintetici, distinti da quelli reali per non violare gli indici univoci
+CHECK_GENERE = 'ZZ'
+CHECK_SORGENTE = 'EXPLAIN_CHECK_%d.pdf'
+CHECK_PAGES = 250
+
+QUERY_FILL_CONSEGNE = """
+    INSERT INTO vanaheim.consegne (
+        numero_documento,
+        genere_documento,
+        data_documento,
+        ragione_sociale,
+        sede_consegna,
+        quantita,
+        data_consegna,
+        targa,
+        sorgente,
+        pagina,
+        data_registrazione
+    )
+    SELECT p.numero,
+        ?,
+        p.data,
+        'EXPLAIN CHECK',
+        'CHECK',
+        1000 + p.g %% 30000,
+        p.data,
+        'CK' || LPAD((p.g %% 50)::TEXT, 3, '0') || 'ZZ',
+        REPLACE(?, '%%d', (p.g / %(pages)d)::TEXT),
+        p.g %% %(pages)d + 1,
+        NOW() - p.g * INTERVAL '1 minute'
+    FROM (
+        SELECT g,
+            g / %(years)d + 1 numero,
+            MAKE_DATE(%(first_year)d + g %% %(years)d, 1, 1) + (g / %(years)d * 365 / (%(rows)d / %(years)d + 1))::INTEGER data
+        FROM GENERATE_SERIES(0, %(rows)d - 1) g
+    ) p;
+"""
+QUERY_ANALYZE_CONSEGNE = """
+    ANALYZE vanaheim.consegne;
+"""
+QUERY_EXPLAIN = 'EXPLAIN (FORMAT JSON) %(query)s'
+
+
+def plan_indexes(plan: dict) -> tuple[set[str], set[str]]:
+    """Collect the indexes and the node types of a query plan, from EXPLAIN (FORMAT JSON).
+
+    :param dict plan: The plan node.
+    :return: A tuple containing the index names and the node types of the plan and of its subplans.
+    """
+    indexes = {plan['Index Name']} if 'Index Name' in plan else set()
+    nodes = {plan['Node Type']}
+    for child in plan.get('Plans', []):
+        child_indexes, child_nodes = plan_indexes(child)
+        indexes |= child_indexes
+        nodes |= child_nodes
+    return indexes, nodes
+
+
+def checks_gnr(args: argparse.Namespace) -> list[tuple[str, str, list, set[str]]]:
+    """Build the queries to be checked on the synthetic records, with their parameters and expected indexes.
+
+    :param Namespace args: The command line options.
+    :return: A list of tuples containing name, query string, parameters and indexes of which at least one must be used.
+    """
+    anno, mese = args.first_year, 6
+    # recording_begin: inizio di una sessione recente, che comprende le ultime 100 registrazioni sintetiche
+    recording_begin = datetime.now() - timedelta(minutes=100)
+    sorgente = CHECK_SORGENTE % 0
+    duplicates = [(CHECK_SORGENTE % (pos * 7), pos + 1, pos * 13 + 1, CHECK_GENERE, anno) for pos in range(100)]
+    periods = [(anno, mese), (anno + 1, mese)]
+
+    return [
+        ('load_duplicate_docs', recording_doc.QUERY_LOAD_DUPLICATE_DOCS, [anno], {'consegne_anno_numero_genere_uq'}),
+        ('load_duplicate_pages', recording_doc.QUERY_LOAD_DUPLICATE_PAGES, [sorgente], {'consegne_sorgente_pagina_uq'}),
+        ('chk_duplicate_many', recording_doc.QUERY_CHK_DUPLICATE_MANY % {
+            'values': ', '.join(['(?::VARCHAR, ?::INTEGER, ?::INTEGER, ?::CHAR(2), ?::INTEGER)'] * len(duplicates))
+        }, [value for record in duplicates for value in record], {'consegne_sorgente_pagina_uq', 'consegne_anno_numero_genere_uq'}),
+        ('gap_ranges', recording_doc.QUERY_GAP_RANGES, [recording_begin], {'consegne_data_registrazione_idx'}),
+        ('gap_numbers', recording_doc.QUERY_GAP_NUMBERS, [anno, 100, 200] * 3, {'consegne_anno_numero_genere_uq'}),
+        ('overview_date', recording_doc.QUERY_OVERVIEW_DATE, [recording_begin], {'consegne_data_registrazione_idx'}),
+        ('overview_data', overview_doc.QUERY_OVERVIEW_DATA, [date(anno, mese, 1), date(anno, mese + 1, 1)], {'consegne_data_consegna_idx'}),
+        ('overview_data_many', overview_doc.QUERY_OVERVIEW_DATA_MANY % {
+            'values': ', '.join(['(?::INTEGER, ?::INTEGER, ?::DATE, ?::DATE)'] * len(periods))
+        }, [value for a, m in periods for value in (a, m, date(a, m, 1), date(a, m + 1, 1))], {'consegne_data_consegna_idx'}),
+        ('summary_viaggi', *overview_doc.summary_query(anno, [f'CK{pos:0>3}ZZ' for pos in range(5)]), {'consegne_data_documento_idx'})
+    ]
+
+
+def explain_run(args: argparse.Namespace) -> dict:
+    """Fill vanaheim.consegne with synthetic records and check the plans of the recording and overview queries.
+
+    Everything runs in a single transaction which is rolled back at the end, so the database is left unchanged.
+
+    :param Namespace args: The command line options.
+    :return: The results of the run.
+    """
+    checks = []
+    with sqlmng.conx_session(args.conn) as (cursor, _):
+        sqlmng.conx_write(cursor, QUERY_FILL_CONSEGNE % {'rows': args.rows, 'years': args.years, 'first_year': args.first_year, 'pages': CHECK_PAGES}, [CHECK_GENERE, CHECK_SORGENTE])
+        sqlmng.conx_write(cursor, QUERY_ANALYZE_CONSEGNE)
+
+        for name, query, params, expected in checks_gnr(args):
+            plan = json.loads(sqlmng.conx_read(cursor, QUERY_EXPLAIN % {'query': query}, params).fetchone()[0])[0]['Plan']
+            indexes, nodes = plan_indexes(plan)
+            checks.append({
+                'name': name,
+                'passed': bool(indexes & expected),
+                'expected': sorted(expected),
+                'indexes': sorted(indexes),
+                'nodes': sorted(nodes),
+                'cost': plan['Total Cost']
+            })
+
+    return {
+        'bench': 'explain',
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'versions': {module.__name__: module.__version__ for module in (recording_doc, overview_doc, sqlmng)},
+        'params': vars(args),
+        'checks': checks
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check with EXPLAIN that the recording and overview queries use the indexes of vanaheim.consegne.')
+    parser.add_argument('--conn', required=True, help='configuration name in sqlmng.json of a database with the updated schema')
+    parser.add_argument('--rows', type=int, default=1000000, help='synthetic records, rolled back at the end')
+    parser.add_argument('--years', type=int, default=10, help='years of the synthetic records')
+    parser.add_argument('--first-year', type=int, default=1990, help='first year of the synthetic records')
+    parser.add_argument('--output', default=PATH_RESULTS, help='directory of the json results')
+    args = parser.parse_args()
+
+    res = explain_run(args)
+    os.makedirs(args.output, exist_ok=True)
+    fou = f"{args.output}/explain_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(fou, 'w') as jou:
+        json.dump(res, jou, indent=2, default=str)
+
+    for check in res['checks']:
+        print(f"{'PASS' if check['passed'] else 'FAIL'} {check['name']}: {', '.join(check['indexes']) or 'no index'} [{', '.join(check['nodes'])}]")
+    print(f'[{fou}]')
+    sys.exit(0 if all(check['passed'] for check in res['checks']) else 1)
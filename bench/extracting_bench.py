@@ -0,0 +1,119 @@
+from datetime import datetime
+from extracting_doc import DocExtractor, PageRecord, PATTERN_NUMERO_DATA, PATTERN_QUANTITA, PATTERN_SEDE_DX, PATTERN_SEDE_SX, PATTERN_TARGA
+import argparse
+import os
+import pypdfium2
+import re
+import sys
+import timeit
+
+__version__ = '1.0.0'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_CORPUS = f'{PATH_PRJ}/bench/corpus'
+
+
+def legacy_scan(text: str) -> tuple[PageRecord, list[str]]:
+    """Extract the delivery information as recording_doc did before DocExtractor, used as reference.
+
+    :param str text: The text of the page.
+    :return: A tuple containing the page record and the list of failed patterns.
+    """
+    errors = []
+
+    search = re.search(PATTERN_NUMERO_DATA, text)
+    numero_documento = int(search.group(1).replace('.', '')) if search else None
+    genere_documento = search.group(2).upper() if search else None
+    data_documento = datetime.strptime(search.group(3)[6:] + '-' + search.group(3)[3:5] + '-' + search.group(3)[0:2], '%Y-%m-%d').date() if search else None
+    if not search:
+        errors.append('PATTERN_NUMERO_DATA')
+
+    search = re.search(PATTERN_SEDE_DX, text) or re.search(PATTERN_SEDE_SX, text)
+    ragione_sociale = search.group(1).upper().strip() if search else None
+    sede_consegna = search.group(3).upper().strip() if search else None
+    if not search:
+        errors.append('PATTERN_SEDE')
+
+    search = re.search(PATTERN_QUANTITA, text)
+    quantita = int(search.group(3).replace('.', '')) if search else None
+    if not search:
+        errors.append('PATTERN_QUANTITA')
+
+    search = re.search(PATTERN_TARGA, text)
+    targa = search.group(1).upper() if search else None
+    if not search:
+        errors.append('PATTERN_TARGA')
+
+    return PageRecord(numero_documento, genere_documento, data_documento, ragione_sociale, sede_consegna, quantita, data_documento, targa), errors
+
+
+def corpus_load(corpus: str) -> dict[str, str]:
+    """Read the page texts of the corpus, keeping the original line endings.
+
+    :param str corpus: Path to the corpus directory.
+    :return: A dictionary with the file name as key and the page text as value.
+    """
+    texts = {}
+    for fin in sorted(os.listdir(corpus)):
+        if fin.endswith('.txt'):
+            with open(f'{corpus}/{fin}', 'r', encoding='utf-8', newline='') as tin:
+                texts[fin] = tin.read()
+    return texts
+
+
+def corpus_dump(fin: str, corpus: str) -> int:
+    """Add the page texts of a real pdf document to the corpus, one file per page.
+
+    :param str fin: Path to the pdf document.
+    :param str corpus: Path to the corpus directory.
+    :return: The number of pages added.
+    """
+    doc = pypdfium2.PdfDocument(fin)
+    doc_name = fin.replace('\\', '/').split('/')[-1].split('.')[0]
+
+    for page_num, page in enumerate(doc, start=1):
+        with open(f'{corpus}/{doc_name}_P{page_num:0>3}.txt', 'w', encoding='utf-8', newline='') as tou:
+            tou.write(page.get_textpage().get_text_bounded())
+
+    doc_pages = len(doc)
+    doc.close()
+    return doc_pages
+
+
+def bench_run(texts: dict[str, str], rounds: int) -> bool:
+    """Check that DocExtractor gives the same records as the reference, then time both over the corpus.
+
+    :param dict[str, str] texts: The page texts of the corpus.
+    :param int rounds: The number of passes over the corpus for each timing.
+    :return: True if every page gives the same result.
+    """
+    extractor = DocExtractor()
+
+    mismatches = [name for name, text in texts.items() if extractor.scan(text) != legacy_scan(text)]
+    for name in mismatches:
+        print(f'mismatch on {name}: {extractor.scan(texts[name])} != {legacy_scan(texts[name])}')
+
+    legacy_time = min(timeit.repeat(lambda: [legacy_scan(text) for text in texts.values()], number=rounds, repeat=5))
+    extractor_time = min(timeit.repeat(lambda: [extractor.scan(text) for text in texts.values()], number=rounds, repeat=5))
+    pages = len(texts) * rounds
+
+    print(f'{"engine":<16}{"pages/sec":>14}{"us/page":>12}')
+    print(f'{"legacy_scan":<16}{pages / legacy_time:>14,.0f}{legacy_time / pages * 1e6:>12.2f}')
+    print(f'{"DocExtractor":<16}{pages / extractor_time:>14,.0f}{extractor_time / pages * 1e6:>12.2f}')
+    print(f'speedup {legacy_time / extractor_time:.2f}x over {len(texts)} pages, {len(mismatches)} mismatches')
+    return not mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the DDT field extraction.')
+    parser.add_argument('--corpus', default=PATH_CORPUS, help='directory of the page texts (*.txt)')
+    parser.add_argument('--rounds', type=int, default=1000, help='passes over the corpus for each timing')
+    parser.add_argument('--dump', nargs='+', metavar='PDF', help='add the pages of real pdf documents to the corpus and exit')
+    args = parser.parse_args()
+
+    if args.dump:
+        for fin in args.dump:
+            print(f'added {corpus_dump(fin, args.corpus)} pages of {fin} to corpus')
+        sys.exit(0)
+
+    sys.exit(0 if bench_run(corpus_load(args.corpus), args.rounds) else 1)
@@ -0,0 +1,502 @@
+from collections import namedtuple
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import partial
+from share import perfmng, sqlmng, xlsmng
+import argparse
+import caching_doc
+import json
+import matching_doc
+import os
+import overview_doc
+import random
+import recording_doc
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__version__ = '1.4.2'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_RESULTS = f'{PATH_PRJ}/bench/results'
+# PATH_SCHEME: modelli Excel delle overview nella cartella scheme/ del repository, ovunque venga avviato il benchmark
+PATH_SCHEME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scheme').replace(os.sep, '/')
+
+# CLIENTI: ragioni sociali e sedi di consegna delle pagine generate
+CLIENTI = [
+    ('ROSSI SRL', 'VIA ROMA 1', '20100', 'MILANO', 'MI'),
+    ('BIANCHI & FIGLI SNC', 'VIA PO 12', '10121', 'TORINO', 'TO'),
+    ("AUTOTRASPORTI D'ANGELO", 'VIA APPIA 240', '00178', 'ROMA', 'RM'),
+    ('VERDI S.P.A.', 'CORSO ITALIA 3', '50123', 'FIRENZE', 'FI')
+]
+
+# TARGHE: targhe iniziali del registro, completato con targhe generate fino al numero richiesto
+TARGHE = ['ES745WH', 'FC065ZW']
+
+# ROW_*: tipi delle righe restituite dalla base dati locale, con gli stessi nomi di colonna delle query
+ROW_DOCS = namedtuple('ROW_DOCS', 'numero_documento genere_documento')
+ROW_PAGES = namedtuple('ROW_PAGES', 'pagina')
+ROW_ID = namedtuple('ROW_ID', 'id')
+ROW_TARGA = namedtuple('ROW_TARGA', 'targa')
+ROW_NUMERO = namedtuple('ROW_NUMERO', 'numero')
+ROW_RANGE = namedtuple('ROW_RANGE', 'anno min_num max_num')
+ROW_PERIOD = namedtuple('ROW_PERIOD', 'anno mese')
+ROW_DISCARD = namedtuple('ROW_DISCARD', 'numero_documento genere_documento data_documento ragione_sociale sede_consegna quantita data_consegna targa id_messaggio sorgente')
+ROW_CHECKPOINT = namedtuple('ROW_CHECKPOINT', 'sha256 pagina pagine_scartate')
+ROW_OVERVIEW = namedtuple('ROW_OVERVIEW', 'anno mese numero_documento data_documento ragione_sociale sede_consegna quantita data_consegna targa')
+
+
+class StandInDatabase:
+    """In-memory stand-in of the vanaheim schema, answering the queries of recording_doc and overview_doc.
+
+    Every query is recognized by its text and served by a handler working on python lists and indexes, so the
+    pipeline runs without a database server. A round-trip is counted for every execute, commit and rollback, and for
+    every parameters set of an executemany unless fast_executemany is enabled, as pyodbc does.
+    """
+
+    def __init__(self, targhe: list[str] = None) -> None:
+        # targhe: registro delle targhe attive
+        self.targhe = list(targhe or TARGHE)
+        # consegne: record salvati, come parametri di QUERY_INSERT_CONSEGNE
+        self.consegne = []
+        # docs, pages: indici di consegne per anno e per sorgente
+        self.docs = {}
+        self.pages = {}
+        # messaggi: messaggi salvati per id
+        self.messaggi = {}
+        # discard_consegne: record di scarto salvati
+        self.discard_consegne = []
+        # checkpoint: checkpoint dei doc per sorgente, come (sha256, pagina, pagine_scartate, stato)
+        self.checkpoint = {}
+        self.round_trips = 0
+
+        # handlers: query servite, con la parte fissa delle query generate con %(values)s
+        self.handlers = [
+            (recording_doc.QUERY_LOAD_DUPLICATE_DOCS, self.load_docs),
+            (recording_doc.QUERY_LOAD_DUPLICATE_PAGES, self.load_pages),
+            (recording_doc.QUERY_CHK_DUPLICATE_MANY, self.chk_duplicate_many),
+            (recording_doc.QUERY_LOCK_CONSEGNE, lambda args: []),
+            (recording_doc.QUERY_INSERT_CONSEGNE, self.insert_consegne),
+            (recording_doc.QUERY_INSERT_MESSAGGI, self.insert_messaggi),
+            (recording_doc.QUERY_INSERT_DISCARD_CONSEGNE, self.insert_discard),
+            (recording_doc.QUERY_LOAD_DISCARD_CONSEGNE, self.load_discard),
+            (recording_doc.QUERY_CLOSE_RECORD_GAPS, self.close_record_gaps),
+            (recording_doc.QUERY_UPDATE_MESSAGGI, self.update_messaggi),
+            (recording_doc.QUERY_GAP_RANGES, self.gap_ranges),
+            (recording_doc.QUERY_GAP_NUMBERS, self.gap_numbers),
+            (recording_doc.QUERY_OVERVIEW_DATE, self.overview_date),
+            (recording_doc.QUERY_LOAD_CHECKPOINT, self.load_checkpoint),
+            (recording_doc.QUERY_SAVE_CHECKPOINT, self.save_checkpoint),
+            (recording_doc.QUERY_CLOSE_CHECKPOINT, self.close_checkpoint),
+            (overview_doc.QUERY_OVERVIEW_DATA_MANY, self.overview_data_many),
+            (matching_doc.QUERY_LOAD_TARGHE, self.load_targhe)
+        ]
+        self.handlers = [(query.split('%(values)s')[0], handler) for query, handler in self.handlers]
+
+    def handler(self, query: str):
+        """Find the handler of a query.
+
+        :param str query: The query string, also with the values list already formatted.
+        :return: The handler of the query.
+        """
+        for prefix, handler in self.handlers:
+            if query.startswith(prefix):
+                return handler
+        raise NotImplementedError(f'StandInDatabase: no handler for query {query.split()[:4]}')
+
+    def load_targhe(self, args: tuple) -> list:
+        """Serve QUERY_LOAD_TARGHE."""
+        return [ROW_TARGA(targa) for targa in self.targhe]
+
+    def load_docs(self, args: tuple) -> list:
+        """Serve QUERY_LOAD_DUPLICATE_DOCS."""
+        return [ROW_DOCS(numero, genere) for numero, genere in self.docs.get(args[0], ())]
+
+    def load_pages(self, args: tuple) -> list:
+        """Serve QUERY_LOAD_DUPLICATE_PAGES."""
+        return [ROW_PAGES(pagina) for pagina in self.pages.get(args[0], ())]
+
+    def chk_duplicate_many(self, args: tuple) -> list:
+        """Serve QUERY_CHK_DUPLICATE_MANY."""
+        return [ROW_PAGES(args[i + 1]) for i in range(0, len(args), 5)
+                if args[i + 1] in self.pages.get(args[i], ()) or (args[i + 2], args[i + 3]) in self.docs.get(args[i + 4], ())]
+
+    def insert_consegne(self, args: tuple) -> list:
+        """Serve QUERY_INSERT_CONSEGNE."""
+        self.consegne.append(tuple(args))
+        self.docs.setdefault(args[2].year, set()).add((args[0], args[1]))
+        self.pages.setdefault(args[8], set()).add(args[9])
+        return []
+
+    def insert_messaggi(self, args: tuple) -> list:
+        """Serve QUERY_INSERT_MESSAGGI."""
+        self.messaggi[len(self.messaggi) + 1] = {'genere': args[0], 'numero_documento': args[2], 'anno': args[5], 'stato': True}
+        return []
+
+    def insert_discard(self, args: tuple) -> list:
+        """Serve QUERY_INSERT_DISCARD_CONSEGNE, saving the message and then the discarded record which refers to it."""
+        self.insert_messaggi(args[:9])
+        # discard_consegne: colonne di QUERY_LOAD_DISCARD_CONSEGNE, poi stato
+        self.discard_consegne.append((*args[9:17], len(self.messaggi), args[17], True))
+        return []
+
+    def load_discard(self, args: tuple) -> list:
+        """Serve QUERY_LOAD_DISCARD_CONSEGNE."""
+        return [ROW_DISCARD(*row[:10]) for row in self.discard_consegne if row[10]]
+
+    def close_record_gaps(self, args: tuple) -> list:
+        """Serve QUERY_CLOSE_RECORD_GAPS, with the ids of the disabled messages as rows for the rowcount."""
+        keys = {(args[i + 1], args[i]) for i in range(0, len(args), 2)}
+        closed = [ROW_ID(msg_id) for msg_id, msg in self.messaggi.items()
+                  if msg['genere'] == 'GAP' and msg['stato'] and (msg['numero_documento'], msg['anno']) in keys]
+        for row in closed:
+            self.messaggi[row.id]['stato'] = False
+        return closed
+
+    def update_messaggi(self, args: tuple) -> list:
+        """Serve QUERY_UPDATE_MESSAGGI, also disabling the discarded record of the message as discard_sync_stato_trg does."""
+        self.messaggi[args[0]]['stato'] = False
+        self.discard_consegne = [(*row[:10], False) if row[8] == args[0] else row for row in self.discard_consegne]
+        return []
+
+    def load_checkpoint(self, args: tuple) -> list:
+        """Serve QUERY_LOAD_CHECKPOINT."""
+        checkpoint = self.checkpoint.get(args[0])
+        return [ROW_CHECKPOINT(*checkpoint[:3])] if checkpoint and checkpoint[3] else []
+
+    def save_checkpoint(self, args: tuple) -> list:
+        """Serve QUERY_SAVE_CHECKPOINT."""
+        self.checkpoint[args[0]] = (*args[1:], True)
+        return []
+
+    def close_checkpoint(self, args: tuple) -> list:
+        """Serve QUERY_CLOSE_CHECKPOINT."""
+        if args[0] in self.checkpoint:
+            self.checkpoint[args[0]] = (*self.checkpoint[args[0]][:3], False)
+        return []
+
+    def gap_ranges(self, args: tuple) -> list:
+        """Serve QUERY_GAP_RANGES."""
+        # sessione: per ogni anno i numeri registrati da args[0]
+        sessione = {}
+        for record in self.consegne:
+            if record[10] >= args[0]:
+                sessione.setdefault(record[2].year, []).append(record[0])
+
+        rows = []
+        for anno, numeri in sorted(sessione.items()):
+            saved = [numero for numero, _ in self.docs[anno]]
+            min_num, max_num = min(numeri), max(numeri)
+            rows.append(ROW_RANGE(
+                anno,
+                max((numero for numero in saved if numero < min_num), default=min_num),
+                min((numero for numero in saved if numero > max_num), default=max_num)
+            ))
+        return rows
+
+    def gap_numbers(self, args: tuple) -> list:
+        """Serve QUERY_GAP_NUMBERS, with the numbers of consegne and of the active discard and gap messages."""
+        anno, min_num, max_num = args[:3]
+        numbers = {numero for numero, _ in self.docs.get(anno, ()) if min_num <= numero <= max_num}
+        numbers.update(msg['numero_documento'] for msg in self.messaggi.values()
+                       if msg['genere'] in ('DISCARD', 'GAP') and msg['stato'] and msg['anno'] == anno and msg['numero_documento'] is not None and min_num <= msg['numero_documento'] <= max_num)
+        return [ROW_NUMERO(numero) for numero in numbers]
+
+    def overview_date(self, args: tuple) -> list:
+        """Serve QUERY_OVERVIEW_DATE."""
+        return [ROW_PERIOD(*period) for period in sorted({(record[2].year, record[2].month) for record in self.consegne if record[10] >= args[0]})]
+
+    def overview_data_many(self, args: tuple) -> list:
+        """Serve QUERY_OVERVIEW_DATA_MANY."""
+        rows = []
+        for i in range(0, len(args), 4):
+            anno, mese, inizio, fine = args[i:i + 4]
+            rows.extend(ROW_OVERVIEW(anno, mese, record[0], *record[2:8]) for record in sorted(self.consegne, key=lambda record: record[0]) if inizio <= record[6] < fine)
+        return rows
+
+
+class StandInCursor:
+    """Cursor of StandInDatabase with the subset of the pyodbc.Cursor interface used by the pipeline."""
+
+    def __init__(self, database: StandInDatabase) -> None:
+        self.database = database
+        self.connection = self
+        self.fast_executemany = False
+        self.arraysize = 1
+        self.rowcount = -1
+        self.rows = []
+
+    def execute(self, query: str, *args):
+        """Run a query with its parameters, given as a single sequence or as arguments."""
+        params = args[0] if len(args) == 1 and isinstance(args[0], (list, tuple)) else args
+        self.database.round_trips += 1
+        self.rows = self.database.handler(query)(tuple(params))
+        self.rowcount = len(self.rows)
+        return self
+
+    def executemany(self, query: str, args: list) -> None:
+        """Run a query once for every parameters set."""
+        self.database.round_trips += 1 if self.fast_executemany else len(args)
+        handler = self.database.handler(query)
+        for params in args:
+            handler(tuple(params))
+        self.rowcount = len(args)
+
+    def fetchone(self):
+        """Get the first row of the last query, or None."""
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self) -> list:
+        """Get the rows of the last query."""
+        return self.rows
+
+    def fetchmany(self, size: int = None) -> list:
+        """Get the next rows of the last query, arraysize rows by default."""
+        rows, self.rows = self.rows[:size or self.arraysize], self.rows[size or self.arraysize:]
+        return rows
+
+    def commit(self) -> None:
+        """Count the commit round-trip, the changes are applied at once."""
+        self.database.round_trips += 1
+
+    def rollback(self) -> None:
+        """Count the rollback round-trip, the changes are not reverted."""
+        self.database.round_trips += 1
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+@contextmanager
+def stand_in_session(cursor: StandInCursor, *args, **kwargs) -> Iterator[tuple[StandInCursor, StandInCursor]]:
+    """Replace sqlmng.conx_session() during the benchmark, always yielding the cursor of StandInDatabase.
+
+    :param StandInCursor cursor: The cursor of StandInDatabase, also used as its connection.
+    :return: A tuple with the cursor and the reference to connection.
+    """
+    yield cursor, cursor
+
+
+def pdf_build(pages: list[list[str]]) -> bytes:
+    """Write a minimal pdf document with a Helvetica text line for every string of every page.
+
+    :param list[list[str]] pages: The text lines of every page.
+    :return: The content of the pdf document.
+    """
+    # objs: oggetti del documento, il numero dell'oggetto è la posizione + 1
+    objs = [b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    for lines in pages:
+        text = [line.encode('cp1252').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') for line in lines]
+        stream = b'\n'.join([b'BT /F1 10 Tf 12 TL 40 800 Td', *[b'(' + line + b') Tj T*' for line in text], b'ET'])
+        objs.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+
+    # pages_id: numero dell'oggetto /Pages, dopo i contenuti e le pagine
+    pages_id = 2 * len(pages) + 2
+    page_ids = []
+    for content_id in range(2, len(pages) + 2):
+        objs.append(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R >>' % (pages_id, content_id))
+        page_ids.append(len(objs))
+    objs.append(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % page_id for page_id in page_ids), len(page_ids)))
+    objs.append(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for obj_id, obj in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (obj_id, obj)
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objs) + 1) + b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs) + 1, len(objs), xref)
+    return out
+
+
+def page_lines(numero: int, data: date, targa: str, is_discarded: bool, rng: random.Random) -> list[str]:
+    """Build the text lines of a DDT page in the layout expected by the extracting_doc patterns.
+
+    :param int numero: The doc number.
+    :param date data: The doc date.
+    :param str targa: The plate.
+    :param bool is_discarded: Leaves out the delivery place, so the page is discarded for PATTERN_SEDE.
+    :param Random rng: The random generator of the corpus.
+    :return: The text lines of the page.
+    """
+    ragione_sociale, indirizzo, cap, citta, provincia = rng.choice(CLIENTI)
+    lines = [f"Num. D.D.T. {numero:,}/AB Data D.D.T. {data.strftime('%d/%m/%Y')} Pag. 1".replace(',', '.')]
+    if not is_discarded:
+        lines += ['Luogo di consegna', ragione_sociale, indirizzo, f'{cap} {citta} ({provincia})']
+    lines += [
+        'Quantità Prezzo',
+        f"GASOLIO AUTOTRAZIONE L {rng.randrange(1000, 40000):,},000 1,245".replace(',', '.', 1),
+        'Peso soggetto accisa',
+        targa,
+        'Firma del conducente'
+    ]
+    return lines
+
+
+def plates_gnr(plates: int, seed: int) -> list[str]:
+    """Generate the plate registry, starting from TARGHE.
+
+    :param int plates: The number of plates.
+    :param int seed: The seed of the random generator.
+    :return: The plates, in registry order.
+    """
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHJKLMNPRSTVWXYZ'
+    res = dict.fromkeys(TARGHE[:plates])
+    while len(res) < plates:
+        res[''.join(rng.choice(letters) for _ in range(2)) + f'{rng.randrange(1000):0>3}' + ''.join(rng.choice(letters) for _ in range(2))] = None
+    return list(res)
+
+
+def corpus_gnr(path: str, targhe: list[str], docs: int, pages: int, discard_ratio: float, similarity_ratio: float, seed: int) -> list[str]:
+    """Generate the synthetic DDT documents of a month, with consecutive doc numbers.
+
+    :param str path: Path to the directory of the documents.
+    :param list targhe: The plates of the registry.
+    :param int docs: The number of documents.
+    :param int pages: The number of pages of every document.
+    :param float discard_ratio: The fraction of pages discarded for PATTERN_SEDE.
+    :param float similarity_ratio: The fraction of pages with a misread plate, corrected by check_similarity.
+    :param int seed: The seed of the random generator.
+    :return: The names of the documents.
+    """
+    rng = random.Random(seed)
+    names = []
+    for doc_num in range(docs):
+        first = doc_num * pages + 1
+        doc_pages = []
+        for numero in range(first, first + pages):
+            targa = rng.choice(targhe)
+            if rng.random() < similarity_ratio:
+                targa = targa[:3] + chr(ord('A') + rng.randrange(26)) + targa[4:]
+            doc_pages.append(page_lines(numero, date(2024, 1, 1 + numero % 28), targa, rng.random() < discard_ratio, rng))
+
+        names.append(f'2024_01_DDT_{first:0>4}_{first + pages - 1:0>4}.pdf')
+        with open(f'{path}/{names[-1]}', 'wb') as pou:
+            pou.write(pdf_build(doc_pages))
+    return names
+
+
+def peak_rss() -> int | None:
+    """Get the peak resident set size of the process and its terminated children.
+
+    :return: The peak RSS in kilobytes, or None if the platform doesn't provide it.
+    """
+    if not resource:
+        return None
+    # ru_maxrss è in byte su macOS e in kilobyte su Linux
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) // scale
+
+
+def bench_run(args: argparse.Namespace) -> dict:
+    """Run the recording pipeline on a generated corpus against StandInDatabase, timing every stage.
+
+    :param Namespace args: The command line options.
+    :return: The results of the run.
+    """
+    work = tempfile.mkdtemp(prefix='vanaheim_bench_')
+    for folder in ('DDTs', 'DDTs/discarded', 'DDTs/recorded', 'res', 'cache', 'log'):
+        os.makedirs(f'{work}/{folder}', exist_ok=True)
+
+    # reindirizzo i percorsi dei moduli nella cartella temporanea
+    recording_doc.PATH_LOG = f'{work}/log/bench.log'
+    recording_doc.PATH_WORKING_DIR = f'{work}/DDTs'
+    recording_doc.PATH_DISCARDED_DIR = f'{work}/DDTs/discarded'
+    recording_doc.PATH_RECORDED_DIR = f'{work}/DDTs/recorded'
+    recording_doc.PATH_FAILED_DIR = f'{work}/DDTs/failed'
+    recording_doc.RECORDING_CHECKPOINT_PAGES = args.checkpoint
+    overview_doc.PATH_LOG = f'{work}/log/bench.log'
+    overview_doc.PATH_RES = f'{work}/res'
+    overview_doc.PATH_SCHEME = PATH_SCHEME
+    caching_doc.PAGE_CACHE = recording_doc.PAGE_CACHE = caching_doc.PageCache(f'{work}/cache')
+
+    targhe = plates_gnr(args.plates, args.seed)
+    database = StandInDatabase(targhe)
+    cursor = StandInCursor(database)
+    sqlmng.conx_session = partial(stand_in_session, cursor)
+
+    docs = corpus_gnr(recording_doc.PATH_WORKING_DIR, targhe, args.docs, args.pages, args.discard_ratio, args.similarity_ratio, args.seed)
+    pool = recording_doc.ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+
+    # stages: durata e round-trip di ogni fase
+    stages = {}
+    perfmng.perf_snapshot(reset=True)
+    recording_begin = datetime.now()
+    for stage in ('recording', 'closing', 'overview', 'excel'):
+        round_trips = database.round_trips
+        start = time.perf_counter()
+        if stage == 'recording':
+            recorded = sum(recording_doc.doc_recording(doc, cursor, recording_begin, pool, recording_doc.duplicate_ini()) for doc in docs)
+        elif stage == 'closing':
+            periods = recording_doc.session_closing(cursor, recording_begin)
+        elif stage == 'overview':
+            failed = overview_doc.overview_batch(periods, args.overview_workers)
+        else:
+            xlsmng.write_excel(f'{work}/res/consegne.xlsx', database.consegne, 'consegne', write_only=True)
+        stages[stage] = {'seconds': time.perf_counter() - start, 'round_trips': database.round_trips - round_trips}
+
+    if pool:
+        pool.shutdown()
+    if not args.keep:
+        shutil.rmtree(work)
+
+    pages = args.docs * args.pages
+    return {
+        'bench': 'recording',
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'versions': {module.__name__: module.__version__ for module in (recording_doc, caching_doc, matching_doc, overview_doc, perfmng, sqlmng, xlsmng)},
+        'params': vars(args),
+        'pages': pages,
+        'recorded_docs': recorded,
+        'saved_records': len(database.consegne),
+        'discarded_records': len(database.discard_consegne),
+        'failed_overviews': failed,
+        'pages_per_sec': pages / stages['recording']['seconds'],
+        'round_trips_per_page': stages['recording']['round_trips'] / pages,
+        'cache': {'hits': caching_doc.PAGE_CACHE.hits, 'misses': caching_doc.PAGE_CACHE.misses},
+        'peak_rss_kb': peak_rss(),
+        'stages': stages,
+        'metrics': perfmng.perf_snapshot(),
+        'work_dir': work if args.keep else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the recording pipeline on synthetic DDTs and a local database stand-in.')
+    parser.add_argument('--docs', type=int, default=4, help='number of generated documents')
+    parser.add_argument('--pages', type=int, default=250, help='pages of every document')
+    parser.add_argument('--discard-ratio', type=float, default=0.05, help='fraction of pages discarded for PATTERN_SEDE')
+    parser.add_argument('--similarity-ratio', type=float, default=0.05, help='fraction of pages with a misread plate')
+    parser.add_argument('--plates', type=int, default=len(TARGHE), help='plates of the registry')
+    parser.add_argument('--workers', type=int, default=recording_doc.RECORDING_WORKERS, help='processes for the page extraction')
+    parser.add_argument('--overview-workers', type=int, default=1, help='processes for the overview rendering')
+    parser.add_argument('--checkpoint', type=int, default=recording_doc.RECORDING_CHECKPOINT_PAGES, help='pages saved in every transaction')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated corpus')
+    parser.add_argument('--output', default=PATH_RESULTS, help='directory of the json results')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory of the run')
+    args = parser.parse_args()
+    if args.docs * args.pages > 9999:
+        parser.error('the generated doc numbers must fit PATTERN_WORKING_DOC (docs * pages <= 9999)')
+
+    res = bench_run(args)
+    os.makedirs(args.output, exist_ok=True)
+    fou = f"{args.output}/recording_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(fou, 'w') as jou:
+        json.dump(res, jou, indent=2, default=str)
+
+    print(f"{res['pages']} pages in {res['stages']['recording']['seconds']:.2f}s: {res['pages_per_sec']:,.1f} pages/sec, "
+          f"{res['round_trips_per_page']:.2f} round-trips/page, peak RSS {res['peak_rss_kb']} KB [{fou}]")
+    # un'overview fallita esclude il suo costo dai tempi misurati, quindi il benchmark non è valido
+    if res['failed_overviews']:
+        print(f"failed overviews {res['failed_overviews']}, see the log of the run", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,258 @@
+from datetime import datetime
+from share import sshmng
+from threading import Event, Thread
+import argparse
+import filecmp
+import json
+import os
+import paramiko
+import random
+import shutil
+import socket
+import tempfile
+import time
+
+__version__ = '1.0.0'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_RESULTS = f'{PATH_PRJ}/bench/results'
+
+# STAND_IN_*: credenziali del server SFTP locale
+STAND_IN_USER = 'vanaheim'
+STAND_IN_PASSWORD = 'stand-in'
+
+
+class StandInServer(paramiko.ServerInterface):
+    """SSH server of the stand-in, accepting a single user by password and the sessions for the sftp subsystem."""
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        return paramiko.AUTH_SUCCESSFUL if (username, password) == (STAND_IN_USER, STAND_IN_PASSWORD) else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username: str) -> str:
+        return 'password'
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class StandInHandle(paramiko.SFTPHandle):
+    """Open file of the stand-in, delaying every read and write by the latency of the server."""
+
+    def __init__(self, path: str, flags: int, latency: float) -> None:
+        super().__init__(flags)
+        self.path = path
+        self.latency = latency
+
+    def read(self, offset: int, length: int) -> bytes | int:
+        time.sleep(self.latency)
+        return super().read(offset, length)
+
+    def write(self, offset: int, data: bytes) -> int:
+        time.sleep(self.latency)
+        return super().write(offset, data)
+
+    def stat(self) -> paramiko.SFTPAttributes | int:
+        return StandInSFTP.attributes(self.path)
+
+    def chattr(self, attr: paramiko.SFTPAttributes) -> int:
+        return StandInSFTP.set_attributes(self.path, attr)
+
+
+class StandInSFTP(paramiko.SFTPServerInterface):
+    """SFTP subsystem of the stand-in, serving a local directory as the remote root."""
+
+    def __init__(self, server: paramiko.ServerInterface, root: str, latency: float = 0.0) -> None:
+        super().__init__(server)
+        self.root = root
+        self.latency = latency
+
+    def local(self, path: str) -> str:
+        """Map a remote path into the served directory."""
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    @staticmethod
+    def attributes(path: str) -> paramiko.SFTPAttributes | int:
+        """Get the attributes of a local file, or the SFTP error code."""
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path), os.path.basename(path))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+    @staticmethod
+    def set_attributes(path: str, attr: paramiko.SFTPAttributes) -> int:
+        """Change the attributes of a local file, returning the SFTP status code."""
+        try:
+            paramiko.SFTPServer.set_file_attr(path, attr)
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def list_folder(self, path: str) -> list[paramiko.SFTPAttributes] | int:
+        try:
+            return [self.attributes(os.path.join(self.local(path), name)) for name in os.listdir(self.local(path))]
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+    def stat(self, path: str) -> paramiko.SFTPAttributes | int:
+        return self.attributes(self.local(path))
+
+    def lstat(self, path: str) -> paramiko.SFTPAttributes | int:
+        return self.attributes(self.local(path))
+
+    def open(self, path: str, flags: int, attr: paramiko.SFTPAttributes) -> paramiko.SFTPHandle | int:
+        mode = 'ab' if flags & os.O_APPEND else 'r+b' if flags & os.O_WRONLY or flags & os.O_RDWR else 'rb'
+        try:
+            fd = os.open(self.local(path), flags | getattr(os, 'O_BINARY', 0), 0o644)
+            handle = StandInHandle(self.local(path), flags, self.latency)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return handle
+
+    def remove(self, path: str) -> int:
+        return self.call(os.remove, self.local(path))
+
+    def rename(self, oldpath: str, newpath: str) -> int:
+        return self.call(os.rename, self.local(oldpath), self.local(newpath))
+
+    def posix_rename(self, oldpath: str, newpath: str) -> int:
+        return self.call(os.replace, self.local(oldpath), self.local(newpath))
+
+    def mkdir(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+        return self.call(os.mkdir, self.local(path))
+
+    def rmdir(self, path: str) -> int:
+        return self.call(os.rmdir, self.local(path))
+
+    def chattr(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+        return self.set_attributes(self.local(path), attr)
+
+    @staticmethod
+    def call(func, *args) -> int:
+        """Run a file system function, returning the SFTP status code."""
+        try:
+            func(*args)
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+
+def stand_in_start(root: str, latency: float, stop: Event) -> int:
+    """Start the SFTP stand-in on a free local port, serving every connection in a thread until stop is set.
+
+    :param str root: The served directory.
+    :param float latency: Seconds of delay of every read and write.
+    :param Event stop: The event which stops the server.
+    :return: The port of the server.
+    """
+    key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    listener.settimeout(0.5)
+
+    def serve() -> None:
+        while not stop.is_set():
+            try:
+                sock, _ = listener.accept()
+            except socket.timeout:
+                continue
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StandInSFTP, root=root, latency=latency)
+            transport.start_server(server=StandInServer())
+        listener.close()
+
+    Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def bench_run(args: argparse.Namespace) -> dict:
+    """Upload, download, skip and resume a directory of generated files against the SFTP stand-in.
+
+    :param Namespace args: The command line options.
+    :return: The results of the run.
+    """
+    work = tempfile.mkdtemp(prefix='vanaheim_sftp_')
+    for folder in ('local', 'remote', 'download'):
+        os.makedirs(f'{work}/{folder}')
+
+    # genero i file da trasferire, come pdf di dimensione casuale
+    rng = random.Random(args.seed)
+    for num in range(args.files):
+        with open(f'{work}/local/2024_01_DDT_{num + 1:0>4}_{num + 1:0>4}.pdf', 'wb') as fou:
+            fou.write(rng.randbytes(rng.randrange(args.size // 2, args.size * 3 // 2)))
+
+    stop = Event()
+    port = stand_in_start(f'{work}/remote', args.latency, stop)
+    sshmng.PATH_CFG = f'{work}/sshmng.json'
+    with open(sshmng.PATH_CFG, 'w') as jou:
+        json.dump([{
+            'name': 'bench', 'server': '127.0.0.1', 'port': port, 'username': STAND_IN_USER, 'password': STAND_IN_PASSWORD,
+            'host_keys': None, 'private_key': None
+        }], jou)
+
+    conn = sshmng.conn_session('bench')
+    runs = {}
+    try:
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            report = sshmng.sftp_upload_dir(conn, f'{work}/local', f'/w{workers}', '*.pdf', workers)
+            runs[f'upload_{workers}'] = {'seconds': time.perf_counter() - start, 'bytes': report['bytes'], 'transferred': len(report['transferred']), 'failed': len(report['failed'])}
+
+        # skip: i file invariati non vengono trasferiti di nuovo
+        start = time.perf_counter()
+        report = sshmng.sftp_upload_dir(conn, f'{work}/local', f'/w{args.workers}', '*.pdf', args.workers)
+        runs['skip'] = {'seconds': time.perf_counter() - start, 'skipped': len(report['skipped']), 'transferred': len(report['transferred'])}
+
+        # resume: un trasferimento interrotto a metà riprende dal file parziale
+        name = sorted(os.listdir(f'{work}/local'))[0]
+        source = os.stat(f'{work}/local/{name}')
+        os.remove(f'{work}/remote/w{args.workers}/{name}')
+        with open(f'{work}/local/{name}', 'rb') as fin, open(f'{work}/remote/w{args.workers}/{name}.{source.st_size}_{int(source.st_mtime)}.part', 'wb') as fou:
+            fou.write(fin.read(source.st_size // 2))
+        report = sshmng.sftp_upload_dir(conn, f'{work}/local', f'/w{args.workers}', '*.pdf', args.workers)
+        runs['resume'] = {'resumed': len(report['resumed']), 'bytes': report['bytes'], 'skipped': len(report['skipped'])}
+
+        start = time.perf_counter()
+        progress = {}
+        report = sshmng.sftp_download_dir(conn, f'/w{args.workers}', f'{work}/download', '*.pdf', args.workers, lambda fin, done, size: progress.__setitem__(fin, (done, size)))
+        runs[f'download_{args.workers}'] = {'seconds': time.perf_counter() - start, 'bytes': report['bytes'], 'transferred': len(report['transferred']), 'progress_complete': all(done == size for done, size in progress.values())}
+        mismatch = filecmp.cmpfiles(f'{work}/local', f'{work}/download', sorted(os.listdir(f'{work}/local')), shallow=False)[1:]
+    finally:
+        stop.set()
+        sshmng.sessions_close()
+        if not args.keep:
+            shutil.rmtree(work)
+
+    return {
+        'bench': 'sftp',
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'versions': {module.__name__: module.__version__ for module in (sshmng, paramiko)},
+        'params': vars(args),
+        'runs': runs,
+        'speedup': runs['upload_1']['seconds'] / runs[f'upload_{args.workers}']['seconds'],
+        'mismatch': [name for names in mismatch for name in names],
+        'work_dir': work if args.keep else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the SFTP transfers of sshmng against a local paramiko stand-in server.')
+    parser.add_argument('--files', type=int, default=24, help='number of generated files')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='average size in bytes of the generated files')
+    parser.add_argument('--workers', type=int, default=sshmng.SFTP_WORKERS, help='parallel SFTP channels')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds of delay of every read and write on the server')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated files')
+    parser.add_argument('--output', default=PATH_RESULTS, help='directory of the json results')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory of the run')
+    args = parser.parse_args()
+
+    res = bench_run(args)
+    os.makedirs(args.output, exist_ok=True)
+    fou = f"{args.output}/sftp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(fou, 'w') as jou:
+        json.dump(res, jou, indent=2, default=str)
+
+    print(f"{args.files} files: upload {res['runs']['upload_1']['seconds']:.2f}s with 1 channel, {res['runs'][f'upload_{args.workers}']['seconds']:.2f}s with {args.workers} "
+          f"({res['speedup']:.1f}x), {res['runs']['skip']['skipped']} skipped, {res['runs']['resume']['resumed']} resumed, {len(res['mismatch'])} mismatches [{fou}]")
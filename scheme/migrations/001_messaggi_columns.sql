@@ -0,0 +1,149 @@
+-- colonne strutturate di vanaheim.messaggi al posto del parsing di testo nelle viste
+BEGIN;
+
+ALTER TABLE vanaheim.messaggi
+    ADD COLUMN numero_documento INTEGER,
+    ADD COLUMN genere_documento CHAR(2),
+    ADD COLUMN data_documento DATE,
+    ADD COLUMN anno INTEGER,
+    ADD COLUMN sorgente VARCHAR(255),
+    ADD COLUMN pagina INTEGER,
+    ADD COLUMN errore VARCHAR(255);
+
+-- backfill dei messaggi DISCARD:
+-- 'Page %(page)d of doc %(doc)s discarded for error on %(pattern)s [numero: %(numero_documento)d, genere: %(genere_documento)s, data: %(data_documento)s]'
+UPDATE vanaheim.messaggi
+SET numero_documento = NULLIF(SUBSTRING(
+        testo,
+        STRPOS(testo, '[numero: ') + LENGTH('[numero: '),
+        STRPOS(testo, ', genere: ') - (STRPOS(testo, '[numero: ') + LENGTH('[numero: '))
+    ), 'None')::INTEGER,
+    genere_documento = NULLIF(SUBSTRING(
+        testo,
+        STRPOS(testo, ', genere: ') + LENGTH(', genere: '),
+        STRPOS(testo, ', data: ') - (STRPOS(testo, ', genere: ') + LENGTH(', genere: '))
+    ), 'None'),
+    data_documento = NULLIF(SUBSTRING(
+        testo,
+        STRPOS(testo, ', data: ') + LENGTH(', data: '),
+        STRPOS(testo, ']') - (STRPOS(testo, ', data: ') + LENGTH(', data: '))
+    ), 'None')::DATE,
+    errore = TRIM(SUBSTRING(
+        testo,
+        STRPOS(testo, 'for error on ') + LENGTH('for error on '),
+        STRPOS(testo, '[numero: ') - (STRPOS(testo, 'for error on ') + LENGTH('for error on '))
+    )),
+    sorgente = SUBSTRING(
+        testo,
+        STRPOS(testo, 'of doc ') + LENGTH('of doc '),
+        STRPOS(testo, ' discarded') - (STRPOS(testo, 'of doc ') + LENGTH('of doc '))
+    ),
+    pagina = SUBSTRING(
+        testo,
+        STRPOS(testo, 'Page ') + LENGTH('Page '),
+        STRPOS(testo, ' of doc ') - (STRPOS(testo, 'Page ') + LENGTH('Page '))
+    )::INTEGER
+WHERE genere = 'DISCARD';
+
+UPDATE vanaheim.messaggi
+SET anno = EXTRACT(YEAR FROM data_documento)::INTEGER
+WHERE genere = 'DISCARD';
+
+-- backfill dei messaggi GAP:
+-- 'Found gap for doc number %(numero_documento)d of year %(anno)d'
+UPDATE vanaheim.messaggi
+SET numero_documento = SUBSTRING(
+        testo,
+        STRPOS(testo, 'doc number ') + LENGTH('doc number '),
+        STRPOS(testo, ' of year ') - (STRPOS(testo, 'doc number ') + LENGTH('doc number '))
+    )::INTEGER,
+    anno = SUBSTRING(
+        testo,
+        STRPOS(testo, ' of year ') + LENGTH(' of year '),
+        LENGTH(testo)
+    )::INTEGER
+WHERE genere = 'GAP';
+
+-- backfill dei messaggi WARNING:
+-- 'Had similarity crash for %(targa)s on page %(page)d of doc %(doc)s'
+UPDATE vanaheim.messaggi
+SET sorgente = SUBSTRING(
+        testo,
+        STRPOS(testo, ' of doc ') + LENGTH(' of doc '),
+        LENGTH(testo)
+    ),
+    pagina = SUBSTRING(
+        testo,
+        STRPOS(testo, ' on page ') + LENGTH(' on page '),
+        STRPOS(testo, ' of doc ') - (STRPOS(testo, ' on page ') + LENGTH(' on page '))
+    )::INTEGER
+WHERE genere = 'WARNING'
+    AND testo LIKE 'Had similarity crash for %';
+
+CREATE INDEX messaggi_discard_idx ON vanaheim.messaggi (anno, numero_documento) WHERE genere = 'DISCARD' AND stato IS TRUE;
+CREATE INDEX messaggi_gap_idx ON vanaheim.messaggi (anno, numero_documento) WHERE genere = 'GAP' AND stato IS TRUE;
+
+-- le viste diventano select sulle colonne strutturate (consegne_gap_vw dipende da messaggi_discard_vw)
+DROP VIEW vanaheim.consegne_gap_vw;
+DROP VIEW vanaheim.messaggi_discard_vw;
+DROP VIEW vanaheim.messaggi_gap_vw;
+
+CREATE VIEW vanaheim.messaggi_discard_vw AS
+SELECT id,
+    numero_documento,
+    genere_documento,
+    data_documento,
+    anno,
+    errore,
+    sorgente,
+    pagina
+FROM vanaheim.messaggi
+WHERE genere = 'DISCARD'
+    AND stato IS TRUE;
+
+CREATE VIEW vanaheim.messaggi_gap_vw AS
+SELECT id,
+    numero_documento,
+    anno
+FROM vanaheim.messaggi
+WHERE genere = 'GAP'
+    AND stato IS TRUE;
+
+CREATE VIEW vanaheim.consegne_gap_vw AS
+WITH doc_nums AS (
+    SELECT dn.anno,
+        s.numero
+    FROM (
+        SELECT EXTRACT(YEAR FROM data_documento) anno,
+            MIN(numero_documento) min_num,
+            MAX(numero_documento) max_num
+        FROM vanaheim.consegne
+        GROUP BY EXTRACT(YEAR FROM data_documento)
+    ) dn,
+        GENERATE_SERIES(dn.min_num, dn.max_num, 1) s(numero)
+)
+SELECT d.numero,
+    d.anno,
+    (
+        SELECT DISTINCT EXTRACT(MONTH FROM data_documento) mese
+        FROM vanaheim.consegne
+        WHERE numero_documento < d.numero
+            AND EXTRACT(YEAR FROM data_documento) = d.anno
+        ORDER BY 1 DESC
+        LIMIT 1
+    ) mese,
+    CASE
+        WHEN m.numero_documento IS NOT NULL THEN TRUE
+        ELSE FALSE
+    END discarded
+FROM doc_nums d
+    LEFT JOIN vanaheim.consegne c
+        ON d.numero = c.numero_documento
+        AND d.anno = EXTRACT(YEAR FROM c.data_documento)
+    LEFT JOIN vanaheim.messaggi_discard_vw m
+        ON d.numero = m.numero_documento
+        AND d.anno = m.anno
+WHERE c.numero_documento IS NULL
+ORDER BY d.anno, d.numero;
+
+COMMIT;
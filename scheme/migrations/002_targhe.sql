@@ -0,0 +1,23 @@
+-- registro delle targhe dei mezzi, al posto dell'elenco fisso in recording_doc
+BEGIN;
+
+CREATE TABLE vanaheim.targhe (
+    id INTEGER GENERATED ALWAYS AS IDENTITY,
+    targa CHAR(7) NOT NULL,
+    descrizione VARCHAR(255),
+    stato BOOLEAN NOT NULL DEFAULT TRUE,
+    data_inserimento TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT targhe_id_pk
+        PRIMARY KEY (id),
+    CONSTRAINT targhe_targa_uq
+        UNIQUE (targa)
+);
+
+-- l'ordine di inserimento è l'ordine di preferenza di check_similarity a parità di somiglianza
+INSERT INTO vanaheim.targhe (targa)
+VALUES ('ES745WH'),
+    ('FC065ZW');
+
+GRANT SELECT, INSERT, UPDATE ON vanaheim.targhe TO vanaheim;
+
+COMMIT;
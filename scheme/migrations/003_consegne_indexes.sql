@@ -0,0 +1,55 @@
+-- anno generato e indici di vanaheim.consegne per i filtri per anno, periodo, sessione e duplicato delle query
+BEGIN;
+
+ALTER TABLE vanaheim.consegne
+    ADD COLUMN anno INTEGER GENERATED ALWAYS AS (EXTRACT(YEAR FROM data_documento)::INTEGER) STORED;
+
+-- gli indici univoci falliscono se esistono già dei duplicati, da cercare con:
+-- SELECT sorgente, pagina, COUNT(*) FROM vanaheim.consegne GROUP BY 1, 2 HAVING COUNT(*) > 1;
+-- SELECT anno, numero_documento, genere_documento, COUNT(*) FROM vanaheim.consegne GROUP BY 1, 2, 3 HAVING COUNT(*) > 1;
+CREATE UNIQUE INDEX consegne_sorgente_pagina_uq ON vanaheim.consegne (sorgente, pagina);
+CREATE UNIQUE INDEX consegne_anno_numero_genere_uq ON vanaheim.consegne (anno, numero_documento, genere_documento);
+CREATE INDEX consegne_data_documento_idx ON vanaheim.consegne (data_documento);
+CREATE INDEX consegne_data_consegna_idx ON vanaheim.consegne (data_consegna);
+CREATE INDEX consegne_data_registrazione_idx ON vanaheim.consegne (data_registrazione);
+
+-- anno della vista diventa INTEGER, quindi la vista va ricreata
+DROP VIEW vanaheim.consegne_gap_vw;
+CREATE VIEW vanaheim.consegne_gap_vw AS
+WITH doc_nums AS (
+    SELECT dn.anno,
+        s.numero
+    FROM (
+        SELECT anno,
+            MIN(numero_documento) min_num,
+            MAX(numero_documento) max_num
+        FROM vanaheim.consegne
+        GROUP BY anno
+    ) dn,
+        GENERATE_SERIES(dn.min_num, dn.max_num, 1) s(numero)
+)
+SELECT d.numero,
+    d.anno,
+    (
+        SELECT MAX(EXTRACT(MONTH FROM data_documento)) mese
+        FROM vanaheim.consegne
+        WHERE anno = d.anno
+            AND numero_documento < d.numero
+    ) mese,
+    CASE
+        WHEN m.numero_documento IS NOT NULL THEN TRUE
+        ELSE FALSE
+    END discarded
+FROM doc_nums d
+    LEFT JOIN vanaheim.consegne c
+        ON d.anno = c.anno
+        AND d.numero = c.numero_documento
+    LEFT JOIN vanaheim.messaggi_discard_vw m
+        ON d.numero = m.numero_documento
+        AND d.anno = m.anno
+WHERE c.numero_documento IS NULL
+ORDER BY d.anno, d.numero;
+
+ANALYZE vanaheim.consegne;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- checkpoint dei doc in registrazione, salvati nella stessa transazione dei record di vanaheim.consegne
+BEGIN;
+
+CREATE TABLE vanaheim.checkpoint_consegne (
+    sorgente VARCHAR(255) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    pagina INTEGER NOT NULL,
+    pagine_scartate INTEGER NOT NULL,
+    stato BOOLEAN NOT NULL DEFAULT TRUE,
+    data_checkpoint TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT checkpoint_consegne_sorgente_pk
+        PRIMARY KEY (sorgente),
+    CONSTRAINT checkpoint_consegne_pagina_chk
+        CHECK (pagina >= 0)
+);
+
+GRANT SELECT, INSERT, UPDATE ON vanaheim.checkpoint_consegne TO vanaheim;
+
+COMMIT;
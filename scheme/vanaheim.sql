@@ -15,6 +15,7 @@ CREATE TABLE vanaheim.consegne (
     sorgente VARCHAR(255),
     pagina INTEGER,
     data_registrazione TIMESTAMP NOT NULL DEFAULT NOW(),
+    anno INTEGER GENERATED ALWAYS AS (EXTRACT(YEAR FROM data_documento)::INTEGER) STORED,
     CONSTRAINT consegne_id_pk
         PRIMARY KEY (id),
     CONSTRAINT consegne_numero_documento_chk
@@ -27,6 +28,11 @@ CREATE TABLE vanaheim.consegne (
 
 CREATE INDEX consegne_ragione_sociale_idx ON vanaheim.consegne (ragione_sociale);
 CREATE INDEX consegne_sede_consegna_idx ON vanaheim.consegne (sede_consegna);
+CREATE UNIQUE INDEX consegne_sorgente_pagina_uq ON vanaheim.consegne (sorgente, pagina);
+CREATE UNIQUE INDEX consegne_anno_numero_genere_uq ON vanaheim.consegne (anno, numero_documento, genere_documento);
+CREATE INDEX consegne_data_documento_idx ON vanaheim.consegne (data_documento);
+CREATE INDEX consegne_data_consegna_idx ON vanaheim.consegne (data_consegna);
+CREATE INDEX consegne_data_registrazione_idx ON vanaheim.consegne (data_registrazione);
 
 CREATE TABLE vanaheim.messaggi (
     id INTEGER GENERATED ALWAYS AS IDENTITY,
@@ -34,11 +40,20 @@ CREATE TABLE vanaheim.messaggi (
     testo VARCHAR(255) NOT NULL,
     data_messaggio TIMESTAMP NOT NULL DEFAULT NOW(),
     stato BOOLEAN NOT NULL DEFAULT TRUE,
+    numero_documento INTEGER,
+    genere_documento CHAR(2),
+    data_documento DATE,
+    anno INTEGER,
+    sorgente VARCHAR(255),
+    pagina INTEGER,
+    errore VARCHAR(255),
     CONSTRAINT messaggi_id_pk
         PRIMARY KEY (id)
 );
 
 CREATE INDEX messaggi_testo_idx ON vanaheim.messaggi (testo);
+CREATE INDEX messaggi_discard_idx ON vanaheim.messaggi (anno, numero_documento) WHERE genere = 'DISCARD' AND stato IS TRUE;
+CREATE INDEX messaggi_gap_idx ON vanaheim.messaggi (anno, numero_documento) WHERE genere = 'GAP' AND stato IS TRUE;
 
 CREATE TABLE vanaheim.discard_consegne (
     id INTEGER GENERATED ALWAYS AS IDENTITY,
@@ -68,6 +83,36 @@ CREATE TABLE vanaheim.discard_consegne (
 CREATE INDEX discard_consegne_ragione_sociale_idx ON vanaheim.discard_consegne (ragione_sociale);
 CREATE INDEX discard_consegne_sede_consegna_idx ON vanaheim.discard_consegne (sede_consegna);
 
+CREATE TABLE vanaheim.checkpoint_consegne (
+    sorgente VARCHAR(255) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    pagina INTEGER NOT NULL,
+    pagine_scartate INTEGER NOT NULL,
+    stato BOOLEAN NOT NULL DEFAULT TRUE,
+    data_checkpoint TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT checkpoint_consegne_sorgente_pk
+        PRIMARY KEY (sorgente),
+    CONSTRAINT checkpoint_consegne_pagina_chk
+        CHECK (pagina >= 0)
+);
+
+CREATE TABLE vanaheim.targhe (
+    id INTEGER GENERATED ALWAYS AS IDENTITY,
+    targa CHAR(7) NOT NULL,
+    descrizione VARCHAR(255),
+    stato BOOLEAN NOT NULL DEFAULT TRUE,
+    data_inserimento TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT targhe_id_pk
+        PRIMARY KEY (id),
+    CONSTRAINT targhe_targa_uq
+        UNIQUE (targa)
+);
+
+-- l'ordine di inserimento è l'ordine di preferenza di check_similarity a parità di somiglianza
+INSERT INTO vanaheim.targhe (targa)
+VALUES ('ES745WH'),
+    ('FC065ZW');
+
 CREATE OR REPLACE FUNCTION vanaheim.discard_sync_stato()
 RETURNS TRIGGER AS $$
 BEGIN
@@ -109,52 +154,21 @@ ALTER DEFAULT PRIVILEGES IN SCHEMA vanaheim GRANT USAGE, SELECT ON SEQUENCES TO
 
 CREATE OR REPLACE VIEW vanaheim.messaggi_discard_vw AS
 SELECT id,
-    NULLIF(SUBSTRING(
-        testo,
-        STRPOS(testo, '[numero: ') + LENGTH('[numero: '),
-        STRPOS(testo, ', genere: ') - (STRPOS(testo, '[numero: ') + LENGTH('[numero: '))
-    ), 'None')::INTEGER numero_documento,
-    NULLIF(SUBSTRING(
-        testo,
-        STRPOS(testo, ', genere: ') + LENGTH(', genere: '),
-        STRPOS(testo, ', data: ') - (STRPOS(testo, ', genere: ') + LENGTH(', genere: '))
-    ), 'None') genere_documento,
-    NULLIF(SUBSTRING(
-        testo,
-        STRPOS(testo, ', data: ') + LENGTH(', data: '),
-        STRPOS(testo, ']') - (STRPOS(testo, ', data: ') + LENGTH(', data: '))
-    ), 'None')::DATE data_documento,
-    SUBSTRING(
-        testo,
-        STRPOS(testo, 'for error on ') + LENGTH('for error on '),
-        STRPOS(testo, '[numero: ') - (STRPOS(testo, 'for error on ') + LENGTH('for error on '))
-    ) errore,
-    SUBSTRING(
-        testo,
-        STRPOS(testo, 'of doc ') + LENGTH('of doc '),
-        STRPOS(testo, ' discarded') - (STRPOS(testo, 'of doc ') + LENGTH('of doc '))
-    ) sorgente,
-    SUBSTRING(
-        testo,
-        STRPOS(testo, 'Page ') + LENGTH('Page '),
-        STRPOS(testo, ' of doc ') - (STRPOS(testo, 'Page ') + LENGTH('Page '))
-    )::INTEGER pagina
+    numero_documento,
+    genere_documento,
+    data_documento,
+    anno,
+    errore,
+    sorgente,
+    pagina
 FROM vanaheim.messaggi
 WHERE genere = 'DISCARD'
     AND stato IS TRUE;
 
 CREATE OR REPLACE VIEW vanaheim.messaggi_gap_vw AS
 SELECT id,
-    SUBSTRING(
-        testo,
-        STRPOS(testo, 'doc number ') + LENGTH('doc number '),
-        STRPOS(testo, ' of year ') - (STRPOS(testo, 'doc number ') + LENGTH('doc number '))
-    )::INTEGER numero_documento,
-    SUBSTRING(
-        testo,
-        STRPOS(testo, ' of year ') + LENGTH(' of year '),
-        LENGTH(testo)
-    )::INTEGER anno
+    numero_documento,
+    anno
 FROM vanaheim.messaggi
 WHERE genere = 'GAP'
     AND stato IS TRUE;
@@ -164,23 +178,21 @@ WITH doc_nums AS (
     SELECT dn.anno,
         s.numero
     FROM (
-        SELECT EXTRACT(YEAR FROM data_documento) anno,
+        SELECT anno,
             MIN(numero_documento) min_num,
             MAX(numero_documento) max_num
         FROM vanaheim.consegne
-        GROUP BY EXTRACT(YEAR FROM data_documento)
+        GROUP BY anno
     ) dn,
         GENERATE_SERIES(dn.min_num, dn.max_num, 1) s(numero)
 )
 SELECT d.numero,
     d.anno,
     (
-        SELECT DISTINCT EXTRACT(MONTH FROM data_documento) mese
+        SELECT MAX(EXTRACT(MONTH FROM data_documento)) mese
         FROM vanaheim.consegne
-        WHERE numero_documento < d.numero
-            AND EXTRACT(YEAR FROM data_documento) = d.anno
-        ORDER BY 1 DESC
-        LIMIT 1
+        WHERE anno = d.anno
+            AND numero_documento < d.numero
     ) mese,
     CASE
         WHEN m.numero_documento IS NOT NULL THEN TRUE
@@ -188,10 +200,10 @@ SELECT d.numero,
     END discarded
 FROM doc_nums d
     LEFT JOIN vanaheim.consegne c
-        ON d.numero = c.numero_documento
-        AND d.anno = EXTRACT(YEAR FROM c.data_documento)
+        ON d.anno = c.anno
+        AND d.numero = c.numero_documento
     LEFT JOIN vanaheim.messaggi_discard_vw m
         ON d.numero = m.numero_documento
-        AND d.anno = EXTRACT(YEAR FROM m.data_documento)
+        AND d.anno = m.anno
 WHERE c.numero_documento IS NULL
 ORDER BY d.anno, d.numero;
@@ -1,41 +1,171 @@
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import parent_process
+from queue import SimpleQueue
+from threading import Lock
+import atexit
 import json
 import logging
+import os
 
-__version__ = '1.2.3'
+__version__ = '1.4.0'
+
+# LOG_LEVEL: livello dei logger, modificabile con VANAHEIM_LOG_LEVEL (es. DEBUG, WARNING)
+LOG_LEVEL = os.environ.get('VANAHEIM_LOG_LEVEL', 'INFO').upper()
+# LOG_FORMAT: formato dei log, 'text' oppure 'json' per un oggetto json per riga, modificabile con VANAHEIM_LOG_FORMAT
+LOG_FORMAT = os.environ.get('VANAHEIM_LOG_FORMAT', 'text').lower()
+# LOG_QUEUED: scrittura dei log da un thread in background, disattivabile con VANAHEIM_LOG_QUEUE=0
+LOG_QUEUED = os.environ.get('VANAHEIM_LOG_QUEUE', '1') != '0'
+
+# log_handlers: handler condivisi dai logger dello stesso file, come {file: handler}
+log_handlers: dict[str, logging.Handler] = {}
+# log_listeners: thread di scrittura dei log in coda, fermati all'uscita dal processo
+log_listeners: list[QueueListener] = []
+log_lock = Lock()
+
+# config_cache: file json già letti, come tuple (firma del file, oggetti, indici per chiave)
+config_cache: dict[str, tuple[tuple[int, int], list, dict[str, dict]]] = {}
+config_lock = Lock()
 
 
 def decode_json(fin: str, key: str, value: str) -> list | None:
     """Read a json file and return the objects which verify the condition {key: value}.
 
+    The file is parsed once and indexed by key, then parsed again only when its modification time or size changes.
+    The returned objects are shared with the cache and must not be modified.
+
     :param str fin: Path to the json file.
     :param str key: The key name to be verified.
     :param str value: The value to look for.
     :return: A list of matching objects in the file.
     """
-    with open(fin, 'r') as jin:
-        res = list(json.load(jin))
+    # stamp: firma del file, per riconoscerne le modifiche
+    stat = os.stat(fin)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with config_lock:
+        cached = config_cache.get(fin)
+    if not cached or cached[0] != stamp:
+        with open(fin, 'r') as jin:
+            cached = (stamp, list(json.load(jin)), {})
+        with config_lock:
+            config_cache[fin] = cached
+
+    _, objs, indexes = cached
+    with config_lock:
+        index = indexes.get(key)
+        if index is None:
+            index = indexes[key] = {}
+            for obj in objs:
+                index.setdefault(obj[key], []).append(obj)
+
+    res = index.get(value)
+    return list(res) if res else None
+
+
+def config_get(fin: str, name: str) -> dict | None:
+    """Get the configuration named name from a json file of configurations, as cached by decode_json().
+
+    :param str fin: Path to the json file.
+    :param str name: The configuration name.
+    :return: The first configuration with the given name, or None if there isn't.
+    """
+    config = decode_json(fin, 'name', name)
+    return config[0] if config else None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format the log records as json objects, one per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        res = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'name': record.name,
+            'level': record.levelname,
+            'process': record.process,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            res['exception'] = self.formatException(record.exc_info)
+        return json.dumps(res, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """Put the log records in a queue for a background QueueListener, leaving their formatting to the listener.
+
+    The arguments of the records are formatted by the listener thread, so they must not be modified after the logging
+    call. A process forked after the listener start writes its records directly, since the listener doesn't run there.
+    """
 
-    res = [obj for obj in res if obj[key] == value]
-    return res if res else None
+    def __init__(self, queue: SimpleQueue, target: logging.Handler) -> None:
+        super().__init__(queue)
+        self.target = target
+        self.pid = os.getpid()
 
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
-def logger_ini(fou: str, name: str = 'main', log_level: int | str = logging.INFO) -> logging.Logger:
+    def emit(self, record: logging.LogRecord) -> None:
+        if os.getpid() == self.pid:
+            super().emit(record)
+        else:
+            self.target.handle(record)
+
+
+def log_handler(fou: str, log_format: str = LOG_FORMAT, queued: bool = LOG_QUEUED) -> logging.Handler:
+    """Get the handler writing on a log file, shared by every logger of the process on the same file.
+
+    :param str fou: Path to the log file, with the '.jsonl' extension in place of its own for the json format.
+    :param str log_format: The format of the records, 'text' or 'json', defaults to LOG_FORMAT.
+    :param bool queued: Writes the records from a background thread, only in the main process, defaults to LOG_QUEUED.
+    :return: The handler, created if it doesn't exist.
+    """
+    if log_format == 'json':
+        fou = f'{os.path.splitext(fou)[0]}.jsonl'
+
+    with log_lock:
+        handler = log_handlers.get(fou)
+        if handler:
+            return handler
+
+        handler = logging.FileHandler(fou, encoding='utf-8' if log_format == 'json' else None)
+        handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(
+            '%(asctime)s [%(name)s] %(levelname)s - %(message)s',
+            '%d/%m/%Y %H:%M:%S'
+        ))
+
+        # i processi del pool scrivono direttamente, la loro coda non verrebbe svuotata all'uscita
+        if queued and parent_process() is None:
+            queue = SimpleQueue()
+            listener = QueueListener(queue, handler)
+            listener.start()
+            if not log_listeners:
+                atexit.register(logger_stop)
+            log_listeners.append(listener)
+            handler = LogQueueHandler(queue, handler)
+
+        log_handlers[fou] = handler
+    return handler
+
+
+def logger_ini(fou: str, name: str = 'main', log_level: int | str = LOG_LEVEL, log_format: str = LOG_FORMAT, queued: bool = LOG_QUEUED) -> logging.Logger:
     """Initialize a new logger object with custom properties.
 
     :param str fou: Path to the log file.
     :param str name: Name of the logger, defaults to 'main'.
-    :param int or str log_level: Logging level, defaults to INFO.
+    :param int or str log_level: Logging level, defaults to LOG_LEVEL.
+    :param str log_format: The format of the records, 'text' or 'json', defaults to LOG_FORMAT.
+    :param bool queued: Writes the records from a background thread, defaults to LOG_QUEUED.
     :return: The logger, created if it doesn't exist.
     """
     logger = logging.getLogger(name)
     if not len(logger.handlers):
         logger.setLevel(log_level)
+        logger.addHandler(log_handler(fou, log_format, queued))
+    return logger
 
-        handler = logging.FileHandler(fou)
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s [%(name)s] %(levelname)s - %(message)s',
-            '%d/%m/%Y %H:%M:%S'
-        ))
 
-        logger.addHandler(handler)
-    return logger
+def logger_stop() -> None:
+    """Write the queued log records and stop the background listeners, called at the process exit."""
+    with log_lock:
+        while log_listeners:
+            log_listeners.pop().stop()
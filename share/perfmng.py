@@ -0,0 +1,116 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from threading import Lock
+import cProfile
+import json
+import time
+
+__version__ = '1.0.0'
+
+# metrics: tempi e contatori del processo, come {fase: [secondi, chiamate]} e {contatore: valore}
+metrics = {'timers': {}, 'counters': {}}
+metrics_lock = Lock()
+
+
+def perf_add(stage: str, start: float) -> None:
+    """Add to the timer of a stage the time elapsed since start, for the hot paths where a with block costs too much.
+
+    :param str stage: The stage name.
+    :param float start: The starting time, achieved from time.perf_counter().
+    """
+    elapsed = time.perf_counter() - start
+    with metrics_lock:
+        timer = metrics['timers'].setdefault(stage, [0.0, 0])
+        timer[0] += elapsed
+        timer[1] += 1
+
+
+@contextmanager
+def perf_timer(stage: str) -> Iterator[None]:
+    """Time a with block into the timer of a stage, also when the block raises.
+
+    :param str stage: The stage name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        perf_add(stage, start)
+
+
+def perf_count(counter: str, value: int = 1) -> None:
+    """Increment a counter.
+
+    :param str counter: The counter name.
+    :param int value: The increment, defaults to 1.
+    """
+    with metrics_lock:
+        metrics['counters'][counter] = metrics['counters'].get(counter, 0) + value
+
+
+def perf_snapshot(reset: bool = False) -> dict:
+    """Get a copy of the timers and counters of the process.
+
+    :param bool reset: Clears the timers and counters after the copy, defaults to False.
+    :return: A dictionary with the timers as {stage: [seconds, calls]} and the counters as {counter: value}.
+    """
+    with metrics_lock:
+        snapshot = {'timers': {stage: list(timer) for stage, timer in metrics['timers'].items()}, 'counters': dict(metrics['counters'])}
+        if reset:
+            metrics['timers'].clear()
+            metrics['counters'].clear()
+    return snapshot
+
+
+def perf_merge(snapshot: dict) -> None:
+    """Add the timers and counters of another process, as returned by its perf_snapshot().
+
+    :param dict snapshot: The timers and counters to be added.
+    """
+    with metrics_lock:
+        for stage, (seconds, calls) in snapshot['timers'].items():
+            timer = metrics['timers'].setdefault(stage, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+        for counter, value in snapshot['counters'].items():
+            metrics['counters'][counter] = metrics['counters'].get(counter, 0) + value
+
+
+def perf_dump(fou: str, info: dict = None, reset: bool = True) -> dict:
+    """Write the timers and counters of the process into a json file.
+
+    :param str fou: Path to the json file.
+    :param dict info: Other values to be written with the metrics, defaults to None.
+    :param bool reset: Clears the timers and counters after the dump, defaults to True.
+    :return: The written metrics.
+    """
+    snapshot = perf_snapshot(reset)
+    res = {
+        **(info or {}),
+        'timers': {stage: {'seconds': round(seconds, 6), 'calls': calls} for stage, (seconds, calls) in sorted(snapshot['timers'].items())},
+        'counters': dict(sorted(snapshot['counters'].items()))
+    }
+
+    with open(fou, 'w') as jou:
+        json.dump(res, jou, indent=2, default=str)
+    return res
+
+
+@contextmanager
+def perf_profile(fou: str, enabled: bool = True) -> Iterator[None]:
+    """Run a with block under cProfile and save the statistics for pstats or snakeviz.
+
+    :param str fou: Path to the statistics file.
+    :param bool enabled: Enables the profiler, otherwise the block runs as is, defaults to True.
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(fou)
@@ -1,11 +1,36 @@
-from share.common import decode_json
+from collections.abc import Iterator
+from contextlib import contextmanager
+from share.common import config_get
+from share.perfmng import perf_add, perf_count
+from threading import Lock
+import atexit
 import pyodbc
+import time
 
-__version__ = '1.3.1'
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__version__ = '1.7.0'
 
 PATH_PRJ = 'c:/source/vanaheim'
 PATH_CFG = f'{PATH_PRJ}/config/sqlmng.json'
 
+# POOL_SIZE: numero massimo di connessioni inattive conservate per ogni configurazione
+POOL_SIZE = 4
+# POOL_IDLE_CHECK: secondi di inattività oltre i quali una connessione viene verificata prima del riuso
+POOL_IDLE_CHECK = 30
+
+# FETCH_SIZE: numero di righe lette dal cursore per ogni fetchmany() delle letture in streaming
+FETCH_SIZE = 1000
+
+QUERY_PING = 'SELECT 1;'
+
+# pool: connessioni inattive per nome configurazione, come tuple (connessione, istante di rilascio)
+pool: dict[str, list[tuple[pyodbc.Connection, float]]] = {}
+pool_lock = Lock()
+
 
 def conx_ini(conn_name: str = 'main', save_changes: bool = False) -> tuple[pyodbc.Cursor, pyodbc.Connection]:
     """Read from config/sqlmng.json the database configuration and start the connection.
@@ -14,20 +39,118 @@ def conx_ini(conn_name: str = 'main', save_changes: bool = False) -> tuple[pyodb
     :param bool save_changes: Enables or disables the auto-commit, defaults to False.
     :return: A tuple with the cursor and the reference to connection.
     """
-    config = decode_json(PATH_CFG, 'name', conn_name)
+    conx = conx_open(conn_name, save_changes)
+    return conx.cursor(), conx
+
+
+def conx_open(conn_name: str = 'main', save_changes: bool = False) -> pyodbc.Connection:
+    """Read from config/sqlmng.json the database configuration and open a new connection.
+
+    The optional "options" object of the configuration is added to the connection string, e.g. UseDeclareFetch and
+    Fetch for the PostgreSQL driver, which otherwise reads the whole result of a query before the first fetch.
+
+    :param str conn_name: Refers to the database configuration name in sqlmng.json, defaults to 'main'.
+    :param bool save_changes: Enables or disables the auto-commit, defaults to False.
+    :return: The new connection.
+    """
+    config = config_get(PATH_CFG, conn_name)
     if not config:
-        raise ValueError(f'conx_ini: no config <{conn_name}> found!')
-
-    conx = pyodbc.connect(
-        driver=f"{{{config[0]['driver']}}}",
-        server=config[0]['server'],
-        port=config[0]['port'],
-        database=config[0]['database'],
-        user=config[0]['user'],
-        password=config[0]['password'],
-        autocommit=save_changes
+        raise ValueError(f'conx_open: no config <{conn_name}> found!')
+
+    return pyodbc.connect(
+        driver=f"{{{config['driver']}}}",
+        server=config['server'],
+        port=config['port'],
+        database=config['database'],
+        user=config['user'],
+        password=config['password'],
+        autocommit=save_changes,
+        **config.get('options', {})
     )
-    return conx.cursor(), conx
+
+
+@contextmanager
+def conx_session(conn_name: str = 'main', save_changes: bool = False) -> Iterator[tuple[pyodbc.Cursor, pyodbc.Connection]]:
+    """Borrow a connection from the pool of the configuration for the duration of a with block.
+
+    The connection is opened only if the pool has no valid idle connection. On exit the cursor is closed, the pending
+    transaction is rolled back and the connection goes back to the pool, or is closed if it's broken or the pool is full.
+
+    :param str conn_name: Refers to the database configuration name in sqlmng.json, defaults to 'main'.
+    :param bool save_changes: Enables or disables the auto-commit, defaults to False.
+    :return: A tuple with the cursor and the reference to connection.
+    """
+    conx = conx_acquire(conn_name)
+    conx.autocommit = save_changes
+    cursor = conx.cursor()
+    try:
+        yield cursor, conx
+    finally:
+        try:
+            cursor.close()
+            conx.rollback()
+        except pyodbc.Error:
+            conx_discard(conx)
+        else:
+            conx_release(conn_name, conx)
+
+
+def conx_acquire(conn_name: str = 'main') -> pyodbc.Connection:
+    """Take an idle connection from the pool of the configuration, or open a new one.
+
+    A connection idle for more than POOL_IDLE_CHECK seconds is verified with QUERY_PING before being reused.
+
+    :param str conn_name: Refers to the database configuration name in sqlmng.json, defaults to 'main'.
+    :return: A valid connection.
+    """
+    while True:
+        with pool_lock:
+            conx, released = pool[conn_name].pop() if pool.get(conn_name) else (None, None)
+        if not conx:
+            return conx_open(conn_name)
+        if time.monotonic() - released < POOL_IDLE_CHECK:
+            return conx
+
+        try:
+            conx.execute(QUERY_PING).fetchall()
+            return conx
+        except pyodbc.Error:
+            conx_discard(conx)
+
+
+def conx_release(conn_name: str, conx: pyodbc.Connection) -> None:
+    """Give back a connection to the pool of the configuration, closing it if the pool is full.
+
+    :param str conn_name: Refers to the database configuration name in sqlmng.json.
+    :param Connection conx: The connection achieved from conx_acquire() calling.
+    """
+    with pool_lock:
+        idle = pool.setdefault(conn_name, [])
+        if len(idle) < POOL_SIZE:
+            idle.append((conx, time.monotonic()))
+            return
+    conx_discard(conx)
+
+
+def conx_discard(conx: pyodbc.Connection) -> None:
+    """Close a connection ignoring the errors of an already broken connection.
+
+    :param Connection conx: The connection to be closed.
+    """
+    try:
+        conx.close()
+    except pyodbc.Error:
+        pass
+
+
+@atexit.register
+def pool_close() -> None:
+    """Close every idle connection of the pool, called at the process exit."""
+    with pool_lock:
+        idle = [conx for conns in pool.values() for conx, _ in conns]
+        pool.clear()
+    for conx in idle:
+        conx_discard(conx)
 
 
 def conx_read(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None) -> pyodbc.Cursor:
@@ -38,7 +161,12 @@ def conx_read(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None
     :param list or set or tuple args: The parameters list of the query string, defaults to None.
     :return: The cursor with values.
     """
-    return cursor.execute(query, args) if args else cursor.execute(query)
+    start = time.perf_counter()
+    cursor = cursor.execute(query, args) if args else cursor.execute(query)
+
+    perf_add('db_read', start)
+    perf_count('db_round_trips')
+    return cursor
 
 
 def conx_write(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None) -> int:
@@ -49,7 +177,111 @@ def conx_write(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = Non
     :param list or set or tuple args: The parameters list of the query string, defaults to None.
     :return: The number of affected rows.
     """
-    return cursor.execute(query, args).rowcount if args else cursor.execute(query).rowcount
+    start = time.perf_counter()
+    rowcount = cursor.execute(query, args).rowcount if args else cursor.execute(query).rowcount
+
+    perf_add('db_write', start)
+    perf_count('db_round_trips')
+    return rowcount
+
+
+def conx_write_many(cursor: pyodbc.Cursor, query: str, args: list, fast: bool = False) -> int:
+    """Execute a DML query on the database once for every parameters set of the list, in the current transaction.
+
+    :param Cursor cursor: The cursor achieved from conx_ini() calling.
+    :param str query: Query string to be executed.
+    :param list args: The list of parameters sets of the query string.
+    :param bool fast: Enables the driver parameter arrays (fast_executemany), defaults to False.
+    :return: The number of affected rows, or -1 if the driver doesn't provide it.
+    """
+    if not args:
+        return 0
+
+    start = time.perf_counter()
+    cursor.fast_executemany = fast
+    cursor.executemany(query, args)
+
+    perf_add('db_write', start)
+    # senza fast_executemany il driver esegue la query una volta per ogni set di parametri
+    perf_count('db_round_trips', 1 if fast else len(args))
+    return cursor.rowcount
+
+
+def conx_commit(cursor: pyodbc.Cursor) -> None:
+    """Commit the current transaction of the cursor connection.
+
+    :param Cursor cursor: The cursor achieved from conx_ini() calling.
+    """
+    start = time.perf_counter()
+    cursor.commit()
+
+    perf_add('db_commit', start)
+    perf_count('db_round_trips')
+
+
+def conx_batches(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None, arraysize: int = FETCH_SIZE, columnar: bool = False) -> Iterator[list[pyodbc.Row] | dict[str, list]]:
+    """Execute a DQL query on the database (SELECT) and yield its rows in batches of arraysize rows.
+
+    :param Cursor cursor: The cursor achieved from conx_ini() calling.
+    :param str query: Query string to be executed.
+    :param list or set or tuple args: The parameters list of the query string, defaults to None.
+    :param int arraysize: Number of rows of every batch, defaults to FETCH_SIZE constant.
+    :param bool columnar: Yields every batch as {column name: values list} instead of a list of rows, defaults to False.
+    :return: The batches of rows, to be consumed before the next query on the same cursor.
+    """
+    cursor = conx_read(cursor, query, args)
+    cursor.arraysize = arraysize
+    header = conx_header(cursor) if columnar else None
+
+    while True:
+        start = time.perf_counter()
+        rows = cursor.fetchmany(arraysize)
+        perf_add('db_fetch', start)
+        if not rows:
+            return
+
+        yield dict(zip(header, map(list, zip(*rows)))) if columnar else rows
+
+
+def conx_stream(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None, arraysize: int = FETCH_SIZE) -> Iterator[pyodbc.Row]:
+    """Execute a DQL query on the database (SELECT) and yield its rows one at a time, fetched in batches of arraysize rows.
+
+    :param Cursor cursor: The cursor achieved from conx_ini() calling.
+    :param str query: Query string to be executed.
+    :param list or set or tuple args: The parameters list of the query string, defaults to None.
+    :param int arraysize: Number of rows fetched at a time, defaults to FETCH_SIZE constant.
+    :return: The rows, to be consumed before the next query on the same cursor.
+    """
+    for rows in conx_batches(cursor, query, args, arraysize):
+        yield from rows
+
+
+def conx_columns(cursor: pyodbc.Cursor, query: str, args: list | set | tuple = None, arraysize: int = FETCH_SIZE, as_numpy: bool = False) -> dict:
+    """Execute a DQL query on the database (SELECT) and get its result by column, for reports and exports.
+
+    The rows are fetched in batches of arraysize rows and moved into the columns batch by batch, so the result is never
+    held also as pyodbc rows.
+
+    :param Cursor cursor: The cursor achieved from conx_ini() calling.
+    :param str query: Query string to be executed.
+    :param list or set or tuple args: The parameters list of the query string, defaults to None.
+    :param int arraysize: Number of rows fetched at a time, defaults to FETCH_SIZE constant.
+    :param bool as_numpy: Gets every column as numpy array with the dtype inferred by numpy, defaults to False.
+    :return: A dictionary {column name: values}, with empty columns if there isn't rows, so the column names must be distinct.
+    """
+    if as_numpy and numpy is None:
+        raise ValueError('conx_columns: numpy not installed!')
+
+    res = None
+    for batch in conx_batches(cursor, query, args, arraysize, columnar=True):
+        if res is None:
+            res = batch
+        else:
+            for name, values in batch.items():
+                res[name].extend(values)
+    res = res if res is not None else {name: [] for name in conx_header(cursor)}
+
+    return {name: numpy.array(values) for name, values in res.items()} if as_numpy else res
 
 
 def conx_header(cursor: pyodbc.Cursor) -> list[str] | None:
@@ -1,12 +1,28 @@
-from share.common import decode_json
-import paramiko
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from share.common import config_get
+from threading import Lock, local
+import atexit
+import fnmatch
 import os
+import paramiko
+import posixpath
+import stat
 
-__version__ = '1.0.0'
+__version__ = '1.2.0'
 
 PATH_PRJ = 'c:/source/vanaheim'
 PATH_CFG = f'{PATH_PRJ}/config/sshmng.json'
 
+# SFTP_WORKERS: numero di canali SFTP paralleli sulla stessa sessione SSH per il trasferimento di più file
+SFTP_WORKERS = 4
+# SFTP_BLOCK_SIZE: byte letti e scritti per volta durante un trasferimento
+SFTP_BLOCK_SIZE = 256 * 1024
+
+# sessions: connessioni SSH aperte per nome configurazione, riusate finché il trasporto è attivo
+sessions: dict[str, paramiko.SSHClient] = {}
+sessions_lock = Lock()
+
 
 def conn_ini(conn_name: str = 'main') -> paramiko.SSHClient:
     """Read from config/sshmng.json the SSH configuration and start the connection.
@@ -14,35 +30,65 @@ def conn_ini(conn_name: str = 'main') -> paramiko.SSHClient:
     :param str conn_name: Refers to SSH configuration name in sshmng.json, defaults to 'main'.
     :return: A reference to the SSH connection.
     """
-    config = decode_json(PATH_CFG, 'name', conn_name)
+    config = config_get(PATH_CFG, conn_name)
     if not config:
         raise ValueError(f'conn_ini: no config <{conn_name}> found!')
 
     conn = paramiko.SSHClient()
 
-    if config[0]['host_keys'] and os.path.exists(config[0]['host_keys']):
-        conn.load_host_keys(config[0]['host_keys'])
+    if config['host_keys'] and os.path.exists(config['host_keys']):
+        conn.load_host_keys(config['host_keys'])
     else:
         conn.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
-    if config[0]['private_key'] and os.path.exists(config[0]['private_key']):
+    if config['private_key'] and os.path.exists(config['private_key']):
         conn.connect(
-            hostname=config[0]['server'],
-            port=config[0]['port'],
-            username=config[0]['username'],
-            pkey=paramiko.RSAKey.from_private_key_file(config[0]['private_key'])
+            hostname=config['server'],
+            port=config['port'],
+            username=config['username'],
+            pkey=paramiko.RSAKey.from_private_key_file(config['private_key'])
         )
     else:
         conn.connect(
-            hostname=config[0]['server'],
-            port=config[0]['port'],
-            username=config[0]['username'],
-            password=config[0]['password']
+            hostname=config['server'],
+            port=config['port'],
+            username=config['username'],
+            password=config['password']
         )
 
     return conn
 
 
+def conn_session(conn_name: str = 'main') -> paramiko.SSHClient:
+    """Get the open SSH connection of the configuration, starting it only if it's missing or closed.
+
+    The connection is shared by the callers of the process and closed at the process exit.
+
+    :param str conn_name: Refers to SSH configuration name in sshmng.json, defaults to 'main'.
+    :return: A reference to the SSH connection.
+    """
+    with sessions_lock:
+        conn = sessions.get(conn_name)
+        transport = conn.get_transport() if conn else None
+        if transport and transport.is_active():
+            return conn
+        if conn:
+            conn.close()
+
+        conn = sessions[conn_name] = conn_ini(conn_name)
+    return conn
+
+
+@atexit.register
+def sessions_close() -> None:
+    """Close every open SSH connection of conn_session(), called at the process exit."""
+    with sessions_lock:
+        conns = list(sessions.values())
+        sessions.clear()
+    for conn in conns:
+        conn.close()
+
+
 def sftp_upload(conn: paramiko.SSHClient, local: str, remote: str) -> None:
     """Upload file on SFTP server.
 
@@ -50,9 +96,9 @@ def sftp_upload(conn: paramiko.SSHClient, local: str, remote: str) -> None:
     :param str local: The local file path.
     :param str remote: The remote file path, including filename.
     """
-    sftp = conn.open_sftp()
-    sftp.put(local, remote)
-    sftp.close()
+    res = sftp_transfer(conn, [(local, remote)], upload=True, workers=1)
+    if res['failed']:
+        raise res['failed'][local]
 
 
 def sftp_download(conn: paramiko.SSHClient, remote: str, local: str) -> None:
@@ -62,6 +108,160 @@ def sftp_download(conn: paramiko.SSHClient, remote: str, local: str) -> None:
     :param remote: The remote file path.
     :param local: The local file path, including filename.
     """
+    res = sftp_transfer(conn, [(remote, local)], upload=False, workers=1)
+    if res['failed']:
+        raise res['failed'][remote]
+
+
+def sftp_upload_dir(conn: paramiko.SSHClient, local_dir: str, remote_dir: str, pattern: str = '*', workers: int = SFTP_WORKERS,
+                    progress: Callable[[str, int, int], None] = None) -> dict:
+    """Upload the files of a local directory matching a pattern (e.g. '*.pdf', '*.xlsx') into a remote directory.
+
+    :param SSHClient conn: The connection achieved from conn_ini() or conn_session() calling.
+    :param str local_dir: The local directory path.
+    :param str remote_dir: The remote directory path, created if it doesn't exist.
+    :param str pattern: The pattern of the file names, defaults to '*'.
+    :param int workers: Number of parallel SFTP channels, defaults to SFTP_WORKERS constant.
+    :param Callable progress: Called as progress(file, transferred bytes, total bytes) after every block, defaults to None.
+    :return: The transfer report from sftp_transfer().
+    """
+    names = sorted(entry.name for entry in os.scandir(local_dir) if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
+
+    sftp = conn.open_sftp()
+    try:
+        sftp.stat(remote_dir)
+    except FileNotFoundError:
+        sftp.mkdir(remote_dir)
+    sftp.close()
+
+    return sftp_transfer(conn, [(f'{local_dir}/{name}', posixpath.join(remote_dir, name)) for name in names], True, workers, progress)
+
+
+def sftp_download_dir(conn: paramiko.SSHClient, remote_dir: str, local_dir: str, pattern: str = '*', workers: int = SFTP_WORKERS,
+                      progress: Callable[[str, int, int], None] = None) -> dict:
+    """Download the files of a remote directory matching a pattern (e.g. '*.pdf', '*.xlsx') into a local directory.
+
+    :param SSHClient conn: The connection achieved from conn_ini() or conn_session() calling.
+    :param str remote_dir: The remote directory path.
+    :param str local_dir: The local directory path, created if it doesn't exist.
+    :param str pattern: The pattern of the file names, defaults to '*'.
+    :param int workers: Number of parallel SFTP channels, defaults to SFTP_WORKERS constant.
+    :param Callable progress: Called as progress(file, transferred bytes, total bytes) after every block, defaults to None.
+    :return: The transfer report from sftp_transfer().
+    """
     sftp = conn.open_sftp()
-    sftp.get(remote, local)
+    names = sorted(attr.filename for attr in sftp.listdir_attr(remote_dir) if stat.S_ISREG(attr.st_mode) and fnmatch.fnmatch(attr.filename, pattern) and not attr.filename.endswith('.part'))
     sftp.close()
+    os.makedirs(local_dir, exist_ok=True)
+
+    return sftp_transfer(conn, [(posixpath.join(remote_dir, name), f'{local_dir}/{name}') for name in names], False, workers, progress)
+
+
+def sftp_transfer(conn: paramiko.SSHClient, files: Iterable[tuple[str, str]], upload: bool = True, workers: int = SFTP_WORKERS,
+                  progress: Callable[[str, int, int], None] = None) -> dict:
+    """Transfer many files over parallel SFTP channels of the same SSH connection.
+
+    A file whose target already has the same size and modification time is skipped. A file is written into a '.part'
+    file named after the size and modification time of the source, renamed to the target when complete, so an
+    interrupted transfer of an unchanged file continues from the bytes already written. The target gets the
+    modification time of the source.
+
+    :param SSHClient conn: The connection achieved from conn_ini() or conn_session() calling.
+    :param Iterable files: The files as tuples (source path, target path), local to remote on upload.
+    :param bool upload: Uploads the files if True, downloads them if False, defaults to True.
+    :param int workers: Number of parallel SFTP channels, defaults to SFTP_WORKERS constant.
+    :param Callable progress: Called as progress(file, transferred bytes, total bytes) after every block, defaults to None.
+    :return: A dictionary with the sources 'transferred', 'resumed' and 'skipped', the 'failed' ones with their exception and the transferred 'bytes'.
+    """
+    files = list(files)
+    res = {'transferred': [], 'resumed': [], 'skipped': [], 'failed': {}, 'bytes': 0}
+    res_lock = Lock()
+    # channels: canale SFTP di ogni thread, aperto al primo file del thread
+    channels = local()
+    opened = []
+
+    def transfer(source: str, target: str) -> None:
+        if not hasattr(channels, 'sftp'):
+            channels.sftp = conn.open_sftp()
+            with res_lock:
+                opened.append(channels.sftp)
+        try:
+            outcome, size = sftp_file(channels.sftp, source, target, upload, progress)
+        except (OSError, paramiko.SSHException) as err:
+            with res_lock:
+                res['failed'][source] = err
+            return
+        with res_lock:
+            res[outcome].append(source)
+            res['bytes'] += size
+
+    try:
+        if workers > 1 and len(files) > 1:
+            with ThreadPoolExecutor(min(workers, len(files))) as pool:
+                list(pool.map(lambda paths: transfer(*paths), files))
+        else:
+            for source, target in files:
+                transfer(source, target)
+    finally:
+        for sftp in opened:
+            sftp.close()
+
+    return res
+
+
+def sftp_file(sftp: paramiko.SFTPClient, source: str, target: str, upload: bool, progress: Callable[[str, int, int], None] = None,
+              part_dir: str = None) -> tuple[str, int]:
+    """Transfer a single file on an SFTP channel, skipping or resuming it as described in sftp_transfer().
+
+    :param SFTPClient sftp: The SFTP channel.
+    :param str source: The source path, local on upload.
+    :param str target: The target path, remote on upload.
+    :param bool upload: Uploads the file if True, downloads it if False.
+    :param Callable progress: Called as progress(file, transferred bytes, total bytes) after every block, defaults to None.
+    :param str part_dir: The directory of the '.part' file, on the same file system of the target so the final rename
+        stays atomic, defaults to None (the directory of the target).
+    :return: A tuple containing the outcome ('transferred', 'resumed' or 'skipped') and the transferred bytes.
+    """
+    # source_stat, target_stat: dimensione e data di modifica dei file, target_stat None se non esiste
+    source_stat = os.stat(source) if upload else sftp.stat(source)
+    size, mtime = source_stat.st_size, int(source_stat.st_mtime)
+    try:
+        target_stat = sftp.stat(target) if upload else os.stat(target)
+    except FileNotFoundError:
+        target_stat = None
+    if target_stat and target_stat.st_size == size and int(target_stat.st_mtime) == mtime:
+        return 'skipped', 0
+
+    # part: file parziale legato alla versione del sorgente (es. 2024_01.xlsx.20480_1718000000.part)
+    part = f'{target}.{size}_{mtime}.part'
+    if part_dir:
+        part = f"{part_dir}/{part.split('/')[-1]}"
+    try:
+        offset = (sftp.stat(part) if upload else os.stat(part)).st_size
+    except FileNotFoundError:
+        offset = 0
+    offset = offset if offset <= size else 0
+
+    with (open(source, 'rb') if upload else sftp.open(source, 'rb')) as fin, (sftp.open(part, 'ab' if offset else 'wb') if upload else open(part, 'ab' if offset else 'wb')) as fou:
+        fin.seek(offset)
+        # le scritture remote non attendono la conferma del server, le letture remote sono richieste in anticipo
+        if upload:
+            fou.set_pipelined(True)
+        else:
+            fin.prefetch(size)
+
+        done = offset
+        for block in iter(lambda: fin.read(SFTP_BLOCK_SIZE), b''):
+            fou.write(block)
+            done += len(block)
+            if progress:
+                progress(source, done, size)
+
+    if upload:
+        sftp.posix_rename(part, target)
+        sftp.utime(target, (mtime, mtime))
+    else:
+        os.replace(part, target)
+        os.utime(target, (mtime, mtime))
+
+    return 'resumed' if offset else 'transferred', size - offset
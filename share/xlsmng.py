@@ -1,8 +1,13 @@
-from openpyxl.styles import Font
+from collections.abc import Iterable
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
+from openpyxl.utils import get_column_letter
+from openpyxl.workbook.workbook import Workbook
+from openpyxl.worksheet.worksheet import Worksheet
 import datetime
 import openpyxl
 
-__version__ = '1.0.3'
+__version__ = '1.2.1'
 
 DEFAULT_FONT = 'Aptos Narrow'
 FORMATS = {
@@ -16,32 +21,96 @@ FORMATS = {
 }
 
 
-def write_excel(fou: str, rows: list, sheet_name: str = None, header: list[str] = None, font_face: str = DEFAULT_FONT) -> None:
+def style_ini(wb: Workbook, number_format: str, font_face: str = DEFAULT_FONT, bold: bool = False) -> str:
+    """Register a named style into the workbook, only once for every combination of properties.
+
+    :param Workbook wb: The workbook which will use the style.
+    :param str number_format: Number format of the style.
+    :param str font_face: Font face of the style, defaults to DEFAULT_FONT constant.
+    :param bool bold: Enables the bold font, defaults to False.
+    :return: The name of the style, to be assigned to Cell.style.
+    """
+    name = f"{font_face} {'bold ' if bold else ''}{number_format}"
+    if name not in wb.named_styles:
+        wb.add_named_style(NamedStyle(name=name, font=Font(name=font_face, bold=bold), number_format=number_format))
+    return name
+
+
+def write_rows(ws: Worksheet, rows: Iterable, start_row: int = 1, font_face: str = DEFAULT_FONT, formats: dict = FORMATS,
+               col_formats: dict[int, str] = None, col_alignments: dict[int, str] = None) -> None:
+    """Write a list of values into an existing worksheet, keeping the other formatting of the cells (borders, fills, ...).
+
+    The font and alignment objects are built once for the whole call instead of once for every cell.
+
+    :param Worksheet ws: The worksheet to write, usually from a template.
+    :param Iterable rows: List of values to write.
+    :param int start_row: Number of the first row to write, defaults to 1.
+    :param str font_face: Font face of the written cells, defaults to DEFAULT_FONT constant.
+    :param dict formats: Number format for every value type, defaults to FORMATS constant.
+    :param dict[int, str] col_formats: Number format forced for some column numbers, defaults to None.
+    :param dict[int, str] col_alignments: Horizontal alignment forced for some column numbers, defaults to None.
+    """
+    font = Font(name=font_face)
+    col_formats = col_formats or {}
+    col_alignments = {col_num: Alignment(horizontal=horizontal) for col_num, horizontal in (col_alignments or {}).items()}
+
+    for row_num, row in enumerate(rows, start=start_row):
+        for col_num, col in enumerate(row, start=1):
+            cell = ws.cell(row=row_num, column=col_num)
+            cell.value = col
+            cell.font = font
+            cell.number_format = col_formats[col_num] if col_num in col_formats else formats[type(col)]
+
+            if col_num in col_alignments:
+                cell.alignment = col_alignments[col_num]
+
+
+def write_excel(fou: str, rows: Iterable, sheet_name: str = None, header: list[str] = None, font_face: str = DEFAULT_FONT, write_only: bool = False) -> None:
     """Write a list of values into Excel file.
 
     :param str fou: Path to the result file.
-    :param list rows: List of values to write.
+    :param Iterable rows: List of values to write, can be a generator when write_only is enabled.
     :param str sheet_name: Name of the sheet into the file, defaults to None.
     :param list[str] header: List of column names, defaults to None.
     :param str font_face: Font face of the file, defaults to DEFAULT_FONT constant.
+    :param bool write_only: Enables the streaming mode with constant memory usage, defaults to False.
     """
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    if sheet_name:
+    wb = openpyxl.Workbook(write_only=write_only)
+    ws = wb.create_sheet(sheet_name) if write_only else wb.active
+    if sheet_name and not write_only:
         ws.title = sheet_name
 
+    # styles: nome dello stile registrato per ogni formato
+    styles = {}
+    # max_row, max_col: dimensioni dei dati scritti
+    max_row, max_col = 0, 0
+
     if header:
-        for col_num, name in enumerate(header, start=1):
-            ws.cell(row=1, column=col_num).value = name
-            ws.cell(row=1, column=col_num).font = Font(name=font_face, bold=True)
-            ws.cell(row=1, column=col_num).number_format = FORMATS[type(name)]
+        ws.append([style_cell(WriteOnlyCell(ws, name), style_ini(wb, FORMATS[type(name)], font_face, bold=True)) for name in header])
+        max_row, max_col = 1, len(header)
 
-    for row_num, row in enumerate(rows, start=2 if header else 1):
-        for col_num, col in enumerate(row, start=1):
-            ws.cell(row=row_num, column=col_num).value = col
-            ws.cell(row=row_num, column=col_num).font = Font(name=font_face)
-            ws.cell(row=row_num, column=col_num).number_format = FORMATS[type(col)]
+    for row in rows:
+        cells = []
+        for col in row:
+            number_format = FORMATS[type(col)]
+            if number_format not in styles:
+                styles[number_format] = style_ini(wb, number_format, font_face)
+            cells.append(style_cell(WriteOnlyCell(ws, col), styles[number_format]))
+
+        ws.append(cells)
+        max_row, max_col = max_row + 1, max(max_col, len(cells))
 
     if header:
-        ws.auto_filter.ref = ws.dimensions
+        ws.auto_filter.ref = f'A1:{get_column_letter(max_col)}{max_row}'
     wb.save(fou)
+
+
+def style_cell(cell: Cell, style: str) -> Cell:
+    """Assign a named style to a cell.
+
+    :param Cell cell: The cell to style.
+    :param str style: The name of the style from style_ini().
+    :return: The same cell.
+    """
+    cell.style = style
+    return cell
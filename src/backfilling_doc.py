@@ -0,0 +1,258 @@
+from caching_doc import PAGE_CACHE, doc_hash
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from extracting_doc import PageRecord
+from matching_doc import PLATE_MATCHER
+from overview_doc import overview_batch
+from pyodbc import Cursor
+from recording_doc import PATH_RECORDED_DIR, PATTERN_MESSAGE_GAPS, PATTERN_WORKING_DOC, QUERY_INSERT_MESSAGGI, QUERY_LOAD_DUPLICATE_DOCS, RECORDING_PROFILE, check_similarity, gap_close, gap_left_checker, message_gnr, page_scan, session_closing
+from share import sqlmng
+from share.common import logger_ini
+from share.perfmng import perf_count, perf_dump, perf_merge, perf_profile, perf_snapshot, perf_timer
+import argparse
+import fnmatch
+import os
+import pypdfium2
+import re
+
+__version__ = '1.0.2'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_LOG = f"{PATH_PRJ}/log/vanaheim_{date.today().strftime('%Y_%m_%d')}.log"
+PATH_METRICS = f"{PATH_PRJ}/log/vanaheim_{datetime.now().strftime('%Y_%m_%d_%H%M%S')}_backfilling"
+
+# BACKFILL_WORKERS: numero di processi che estraggono i doc dell'archivio
+BACKFILL_WORKERS = os.cpu_count() or 1
+# BACKFILL_BATCH_DOCS: numero di doc confrontati e aggiornati in un'unica transazione
+BACKFILL_BATCH_DOCS = 50
+
+QUERY_LOAD_BACKFILL_CONSEGNE = """
+    SELECT c.sorgente,
+        c.pagina,
+        c.numero_documento,
+        c.genere_documento,
+        c.data_documento,
+        c.ragione_sociale,
+        c.sede_consegna,
+        c.quantita,
+        c.data_consegna,
+        c.targa
+    FROM vanaheim.consegne c
+        JOIN (VALUES %(values)s) s (sorgente)
+            ON c.sorgente = s.sorgente;
+"""
+QUERY_UPSERT_CONSEGNE = """
+    INSERT INTO vanaheim.consegne AS c (
+        numero_documento,
+        genere_documento,
+        data_documento,
+        ragione_sociale,
+        sede_consegna,
+        quantita,
+        data_consegna,
+        targa,
+        sorgente,
+        pagina,
+        data_registrazione
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (sorgente, pagina) DO UPDATE
+    SET numero_documento = EXCLUDED.numero_documento,
+        genere_documento = EXCLUDED.genere_documento,
+        data_documento = EXCLUDED.data_documento,
+        ragione_sociale = EXCLUDED.ragione_sociale,
+        sede_consegna = EXCLUDED.sede_consegna,
+        quantita = EXCLUDED.quantita,
+        data_consegna = EXCLUDED.data_consegna,
+        targa = EXCLUDED.targa
+    WHERE (c.numero_documento, c.genere_documento, c.data_documento, c.ragione_sociale, c.sede_consegna, c.quantita, c.data_consegna, c.targa)
+        IS DISTINCT FROM (EXCLUDED.numero_documento, EXCLUDED.genere_documento, EXCLUDED.data_documento, EXCLUDED.ragione_sociale,
+            EXCLUDED.sede_consegna, EXCLUDED.quantita, EXCLUDED.data_consegna, EXCLUDED.targa);
+"""
+
+
+def backfill_extractor(recorded_doc: str) -> tuple[list[tuple[int, PageRecord, list[str]]], int, int, dict]:
+    """Extract and parse all the pages of a recorded doc, used as a worker of the process pool.
+
+    :param str recorded_doc: Path to the recorded doc (e.g. c:/source/vanaheim/DDTs/recorded/2024_01_DDT_0001_0267.pdf.recorded).
+    :return: A tuple containing the page number, the page record and the failed patterns of every page, the cache hits
+        and misses, and the metrics of the worker.
+    """
+    # azzero le metriche ereditate dal processo principale o già riportate
+    perf_snapshot(reset=True)
+    cache_hits, cache_misses = PAGE_CACHE.hits, PAGE_CACHE.misses
+    # il testo delle pagine resta in cache tra un backfill e l'altro, quindi va riletto solo il pdf modificato
+    with perf_timer('hash_pdf'):
+        working_hash = doc_hash(recorded_doc)
+    with perf_timer('open_pdf'):
+        doc = pypdfium2.PdfDocument(recorded_doc)
+    res = [(working_page, *page_scan(doc, working_page, working_hash)) for working_page in range(1, len(doc) + 1)]
+
+    doc.close()
+    return res, PAGE_CACHE.hits - cache_hits, PAGE_CACHE.misses - cache_misses, perf_snapshot(reset=True)
+
+
+def backfill_diff(cursor: Cursor, extracted: dict, backfill_begin: datetime, duplicates: dict) -> tuple[list[tuple], set[tuple[int, int]], set[tuple[int, int]]]:
+    """Compare the records extracted from a batch of recorded docs with the ones saved in vanaheim.consegne.
+
+    A page whose extraction fails keeps its saved record. A new or changed record is skipped if its (numero_documento,
+    genere_documento, anno) key belongs to another record, so the upsert never violates the unique indexes.
+
+    :param Cursor cursor: The cursor to the database.
+    :param dict extracted: The extraction of every doc of the batch as {sorgente: result of backfill_extractor()}.
+    :param datetime backfill_begin: The registration timestamp of the new records, the changed ones keep their own.
+    :param dict duplicates: The index of the saved keys as duplicate_ini() of recording_doc, loaded by year on demand.
+    :return: A tuple containing the records to be upserted, as parameters of QUERY_UPSERT_CONSEGNE, the (anno, mese)
+        periods of data_documento they leave or enter, and the (anno, numero_documento) numbers left by the changed records.
+    """
+    logger = logger_ini(PATH_LOG, 'backfilling_doc')
+
+    # saved: record salvati dei doc del batch per (sorgente, pagina), con i CHAR senza spazi di riempimento
+    query = QUERY_LOAD_BACKFILL_CONSEGNE % {'values': ', '.join(['(?::VARCHAR)'] * len(extracted))}
+    saved = {(row[0], row[1]): PageRecord(*(value.rstrip() if isinstance(value, str) else value for value in row[2:]))
+             for row in sqlmng.conx_stream(cursor, query, list(extracted))}
+
+    upserts = []
+    # periods: mesi delle overview da aggiornare, sia quello di arrivo sia quello di partenza di un record spostato
+    periods = set()
+    # left: numeri lasciati dai record modificati, da verificare come possibili gap
+    left = set()
+    for sorgente, pages in extracted.items():
+        for working_page, doc_record, errors in pages:
+            if errors:
+                perf_count('backfill_failed')
+                continue
+
+            # verifica targa
+            if doc_record.targa and doc_record.targa not in PLATE_MATCHER:
+                doc_record = doc_record._replace(targa=check_similarity(doc_record.targa))
+
+            saved_record = saved.get((sorgente, working_page))
+            if doc_record == saved_record:
+                perf_count('backfill_unchanged')
+                continue
+
+            # controllo che la chiave del record non sia già di un altro record
+            key = (doc_record.numero_documento, doc_record.genere_documento, doc_record.data_documento.year)
+            saved_key = (saved_record.numero_documento, saved_record.genere_documento, saved_record.data_documento.year) if saved_record else None
+            if key[2] not in duplicates['years']:
+                duplicates['docs'].update((row.numero_documento, row.genere_documento, key[2]) for row in sqlmng.conx_stream(cursor, QUERY_LOAD_DUPLICATE_DOCS, [key[2]]))
+                duplicates['years'].add(key[2])
+            if key != saved_key and key in duplicates['docs']:
+                logger.warning('skipping page %d of %s because already recorded by another record... [%s]', working_page, sorgente, key)
+                perf_count('backfill_conflicts')
+                continue
+
+            duplicates['docs'].discard(saved_key)
+            duplicates['docs'].add(key)
+            perf_count('backfill_updated' if saved_record else 'backfill_inserted')
+            upserts.append((*doc_record, sorgente, working_page, backfill_begin))
+            periods.add((doc_record.data_documento.year, doc_record.data_documento.month))
+            if saved_record:
+                periods.add((saved_record.data_documento.year, saved_record.data_documento.month))
+            if saved_record and (saved_key[2], saved_key[0]) != (key[2], key[0]):
+                left.add((saved_key[2], saved_key[0]))
+
+    return upserts, periods, left
+
+
+def backfill_run(pattern: str = '*', workers: int = BACKFILL_WORKERS, dry_run: bool = False) -> list[str]:
+    """Extract again the docs of PATH_RECORDED_DIR and apply to vanaheim.consegne only the differences from the saved records.
+
+    The docs are shared among the worker processes and every BACKFILL_BATCH_DOCS extracted docs their records are
+    compared with the saved ones by backfill_diff() and upserted with a single bulk QUERY_UPSERT_CONSEGNE, so a
+    repeated backfill changes nothing. The discard docs (e.g. 2024_01_DDT_0001_0267_P005.pdf) are left out, since their
+    records come from the corrections of vanaheim.discard_consegne. A changed record keeps its data_registrazione, so
+    the gaps of the new records are checked as at the end of a recording session, while in every batch the gap
+    messages of the upserted numbers are disabled and the numbers left by the changed records are checked for new gaps.
+    The overviews are refreshed for every month a record has entered or left.
+
+    :param str pattern: The pattern of the doc names to be extracted again (e.g. '2023_*'), defaults to '*'.
+    :param int workers: Number of worker processes, defaults to BACKFILL_WORKERS constant.
+    :param bool dry_run: Rolls back the changes instead of saving them, defaults to False.
+    :return: The list of extracted docs.
+    """
+    logger = logger_ini(PATH_LOG, 'backfilling_doc')
+    # docs: doc registrati da estrarre di nuovo, esclusi gli scarti (es. [2024_01_DDT_0001_0267.pdf, ...])
+    docs = sorted(
+        name.removesuffix('.recorded') for name in next(os.walk(PATH_RECORDED_DIR), (None, None, []))[2]
+        if name.endswith('.recorded') and re.search(PATTERN_WORKING_DOC, name.removesuffix('.recorded'))
+        and not re.search(r'_P\d{3}', name) and fnmatch.fnmatch(name.removesuffix('.recorded'), pattern)
+    )
+    logger.info(f'backfilling {len(docs)} recorded docs with {workers} workers...')
+
+    backfill_begin = datetime.now()
+    # duplicates: chiavi (numero_documento, genere_documento, anno) dei record salvati, caricate per anno
+    duplicates = {'years': set(), 'docs': set()}
+    # overviews: mesi modificati dal backfill
+    overviews = set()
+    with sqlmng.conx_session() as (cursor, _), ProcessPoolExecutor(workers) as pool:
+        # leggo il registro delle targhe, se non è stato letto di recente
+        PLATE_MATCHER.load(cursor)
+        futures = {pool.submit(backfill_extractor, f'{PATH_RECORDED_DIR}/{doc}.recorded'): doc for doc in docs}
+
+        # extracted: doc estratti in attesa del confronto, come {sorgente: pagine}
+        extracted = {}
+        for pos, future in enumerate(as_completed(futures), 1):
+            res, hits, misses, metrics = future.result()
+            # riporto i contatori della cache e le metriche del processo
+            PAGE_CACHE.hits += hits
+            PAGE_CACHE.misses += misses
+            perf_merge(metrics)
+            perf_count('pages', len(res))
+            extracted[futures[future]] = res
+
+            if len(extracted) < BACKFILL_BATCH_DOCS and pos < len(futures):
+                continue
+
+            with perf_timer('backfill_diff'):
+                upserts, periods, left = backfill_diff(cursor, extracted, backfill_begin, duplicates)
+            sqlmng.conx_write_many(cursor, QUERY_UPSERT_CONSEGNE, upserts, fast=True)
+            # disattivo i gap message dei numeri salvati e segnalo i gap aperti dai numeri corretti, nella stessa transazione
+            gap_close(cursor, ((record[2].year, record[0]) for record in upserts))
+            with perf_timer('gap_check'):
+                gaps = gap_left_checker(cursor, left)
+            sqlmng.conx_write_many(cursor, QUERY_INSERT_MESSAGGI, [message_gnr(PATTERN_MESSAGE_GAPS, {
+                'numero_documento': numero,
+                'anno': anno
+            }) for numero, anno in gaps], fast=True)
+            if dry_run:
+                cursor.rollback()
+            else:
+                sqlmng.conx_commit(cursor)
+                overviews |= periods
+            logger.info(f'backfilled {pos} of {len(docs)} docs... [{len(upserts)} records upserted, {len(gaps)} gaps found]')
+            extracted = {}
+
+        # verifico i gap dei record nuovi, aggiungendo i loro mesi a quelli dei record modificati
+        if not dry_run:
+            overviews.update(session_closing(cursor, backfill_begin))
+
+    counters = perf_snapshot()['counters']
+    logger.info(f"backfill {'simulated' if dry_run else 'completed'}... [{', '.join(f'{counter}: {counters.get(counter, 0)}' for counter in ('backfill_inserted', 'backfill_updated', 'backfill_unchanged', 'backfill_failed', 'backfill_conflicts'))}]")
+
+    # aggiorno overview dei mesi modificati, riusando la connessione rilasciata al pool
+    with perf_timer('overview'):
+        overview_batch(sorted(overviews))
+    return docs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract again the recorded DDTs and update vanaheim.consegne with the differences.')
+    parser.add_argument('--pattern', default='*', help="pattern of the doc names to be extracted again (e.g. '2023_*')")
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='count the differences without saving them')
+    args = parser.parse_args()
+
+    logger = logger_ini(PATH_LOG, 'backfilling_doc')
+    session_begin = datetime.now()
+    with perf_profile(f'{PATH_METRICS}.prof', RECORDING_PROFILE), perf_timer('session'):
+        backfilled = backfill_run(args.pattern, args.workers, args.dry_run)
+
+    # salvo le metriche della sessione accanto al log
+    perf_dump(f'{PATH_METRICS}.json', {
+        'session': session_begin,
+        'docs': backfilled,
+        'params': vars(args),
+        'cache': {'hits': PAGE_CACHE.hits, 'misses': PAGE_CACHE.misses}
+    })
+    logger.info(f'saving session metrics... [{PATH_METRICS}.json]')
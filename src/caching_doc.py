@@ -0,0 +1,131 @@
+from hashlib import sha256
+import os
+
+__version__ = '1.0.0'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_CACHE_DIR = f'{PATH_PRJ}/cache/pages'
+
+# CACHE_MAX_BYTES: dimensione massima dei testi in cache, oltre la quale si eliminano i meno usati
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# CACHE_EVICT_RATIO: frazione di CACHE_MAX_BYTES da raggiungere con l'eliminazione
+CACHE_EVICT_RATIO = 0.8
+
+
+def doc_hash(fin: str) -> str:
+    """Get the sha256 of the content of a file, read in blocks.
+
+    :param str fin: Path to the file.
+    :return: The hexadecimal digest.
+    """
+    digest = sha256()
+    with open(fin, 'rb') as din:
+        for block in iter(lambda: din.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """On-disk cache of the page texts extracted by pdfium, keyed by the sha256 of the pdf content and the page number.
+
+    Every text is a file under the cache directory, whose modification time is refreshed on every hit, so the least
+    recently used texts are removed first when the total size goes over max_bytes. The files are written atomically,
+    so the cache can be shared by the processes of the extraction pool.
+    """
+    __slots__ = ('path', 'max_bytes', 'size', 'hits', 'misses')
+
+    def __init__(self, path: str = PATH_CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        # size: dimensione dei testi in cache, calcolata alla prima scrittura
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def name(self, doc_hash: str, page: int) -> str:
+        """Get the path of the cached text of a page.
+
+        :param str doc_hash: The sha256 of the pdf content.
+        :param int page: The page number, starting from 1.
+        :return: The path of the cached text.
+        """
+        # es. c:/source/vanaheim/cache/pages/9d/9d1008e7..._0005.txt
+        return f'{self.path}/{doc_hash[:2]}/{doc_hash}_{page:0>4}.txt'
+
+    def get(self, doc_hash: str, page: int, count: bool = True) -> str | None:
+        """Read the cached text of a page.
+
+        :param str doc_hash: The sha256 of the pdf content.
+        :param int page: The page number, starting from 1.
+        :param bool count: Updates the hit and miss counters, defaults to True.
+        :return: The text of the page, or None if it isn't cached.
+        """
+        try:
+            with open(self.name(doc_hash, page), 'r', encoding='utf-8', newline='') as tin:
+                text = tin.read()
+        except FileNotFoundError:
+            self.misses += count
+            return None
+
+        # aggiorno la data di modifica per l'ordine di eliminazione, ignorando un testo appena eliminato
+        try:
+            os.utime(self.name(doc_hash, page))
+        except FileNotFoundError:
+            pass
+
+        self.hits += count
+        return text
+
+    def put(self, doc_hash: str, page: int, text: str) -> None:
+        """Save the text of a page, removing the least recently used texts if the cache is full.
+
+        :param str doc_hash: The sha256 of the pdf content.
+        :param int page: The page number, starting from 1.
+        :param str text: The text of the page.
+        """
+        fou = self.name(doc_hash, page)
+        os.makedirs(os.path.dirname(fou), exist_ok=True)
+        with open(f'{fou}.{os.getpid()}.tmp', 'w', encoding='utf-8', newline='') as tou:
+            tou.write(text)
+        os.replace(f'{fou}.{os.getpid()}.tmp', fou)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += os.path.getsize(fou)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """List the cached texts.
+
+        :return: A list of tuples containing modification time, size and path of every cached text.
+        """
+        res = []
+        for folder in os.scandir(self.path) if os.path.isdir(self.path) else []:
+            for entry in os.scandir(folder.path) if folder.is_dir() else []:
+                if entry.name.endswith('.txt'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    res.append((stat.st_mtime, stat.st_size, entry.path))
+        return res
+
+    def evict(self) -> None:
+        """Remove the least recently used texts until the cache is CACHE_EVICT_RATIO of max_bytes."""
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+
+        for _, size, fou in entries:
+            if self.size <= self.max_bytes * CACHE_EVICT_RATIO:
+                break
+            try:
+                os.remove(fou)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+# PAGE_CACHE: cache condivisa dal processo
+PAGE_CACHE = PageCache()
@@ -0,0 +1,101 @@
+from datetime import date
+from typing import NamedTuple
+import re
+
+__version__ = '1.0.0'
+
+PATTERN_NUMERO_DATA = r'Num\. D\.D\.T\. ([\d\.]+)\/(\w{2}) Data D\.D\.T\. (\d{2}\/\d{2}\/\d{4}) Pag'
+PATTERN_SEDE_SX = r"Luogo di partenza: .+\r\n([\w\s\.\&\-'\/]+)\r\n(\d{5}) ([\w\s'\-]+) \(?(\w{2})\)?\r\n"
+PATTERN_SEDE_DX = r"Luogo di consegna\r\n([\w\s\.\&\-'\/]+)\r\n.+\r\n(\d{0,5}) ?([\w\s'\-]+) \(?(\w{2})\)?\r\n"
+PATTERN_QUANTITA = r'(Quantità Prezzo\r\n.+)? (L|KG) ([\d\.]+),000\s'
+PATTERN_TARGA = r'Peso soggetto accisa\r\n([\w\d]{7})\r\n'
+
+# ANCHOR_*: testo fisso con cui inizia ogni occorrenza del relativo pattern
+ANCHOR_NUMERO_DATA = 'Num. D.D.T. '
+ANCHOR_SEDE_SX = 'Luogo di partenza: '
+ANCHOR_SEDE_DX = 'Luogo di consegna\r\n'
+ANCHOR_QUANTITA = ',000'
+ANCHOR_TARGA = 'Peso soggetto accisa\r\n'
+
+
+class PageRecord(NamedTuple):
+    """The delivery information extracted from a pdf page, in the column order of vanaheim.consegne."""
+    numero_documento: int | None
+    genere_documento: str | None
+    data_documento: date | None
+    ragione_sociale: str | None
+    sede_consegna: str | None
+    quantita: int | None
+    data_consegna: date | None
+    targa: str | None
+
+
+class DocExtractor:
+    """Extract the delivery information from the text of a pdf page with the patterns compiled once.
+
+    Every pattern is searched only if its anchor is in the text, starting from the first occurrence of the anchor,
+    so a page missing a section costs a str.find() instead of a full regex scan.
+    """
+    __slots__ = ('numero_data', 'sede_sx', 'sede_dx', 'quantita', 'targa')
+
+    def __init__(self) -> None:
+        self.numero_data = re.compile(PATTERN_NUMERO_DATA)
+        self.sede_sx = re.compile(PATTERN_SEDE_SX)
+        self.sede_dx = re.compile(PATTERN_SEDE_DX)
+        self.quantita = re.compile(PATTERN_QUANTITA)
+        self.targa = re.compile(PATTERN_TARGA)
+
+    def scan(self, text: str) -> tuple[PageRecord, list[str]]:
+        """Extract the delivery information from the text of a pdf page.
+
+        :param str text: The text of the page.
+        :return: A tuple containing the page record and the list of failed patterns.
+        """
+        # errors: elenco dei pattern in errore
+        errors = []
+
+        # estrazione numero_documento, genere_documento e data_documento
+        pos = text.find(ANCHOR_NUMERO_DATA)
+        search = self.numero_data.search(text, pos) if pos != -1 else None
+        if search:
+            numero_documento = int(search.group(1).replace('.', ''))
+            genere_documento = search.group(2).upper()
+            # data_documento nel formato dd/mm/yyyy
+            data_documento = search.group(3)
+            data_documento = date(int(data_documento[6:]), int(data_documento[3:5]), int(data_documento[:2]))
+        else:
+            numero_documento = genere_documento = data_documento = None
+            errors.append('PATTERN_NUMERO_DATA')
+
+        # estrazione sede_consegna
+        pos = text.find(ANCHOR_SEDE_DX)
+        search = self.sede_dx.search(text, pos) if pos != -1 else None
+        if not search:
+            pos = text.find(ANCHOR_SEDE_SX)
+            search = self.sede_sx.search(text, pos) if pos != -1 else None
+        if search:
+            ragione_sociale = search.group(1).upper().strip()
+            sede_consegna = search.group(3).upper().strip()
+        else:
+            ragione_sociale = sede_consegna = None
+            errors.append('PATTERN_SEDE')
+
+        # estrazione quantità
+        search = self.quantita.search(text) if ANCHOR_QUANTITA in text else None
+        quantita = int(search.group(3).replace('.', '')) if search else None
+        if not search:
+            errors.append('PATTERN_QUANTITA')
+
+        # estrazione targa
+        pos = text.find(ANCHOR_TARGA)
+        search = self.targa.search(text, pos) if pos != -1 else None
+        targa = search.group(1).upper() if search else None
+        if not search:
+            errors.append('PATTERN_TARGA')
+
+        # duplico data_documento in data_consegna
+        return PageRecord(numero_documento, genere_documento, data_documento, ragione_sociale, sede_consegna, quantita, data_documento, targa), errors
+
+
+# DOC_EXTRACTOR: estrattore condiviso dal processo
+DOC_EXTRACTOR = DocExtractor()
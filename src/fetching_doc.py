@@ -0,0 +1,155 @@
+from caching_doc import PAGE_CACHE
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from overview_doc import overview_batch
+from recording_doc import PATH_RECORDED_DIR, PATH_WORKING_DIR, PATTERN_WORKING_DOC, RECORDING_PROFILE, RECORDING_WORKERS, doc_recording, duplicate_ini, session_closing
+from share import sqlmng, sshmng
+from share.common import logger_ini
+from share.perfmng import perf_count, perf_dump, perf_profile, perf_timer
+from threading import Lock, local
+import os
+import paramiko
+import posixpath
+import re
+import stat
+
+__version__ = '1.0.1'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_LOG = f"{PATH_PRJ}/log/vanaheim_{date.today().strftime('%Y_%m_%d')}.log"
+PATH_METRICS = f"{PATH_PRJ}/log/vanaheim_{datetime.now().strftime('%Y_%m_%d_%H%M%S')}_fetching"
+# PATH_FETCHING_DIR: cartella dei file parziali in scaricamento, sullo stesso disco di PATH_WORKING_DIR per uno spostamento atomico
+PATH_FETCHING_DIR = f'{PATH_WORKING_DIR}/fetching'
+
+# FETCHING_CONN: configurazione di sshmng.json del server SFTP dei DDT
+FETCHING_CONN = 'main'
+# FETCHING_DROP_DIR: cartella remota in cui vengono depositati i DDT da registrare
+FETCHING_DROP_DIR = '/DDTs'
+# FETCHING_ARCHIVE_DIR: cartella remota in cui vengono spostati i DDT registrati
+FETCHING_ARCHIVE_DIR = '/DDTs/recorded'
+# FETCHING_WINDOW: numero massimo di DDT scaricati in anticipo rispetto a quello in registrazione
+FETCHING_WINDOW = 3
+# FETCHING_WORKERS: numero di canali SFTP paralleli per lo scaricamento dei DDT
+FETCHING_WORKERS = 2
+
+
+def fetch_doc(conn: paramiko.SSHClient, channels: dict, doc: str) -> str:
+    """Download a doc of FETCHING_DROP_DIR into PATH_WORKING_DIR, used as a task of the prefetch threads.
+
+    The doc is written in PATH_FETCHING_DIR and moved into PATH_WORKING_DIR only when complete, so the scans of
+    PATH_WORKING_DIR never see a partial doc. A doc already recorded, or left as '.recording' by an interrupted run,
+    isn't downloaded again.
+
+    :param SSHClient conn: The SSH connection.
+    :param dict channels: The SFTP channel of every prefetch thread in 'thread', opened at its first doc and listed in
+        'opened' to be closed by fetch_recording().
+    :param str doc: The doc name (e.g. 2024_01_DDT_0001_0267.pdf).
+    :return: The name to be recorded from PATH_WORKING_DIR, with the '.recording' suffix for an interrupted doc, or
+        None if the doc is already recorded.
+    """
+    if os.path.isfile(f'{PATH_RECORDED_DIR}/{doc}.recorded'):
+        return None
+    if os.path.isfile(f'{PATH_WORKING_DIR}/{doc}.recording'):
+        return f'{doc}.recording'
+
+    if not hasattr(channels['thread'], 'sftp'):
+        channels['thread'].sftp = conn.open_sftp()
+        with channels['lock']:
+            channels['opened'].append(channels['thread'].sftp)
+    with perf_timer('fetch_doc'):
+        _, size = sshmng.sftp_file(channels['thread'].sftp, posixpath.join(FETCHING_DROP_DIR, doc), f'{PATH_WORKING_DIR}/{doc}', upload=False, part_dir=PATH_FETCHING_DIR)
+    perf_count('fetched_bytes', size)
+    return doc
+
+
+def fetch_recording(conn_name: str = FETCHING_CONN, window: int = FETCHING_WINDOW) -> list[str]:
+    """Record the docs of the remote FETCHING_DROP_DIR, downloading the next ones while the current one is recorded.
+
+    The docs are recorded in name order as recording_doc does with PATH_WORKING_DIR. Up to window docs are downloaded
+    ahead by FETCHING_WORKERS threads, each one on its SFTP channel of the same SSH connection, and a recorded doc is
+    moved to FETCHING_ARCHIVE_DIR. A doc which fails the download or the recording stays in FETCHING_DROP_DIR for the
+    next run.
+
+    :param str conn_name: Refers to the SSH configuration name in sshmng.json, defaults to FETCHING_CONN constant.
+    :param int window: Number of docs downloaded ahead, defaults to FETCHING_WINDOW constant.
+    :return: The list of recorded docs.
+    """
+    logger = logger_ini(PATH_LOG, 'fetching_doc')
+    conn = sshmng.conn_session(conn_name)
+    sftp = conn.open_sftp()
+    try:
+        sftp.stat(FETCHING_ARCHIVE_DIR)
+    except FileNotFoundError:
+        sftp.mkdir(FETCHING_ARCHIVE_DIR)
+
+    # docs: elenco dei doc nella cartella remota (es. [2024_01_DDT_0001_0267.pdf, ...])
+    docs = sorted(attr.filename for attr in sftp.listdir_attr(FETCHING_DROP_DIR) if stat.S_ISREG(attr.st_mode) and re.match(PATTERN_WORKING_DOC, attr.filename))
+    logger.info(f'remote DDTs dir content {docs}')
+
+    recorded = []
+    recording_begin = datetime.now()
+    os.makedirs(PATH_FETCHING_DIR, exist_ok=True)
+    # channels: canale SFTP di ogni thread di scaricamento, con l'elenco dei canali aperti da chiudere al termine
+    channels = {'thread': local(), 'opened': [], 'lock': Lock()}
+    prefetch = ThreadPoolExecutor(FETCHING_WORKERS, thread_name_prefix='fetch_doc')
+    # fetches: scaricamenti avviati, al massimo window oltre al doc in registrazione
+    fetches: dict[str, Future] = {}
+    try:
+        with sqlmng.conx_session() as (cursor, _):
+            # pool: processi per l'estrazione delle pagine, assente se l'estrazione è seriale
+            pool = ProcessPoolExecutor(RECORDING_WORKERS) if RECORDING_WORKERS > 1 else None
+            # duplicates: indice dei record già registrati, caricato per anno e sorgente durante la sessione
+            duplicates = duplicate_ini()
+
+            for pos, doc in enumerate(docs):
+                for ahead in docs[pos:pos + window + 1]:
+                    if ahead not in fetches:
+                        fetches[ahead] = prefetch.submit(fetch_doc, conn, channels, ahead)
+
+                try:
+                    with perf_timer('fetch_wait'):
+                        working_doc = fetches.pop(doc).result()
+                except (OSError, paramiko.SSHException) as err:
+                    logger.error(f'error on downloading doc {doc}... skipping doc! [{err}]')
+                    continue
+
+                if working_doc and not doc_recording(working_doc, cursor, recording_begin, pool, duplicates):
+                    continue
+
+                # archivio il doc registrato, anche se era già stato registrato da un'esecuzione precedente
+                try:
+                    sftp.posix_rename(posixpath.join(FETCHING_DROP_DIR, doc), posixpath.join(FETCHING_ARCHIVE_DIR, doc))
+                except (OSError, paramiko.SSHException) as err:
+                    logger.error(f'error on archiving remote doc {doc}... leaving doc in drop folder! [{err}]')
+                recorded.append(doc)
+
+            if pool:
+                pool.shutdown()
+
+            overviews = session_closing(cursor, recording_begin)
+    finally:
+        # attendo gli scaricamenti in corso prima di chiudere i canali che li servono
+        prefetch.shutdown(cancel_futures=True)
+        for channel in channels['opened']:
+            channel.close()
+        sftp.close()
+
+    # aggiorno overview dei doc registrati, riusando la connessione rilasciata al pool
+    with perf_timer('overview'):
+        overview_batch(overviews)
+    return recorded
+
+
+if __name__ == '__main__':
+    logger = logger_ini(PATH_LOG, 'fetching_doc')
+    session_begin = datetime.now()
+    with perf_profile(f'{PATH_METRICS}.prof', RECORDING_PROFILE), perf_timer('session'):
+        recorded = fetch_recording()
+
+    # salvo le metriche della sessione accanto al log
+    perf_dump(f'{PATH_METRICS}.json', {
+        'session': session_begin,
+        'docs': recorded,
+        'cache': {'hits': PAGE_CACHE.hits, 'misses': PAGE_CACHE.misses}
+    })
+    logger.info(f'saving session metrics... [{PATH_METRICS}.json]')
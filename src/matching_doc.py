@@ -0,0 +1,118 @@
+from collections import Counter
+from difflib import SequenceMatcher
+from pyodbc import Cursor
+from share import sqlmng
+import time
+
+__version__ = '1.0.0'
+
+# MATCHING_THRESHOLD: similarità minima, esclusa, per correggere una targa con quella del registro
+MATCHING_THRESHOLD = 0.5
+# MATCHING_REFRESH: secondi dopo i quali il registro delle targhe viene letto di nuovo dal database
+MATCHING_REFRESH = 300
+# MATCHING_MEMO_SIZE: numero massimo di targhe lette già risolte, oltre il quale la memoria viene svuotata
+MATCHING_MEMO_SIZE = 10000
+
+QUERY_LOAD_TARGHE = """
+    SELECT targa
+    FROM vanaheim.targhe
+    WHERE stato IS TRUE
+    ORDER BY id;
+"""
+
+
+class PlateMatcher:
+    """Match the plates read from the pdf pages with the plates of the vanaheim.targhe registry.
+
+    The result is the same of comparing the plate with every registry plate by SequenceMatcher.ratio() and keeping
+    the best one, the first in registry order on ties, if its ratio is over MATCHING_THRESHOLD. The ratio is bounded
+    by the characters in common, so the registry plates are indexed by character and only the ones which share enough
+    characters are compared, best bound first, stopping when no bound can beat the best ratio. The plates already
+    resolved are remembered, since the same misreading occurs on many pages.
+    """
+    __slots__ = ('plates', 'order', 'chars', 'index', 'memo', 'loaded')
+
+    def __init__(self, plates: list[str] = None) -> None:
+        self.plates = []
+        # order: posizione di ogni targa nel registro
+        self.order = {}
+        # chars: caratteri di ogni targa con la relativa molteplicità
+        self.chars = {}
+        # index: targhe del registro che contengono ogni carattere
+        self.index = {}
+        # memo: targhe lette già risolte, come {targa letta: targa}
+        self.memo = {}
+        # loaded: istante dell'ultima lettura del registro, None se non è mai stato letto
+        self.loaded = None
+        self.build(plates or [])
+
+    def __contains__(self, plate: str) -> bool:
+        return plate in self.order
+
+    def __len__(self) -> int:
+        return len(self.plates)
+
+    def build(self, plates: list[str]) -> None:
+        """Index the registry plates, forgetting the plates already resolved.
+
+        :param list plates: The registry plates, in registry order.
+        """
+        self.plates = list(dict.fromkeys(plates))
+        self.order = {plate: pos for pos, plate in enumerate(self.plates)}
+        self.chars = {plate: Counter(plate) for plate in self.plates}
+        self.index = {}
+        for plate in self.plates:
+            for char in self.chars[plate]:
+                self.index.setdefault(char, []).append(plate)
+        self.memo = {}
+
+    def load(self, cursor: Cursor, refresh: float = MATCHING_REFRESH) -> None:
+        """Read the active plates from vanaheim.targhe, if they weren't read in the last refresh seconds.
+
+        :param Cursor cursor: The cursor to the database.
+        :param float refresh: Seconds after which the registry is read again, defaults to MATCHING_REFRESH.
+        """
+        if self.loaded is not None and time.monotonic() - self.loaded < refresh:
+            return
+
+        self.build([row.targa.strip() for row in sqlmng.conx_read(cursor, QUERY_LOAD_TARGHE).fetchall()])
+        self.loaded = time.monotonic()
+
+    def match(self, doc_plate: str) -> str:
+        """Get the registry plate most similar to a plate read from a pdf page.
+
+        :param str doc_plate: The plate read from the page.
+        :return: The registry plate, or the plate read if none is similar enough.
+        """
+        if doc_plate in self.order:
+            return doc_plate
+        if doc_plate in self.memo:
+            return self.memo[doc_plate]
+
+        # common: caratteri in comune con ogni targa del registro che ne condivide almeno uno
+        doc_chars = Counter(doc_plate)
+        common = {}
+        for char, count in doc_chars.items():
+            for plate in self.index.get(char, []):
+                common[plate] = common.get(plate, 0) + min(count, self.chars[plate][char])
+
+        # bounds: limite superiore del ratio di ogni targa (come SequenceMatcher.quick_ratio()), dal maggiore
+        bounds = sorted(((2.0 * shared / (len(plate) + len(doc_plate)), self.order[plate], plate) for plate, shared in common.items()), key=lambda bound: (-bound[0], bound[1]))
+
+        best, best_ratio, best_order = doc_plate, MATCHING_THRESHOLD, len(self.plates)
+        for bound, order, plate in bounds:
+            # a parità di ratio vince la targa precedente nel registro, mentre la soglia va superata
+            if bound < best_ratio or (bound == best_ratio and (best == doc_plate or order > best_order)):
+                break
+            ratio = SequenceMatcher(None, plate, doc_plate).ratio()
+            if ratio > best_ratio or (ratio == best_ratio and best != doc_plate and order < best_order):
+                best, best_ratio, best_order = plate, ratio, order
+
+        if len(self.memo) >= MATCHING_MEMO_SIZE:
+            self.memo.clear()
+        self.memo[doc_plate] = best
+        return best
+
+
+# PLATE_MATCHER: registro delle targhe condiviso dal processo, letto dal database all'inizio di ogni sessione
+PLATE_MATCHER = PlateMatcher()
@@ -1,18 +1,27 @@
 from calendar import Calendar
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
 from datetime import date
-from openpyxl.styles import Alignment, Font
-from share import sqlmng
+from matching_doc import PLATE_MATCHER
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.worksheet import Worksheet
+from share import sqlmng, xlsmng
 from share.common import logger_ini
+import itertools
 import openpyxl
 import os
 
-__version__ = '2.2.3'
+__version__ = '2.8.1'
 
 PATH_PRJ = 'c:/source/vanaheim'
 PATH_LOG = f"{PATH_PRJ}/log/vanaheim_{date.today().strftime('%Y_%m_%d')}.log"
 PATH_RES = f'{PATH_PRJ}/res'
 PATH_SCHEME = f'{PATH_PRJ}/scheme'
 
+# OVERVIEW_WORKERS: numero di processi per la generazione delle overview di più mesi
+OVERVIEW_WORKERS = os.cpu_count() or 1
+
 QUERY_OVERVIEW_DATA = """
     SELECT numero_documento,
         data_documento,
@@ -22,40 +31,46 @@ QUERY_OVERVIEW_DATA = """
         data_consegna,
         targa
     FROM vanaheim.consegne
-    WHERE EXTRACT(YEAR FROM data_consegna) = ?
-        AND EXTRACT(MONTH FROM data_consegna) = ?
+    WHERE data_consegna >= ?
+        AND data_consegna < ?
     ORDER BY numero_documento;
 """
+QUERY_OVERVIEW_DATA_MANY = """
+    SELECT p.anno,
+        p.mese,
+        c.numero_documento,
+        c.data_documento,
+        c.ragione_sociale,
+        c.sede_consegna,
+        c.quantita,
+        c.data_consegna,
+        c.targa
+    FROM (VALUES %(values)s) p (anno, mese, inizio, fine)
+        JOIN vanaheim.consegne c
+            ON c.data_consegna >= p.inizio
+            AND c.data_consegna < p.fine
+    ORDER BY p.anno, p.mese, c.numero_documento;
+"""
 QUERY_SUMMARY_VIAGGI = """
     WITH viaggi AS (
         SELECT ROW_NUMBER() OVER (PARTITION BY targa ORDER BY data_consegna, sede_consegna) AS id,
             targa,
-            data_consegna, 
-            sede_consegna
-        FROM vanaheim.consegne
-        WHERE EXTRACT(YEAR FROM data_documento) = ?
-    ) 
-    SELECT v1.data_consegna data_es745wh,
-        v1.sede_consegna sede_es745wh,
-        NULL gap,
-        v2.sede_consegna sede_fc065zw,
-        v2.data_consegna data_fc065zw
-    FROM (
-        SELECT id,
             data_consegna,
             sede_consegna
-        FROM viaggi
-        WHERE targa = 'ES745WH'
-    ) v1
-        FULL JOIN (
-            SELECT id, 
-                data_consegna,
-                sede_consegna
-            FROM viaggi
-            WHERE targa = 'FC065ZW'
-        ) v2 ON v1.id = v2.id
-    ORDER BY COALESCE(v1.id, v2.id);
+        FROM vanaheim.consegne
+        WHERE data_documento >= ?
+            AND data_documento < ?
+            AND targa IN (%(targhe)s)
+    )
+    SELECT %(columns)s
+    FROM viaggi
+    GROUP BY id
+    ORDER BY id;
 """
+# COLUMN_SUMMARY_*: colonne di QUERY_SUMMARY_VIAGGI per ogni targa, con la targa come parametro
+COLUMN_SUMMARY_DATA = 'MAX(data_consegna) FILTER (WHERE targa = ?)'
+COLUMN_SUMMARY_SEDE = 'MAX(sede_consegna) FILTER (WHERE targa = ?)'
+COLUMN_SUMMARY_GAP = 'NULL'
 
 DEFAULT_FONT = 'Arial'
 FORMATS = {
@@ -74,20 +89,78 @@ def overview_gnr(anno: int = date.today().year, mese: int = date.today().month)
     :param int mese: The desired month for the overview.
     """
     logger = logger_ini(PATH_LOG, 'overview_doc')
-    cursor, conn = sqlmng.conx_ini()
+    with sqlmng.conx_session() as (cursor, _):
+        consegne = sqlmng.conx_stream(cursor, QUERY_OVERVIEW_DATA, (date(anno, mese, 1), date(anno + mese // 12, mese % 12 + 1, 1)))
+        first = next(consegne, None)
+        if not first:
+            logger.warning(f'no record founded in {anno}/{mese:0>2}... skipping overview!')
+            return
+
+        logger.info('saving overview for %(data)s... [%(data)s.xlsx]' % {'data': f'{anno}_{mese:0>2}'})
+        overview_render(anno, mese, itertools.chain([first], consegne))
+
+
+def overview_batch(periods: list[tuple[int, int]], workers: int = OVERVIEW_WORKERS) -> list[tuple[int, int]]:
+    """Generate the overview excel of many months, with a single query and the workbooks rendered by a process pool.
+
+    An error on a month is logged and doesn't stop the other months.
 
-    consegne = sqlmng.conx_read(cursor, QUERY_OVERVIEW_DATA, (anno, mese)).fetchall()
-    if not consegne:
+    :param list[tuple[int, int]] periods: The desired months for the overviews, as (anno, mese) tuples.
+    :param int workers: Number of processes rendering the workbooks, defaults to OVERVIEW_WORKERS constant.
+    :return: The list of months whose overview failed.
+    """
+    logger = logger_ini(PATH_LOG, 'overview_doc')
+    if not periods:
+        return []
+
+    # args: per ogni mese anno, mese, primo giorno del mese e primo giorno del mese successivo
+    args = [value for anno, mese in periods for value in (anno, mese, date(anno, mese, 1), date(anno + mese // 12, mese % 12 + 1, 1))]
+    query = QUERY_OVERVIEW_DATA_MANY % {'values': ', '.join(['(?::INTEGER, ?::INTEGER, ?::DATE, ?::DATE)'] * len(periods))}
+
+    # consegne: righe di ogni mese, senza anno e mese
+    consegne = {period: [] for period in periods}
+    with sqlmng.conx_session() as (cursor, _):
+        for row in sqlmng.conx_stream(cursor, query, args):
+            consegne[(row.anno, row.mese)].append(tuple(row)[2:])
+
+    for anno, mese in [period for period in periods if not consegne[period]]:
         logger.warning(f'no record founded in {anno}/{mese:0>2}... skipping overview!')
-        return
+        consegne.pop((anno, mese))
+
+    # errors: eccezione sollevata dalla generazione di ogni mese, None se generato
+    errors = {}
+    if workers > 1 and len(consegne) > 1:
+        with ProcessPoolExecutor(min(workers, len(consegne))) as pool:
+            renders = {period: pool.submit(overview_render, *period, rows) for period, rows in consegne.items()}
+            errors = {period: render.exception() for period, render in renders.items()}
+    else:
+        for period, rows in consegne.items():
+            try:
+                errors[period] = overview_render(*period, rows)
+            except Exception as err:
+                errors[period] = err
+
+    # failed: mesi con errore in generazione
+    failed = []
+    for (anno, mese), err in errors.items():
+        if err:
+            logger.error(f'error on saving overview for {anno}_{mese:0>2}... skipping overview! [{err!r}]')
+            failed.append((anno, mese))
+        else:
+            logger.info('saving overview for %(data)s... [%(data)s.xlsx]' % {'data': f'{anno}_{mese:0>2}'})
+
+    return failed
 
+
+def overview_render(anno: int, mese: int, consegne: Iterable) -> None:
+    """Write the month overview excel from the records of the month, starting from the previous overview if exists.
+
+    :param int anno: The year of the overview.
+    :param int mese: The month of the overview.
+    :param Iterable consegne: The records of the month, with the columns of QUERY_OVERVIEW_DATA.
+    """
     wb = openpyxl.load_workbook(f'{PATH_RES}/{anno}_{mese:0>2}.xlsx' if os.path.isfile(f'{PATH_RES}/{anno}_{mese:0>2}.xlsx') else f'{PATH_SCHEME}/consegne.xlsx')
-    ws = wb['consegne']
-    for row_num, row in enumerate(consegne, start=2):
-        for col_num, col in enumerate(row, start=1):
-            ws.cell(row=row_num, column=col_num).value = col
-            ws.cell(row=row_num, column=col_num).font = Font(name=DEFAULT_FONT)
-            ws.cell(row=row_num, column=col_num).number_format = FORMATS[type(col)] if col_num != 1 else FORMATS['number']
+    xlsmng.write_rows(wb['consegne'], consegne, 2, DEFAULT_FONT, FORMATS, col_formats={1: FORMATS['number']})
 
     sheets = [
         wb['cifre'],
@@ -96,50 +169,97 @@ def overview_gnr(anno: int = date.today().year, mese: int = date.today().month)
         wb['litri manuale']
     ]
 
+    # days: giorni del mese, uno per riga
+    days = [[d] for d in Calendar().itermonthdates(anno, mese) if d.month == mese]
     for ws in sheets:
-        ws.cell(row=1, column=1).value = anno
-        ws.cell(row=1, column=1).font = Font(name=DEFAULT_FONT)
-        ws.cell(row=1, column=1).number_format = FORMATS['number']
+        xlsmng.write_rows(ws, [[anno]], 1, DEFAULT_FONT, FORMATS, col_formats={1: FORMATS['number']})
+        xlsmng.write_rows(ws, days, 3, DEFAULT_FONT, FORMATS)
 
-        for row_num, day in enumerate([d for d in Calendar().itermonthdates(anno, mese) if d.month == mese], start=3):
-            ws.cell(row=row_num, column=1).value = day
-            ws.cell(row=row_num, column=1).font = Font(name=DEFAULT_FONT)
-            ws.cell(row=row_num, column=1).number_format = FORMATS[date]
-
-    logger.info('saving overview for %(data)s... [%(data)s.xlsx]' % {'data': f'{anno}_{mese:0>2}'})
     wb.save(f'{PATH_RES}/{anno}_{mese:0>2}.xlsx')
-    cursor.close()
-    conn.close()
 
 
 def summary_viaggi(anno: int = date.today().year) -> None:
     """Generate the year trips summary excel by taking data from the database.
 
+    Every active plate of the vanaheim.targhe registry has a block of date and place columns, with a gap column
+    between two blocks and every other block mirrored as in the template, and the n-th row holds the n-th trip of
+    every plate. The trips are pivoted by a single query and its rows are written as they are fetched.
+
     :param int anno: The desired year for the summary.
     """
     logger = logger_ini(PATH_LOG, 'overview_doc')
-    cursor, conn = sqlmng.conx_ini()
+    with sqlmng.conx_session() as (cursor, _):
+        PLATE_MATCHER.load(cursor)
+        targhe = PLATE_MATCHER.plates
+        if not targhe:
+            logger.warning(f'no active plate in vanaheim.targhe... skipping summary for {anno}!')
+            return
 
-    viaggi = sqlmng.conx_read(cursor, QUERY_SUMMARY_VIAGGI, [anno]).fetchall()
-    if not viaggi:
-        logger.warning(f'no record founded in {anno}... skipping summary!')
-        return
+        viaggi = sqlmng.conx_stream(cursor, *summary_query(anno, targhe))
+        first = next(viaggi, None)
+        if not first:
+            logger.warning(f'no record founded in {anno}... skipping summary!')
+            return
 
-    wb = openpyxl.load_workbook(f'{PATH_SCHEME}/viaggi.xlsx')
-    ws = wb['viaggi']
-    for row_num, row in enumerate(viaggi, start=3):
-        for col_num, col in enumerate(row, start=1):
-            ws.cell(row=row_num, column=col_num).value = col
-            ws.cell(row=row_num, column=col_num).font = Font(name=DEFAULT_FONT)
-            ws.cell(row=row_num, column=col_num).number_format = FORMATS[type(col)]
-
-            if col_num == 4:
-                ws.cell(row=row_num, column=col_num).alignment = Alignment(horizontal='right')
+        wb = openpyxl.load_workbook(f'{PATH_SCHEME}/viaggi.xlsx')
+        summary_layout(wb['viaggi'], targhe)
+        # le sedi dei blocchi speculari sono allineate a destra, verso la colonna delle date
+        xlsmng.write_rows(wb['viaggi'], itertools.chain([first], viaggi), 3, DEFAULT_FONT, FORMATS, col_alignments={pos * 3 + 1: 'right' for pos in range(1, len(targhe), 2)})
 
     logger.info('saving summary for %(anno)d... [%(anno)d_TRIPS.xlsx]' % {'anno': anno})
     wb.save(f'{PATH_RES}/{anno}_TRIPS.xlsx')
-    cursor.close()
-    conn.close()
+
+
+def summary_query(anno: int, targhe: list[str]) -> tuple[str, list]:
+    """Build QUERY_SUMMARY_VIAGGI with the columns of the given plates.
+
+    :param int anno: The year of the summary.
+    :param list[str] targhe: The plates of the summary, in column order.
+    :return: A tuple containing the query string and its parameters.
+    """
+    # columns, args: colonne di ogni targa con gap tra due targhe, e relative targhe come parametri
+    columns, args = [], [date(anno, 1, 1), date(anno + 1, 1, 1), *targhe]
+    for pos, targa in enumerate(targhe):
+        block = [COLUMN_SUMMARY_DATA, COLUMN_SUMMARY_SEDE] if pos % 2 == 0 else [COLUMN_SUMMARY_SEDE, COLUMN_SUMMARY_DATA]
+        columns += ([COLUMN_SUMMARY_GAP] if pos else []) + block
+        args += [targa, targa]
+
+    return QUERY_SUMMARY_VIAGGI % {'targhe': ', '.join(['?'] * len(targhe)), 'columns': ',\n        '.join(columns)}, args
+
+
+def summary_layout(ws: Worksheet, targhe: list[str]) -> None:
+    """Write the header of the trips summary for the given plates, repeating the two plate blocks of the template.
+
+    :param Worksheet ws: The viaggi worksheet of the template.
+    :param list[str] targhe: The plates of the summary, in column order.
+    """
+    # template: celle di intestazione del modello come (colonna, riga, valore, stile), per il blocco normale (A:B),
+    # il gap (C) e il blocco speculare (D:E), con lo stile come (carattere, bordo, riempimento, allineamento, formato)
+    template = {
+        name: [(cell.column, cell.row, cell.value, (copy(cell.font), copy(cell.border), copy(cell.fill), copy(cell.alignment), cell.number_format))
+               for col in cols for cell in (ws.cell(row=1, column=col), ws.cell(row=2, column=col))]
+        for name, cols in (('normal', (1, 2)), ('gap', (3, )), ('mirrored', (4, 5)))
+    }
+    widths = {col: ws.column_dimensions[get_column_letter(col)].width for col in range(1, 6)}
+    ws.unmerge_cells('A1:B1')
+    ws.unmerge_cells('D1:E1')
+    for col in range(1, 6):
+        for row in (1, 2):
+            ws.cell(row=row, column=col).value = None
+
+    for pos, targa in enumerate(targhe):
+        # start: prima colonna del blocco, preceduta dal gap dal secondo blocco in poi
+        start = pos * 3 + 1
+        block = template['normal' if pos % 2 == 0 else 'mirrored']
+        for col, row, value, style in (template['gap'] if pos else []) + block:
+            # offset: posizione della colonna rispetto alla prima del blocco, il gap è quella precedente
+            offset = -1 if col == 3 else col - block[0][0]
+            cell = ws.cell(row=row, column=start + offset)
+            cell.value = targa if row == 1 and value else value
+            cell.font, cell.border, cell.fill, cell.alignment, cell.number_format = style
+            ws.column_dimensions[cell.column_letter].width = widths[col]
+
+        ws.merge_cells(start_row=1, start_column=start, end_row=1, end_column=start + 1)
 
 
 if __name__ == '__main__':
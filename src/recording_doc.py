@@ -1,40 +1,78 @@
+from caching_doc import PAGE_CACHE, doc_hash
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import date, datetime
-from difflib import SequenceMatcher
-from pyodbc import Cursor
+from extracting_doc import DOC_EXTRACTOR, PageRecord
+from matching_doc import PLATE_MATCHER
+from pyodbc import Cursor, Error
 from share import sqlmng
 from share.common import logger_ini
-from overview_doc import overview_gnr
+from share.perfmng import perf_add, perf_count, perf_dump, perf_merge, perf_profile, perf_snapshot, perf_timer
+from overview_doc import overview_batch
+import argparse
+import logging
 import os
 import pypdfium2
 import re
+import time
 
-__version__ = '4.1.9'
+__version__ = '5.11.0'
 
 PATH_PRJ = 'c:/source/vanaheim'
 PATH_LOG = f"{PATH_PRJ}/log/vanaheim_{date.today().strftime('%Y_%m_%d')}.log"
 PATH_WORKING_DIR = f'{PATH_PRJ}/DDTs'
 PATH_DISCARDED_DIR = f'{PATH_WORKING_DIR}/discarded'
 PATH_RECORDED_DIR = f'{PATH_WORKING_DIR}/recorded'
+PATH_FAILED_DIR = f'{PATH_WORKING_DIR}/failed'
+PATH_METRICS = f"{PATH_PRJ}/log/vanaheim_{datetime.now().strftime('%Y_%m_%d_%H%M%S')}"
+
+# RECORDING_WORKERS: numero di processi per l'estrazione delle pagine (1 per l'estrazione seriale), modificabile con VANAHEIM_RECORDING_WORKERS
+RECORDING_WORKERS = max(int(os.environ.get('VANAHEIM_RECORDING_WORKERS', '1')), 1)
+# RECORDING_CHUNK_SIZE: numero di pagine consecutive estratte da un processo per volta
+RECORDING_CHUNK_SIZE = 16
+# RECORDING_CHECKPOINT_PAGES: numero di pagine salvate per transazione, al termine della quale si aggiorna il checkpoint
+RECORDING_CHECKPOINT_PAGES = 100
+# RECORDING_PROFILE: abilita cProfile sulla sessione, salvando le statistiche in PATH_METRICS.prof (VANAHEIM_PROFILE=1)
+RECORDING_PROFILE = os.environ.get('VANAHEIM_PROFILE') == '1'
+# RECORDING_PAGE_LOG_LEVEL: livello dei log scritti per ogni pagina, modificabile con VANAHEIM_PAGE_LOG_LEVEL (es. DEBUG per nasconderli)
+RECORDING_PAGE_LOG_LEVEL = logging.getLevelNamesMapping().get(os.environ.get('VANAHEIM_PAGE_LOG_LEVEL', 'INFO').upper(), logging.INFO)
+# RECORDING_GAP_CHUNK: numero massimo di numeri di doc per ogni query sui gap message
+RECORDING_GAP_CHUNK = 1000
+# RECORDING_DISCARD_REFRESH: secondi dopo i quali il record di scarto mancante o incompleto di un doc di scarto viene cercato di nuovo su vanaheim.discard_consegne
+RECORDING_DISCARD_REFRESH = 60
 
 PATTERN_WORKING_DOC = r'^\d{4}_\d{2}_DDT_\d{4}_\d{4}(_P\d{3})*\.pdf$'
-PATTERN_NUMERO_DATA = r'Num\. D\.D\.T\. ([\d\.]+)\/(\w{2}) Data D\.D\.T\. (\d{2}\/\d{2}\/\d{4}) Pag'
-PATTERN_SEDE_SX = r"Luogo di partenza: .+\r\n([\w\s\.\&\-'\/]+)\r\n(\d{5}) ([\w\s'\-]+) \(?(\w{2})\)?\r\n"
-PATTERN_SEDE_DX = r"Luogo di consegna\r\n([\w\s\.\&\-'\/]+)\r\n.+\r\n(\d{0,5}) ?([\w\s'\-]+) \(?(\w{2})\)?\r\n"
-PATTERN_QUANTITA = r'(Quantità Prezzo\r\n.+)? (L|KG) ([\d\.]+),000\s'
-PATTERN_TARGA = r'Peso soggetto accisa\r\n([\w\d]{7})\r\n'
-
-QUERY_CHK_DUPLICATE = """
-    SELECT COUNT(*) nr_record
+
+QUERY_LOAD_DUPLICATE_DOCS = """
+    SELECT numero_documento,
+        genere_documento
     FROM vanaheim.consegne
-    WHERE (
-        sorgente = ?
-        AND pagina = ?
-    ) OR (
-        numero_documento = ?
-        AND genere_documento = ?
-        AND EXTRACT(YEAR FROM data_documento) = ?
+    WHERE anno = ?;
+"""
+QUERY_LOAD_DUPLICATE_PAGES = """
+    SELECT pagina
+    FROM vanaheim.consegne
+    WHERE sorgente = ?;
+"""
+QUERY_CHK_DUPLICATE_MANY = """
+    SELECT s.pagina
+    FROM (VALUES %(values)s) s (sorgente, pagina, numero_documento, genere_documento, anno)
+    WHERE EXISTS (
+        SELECT 1
+        FROM vanaheim.consegne c
+        WHERE c.sorgente = s.sorgente
+            AND c.pagina = s.pagina
+    ) OR EXISTS (
+        SELECT 1
+        FROM vanaheim.consegne c
+        WHERE c.anno = s.anno
+            AND c.numero_documento = s.numero_documento
+            AND c.genere_documento = s.genere_documento
     );
 """
+QUERY_LOCK_CONSEGNE = """
+    LOCK TABLE vanaheim.consegne IN SHARE ROW EXCLUSIVE MODE;
+"""
 QUERY_INSERT_CONSEGNE = """
     INSERT INTO vanaheim.consegne (
         numero_documento,
@@ -53,26 +91,96 @@ QUERY_INSERT_CONSEGNE = """
 QUERY_INSERT_MESSAGGI = """
     INSERT INTO vanaheim.messaggi (
         genere,
-        testo
-    ) VALUES (?, ?)
-    RETURNING id;
+        testo,
+        numero_documento,
+        genere_documento,
+        data_documento,
+        anno,
+        sorgente,
+        pagina,
+        errore
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
 """
-QUERY_CHK_GAPS = """
-    SELECT cg.numero, 
-        cg.anno 
-    FROM vanaheim.consegne_gap_vw cg 
-        LEFT JOIN vanaheim.messaggi_gap_vw mg 
-            ON cg.numero = mg.numero_documento 
-            AND cg.anno = mg.anno 
-    WHERE cg.discarded IS FALSE
-        AND mg.numero_documento IS NULL
-    ORDER BY cg.anno, cg.numero;
+QUERY_GAP_RANGES = """
+    WITH sessione AS (
+        SELECT anno,
+            MIN(numero_documento) min_num,
+            MAX(numero_documento) max_num
+        FROM vanaheim.consegne
+        WHERE data_registrazione >= ?
+        GROUP BY anno
+    )
+    SELECT s.anno,
+        COALESCE((
+            SELECT MAX(c.numero_documento)
+            FROM vanaheim.consegne c
+            WHERE c.anno = s.anno
+                AND c.numero_documento < s.min_num
+        ), s.min_num) min_num,
+        COALESCE((
+            SELECT MIN(c.numero_documento)
+            FROM vanaheim.consegne c
+            WHERE c.anno = s.anno
+                AND c.numero_documento > s.max_num
+        ), s.max_num) max_num
+    FROM sessione s
+    ORDER BY s.anno;
 """
-QUERY_CHK_RECORD_GAP = """
-    SELECT id
+QUERY_GAP_NUMBERS = """
+    SELECT numero_documento numero
+    FROM vanaheim.consegne
+    WHERE anno = ?
+        AND numero_documento BETWEEN ? AND ?
+    UNION
+    SELECT numero_documento
+    FROM vanaheim.messaggi_discard_vw
+    WHERE anno = ?
+        AND numero_documento BETWEEN ? AND ?
+    UNION
+    SELECT numero_documento
     FROM vanaheim.messaggi_gap_vw
-    WHERE numero_documento = ?
-        AND anno = ?;
+    WHERE anno = ?
+        AND numero_documento BETWEEN ? AND ?;
+"""
+QUERY_GAP_LEFT = """
+    SELECT s.numero_documento numero,
+        s.anno
+    FROM (VALUES %(values)s) s (anno, numero_documento)
+    WHERE EXISTS (
+        SELECT 1
+        FROM vanaheim.consegne c
+        WHERE c.anno = s.anno
+            AND c.numero_documento < s.numero_documento
+    ) AND EXISTS (
+        SELECT 1
+        FROM vanaheim.consegne c
+        WHERE c.anno = s.anno
+            AND c.numero_documento > s.numero_documento
+    ) AND NOT EXISTS (
+        SELECT 1
+        FROM vanaheim.consegne c
+        WHERE c.anno = s.anno
+            AND c.numero_documento = s.numero_documento
+    ) AND NOT EXISTS (
+        SELECT 1
+        FROM vanaheim.messaggi_discard_vw m
+        WHERE m.anno = s.anno
+            AND m.numero_documento = s.numero_documento
+    ) AND NOT EXISTS (
+        SELECT 1
+        FROM vanaheim.messaggi_gap_vw m
+        WHERE m.anno = s.anno
+            AND m.numero_documento = s.numero_documento
+    );
+"""
+QUERY_CLOSE_RECORD_GAPS = """
+    UPDATE vanaheim.messaggi m
+    SET stato = FALSE
+    FROM (VALUES %(values)s) s (anno, numero_documento)
+    WHERE m.genere = 'GAP'
+        AND m.stato IS TRUE
+        AND m.anno = s.anno
+        AND m.numero_documento = s.numero_documento;
 """
 QUERY_UPDATE_MESSAGGI = """
     UPDATE vanaheim.messaggi
@@ -80,13 +188,27 @@ QUERY_UPDATE_MESSAGGI = """
     WHERE id = ?;
 """
 QUERY_OVERVIEW_DATE = """
-    SELECT DISTINCT EXTRACT(YEAR FROM data_documento)::INT anno, 
+    SELECT DISTINCT anno,
         EXTRACT(MONTH FROM data_documento)::INT mese
     FROM vanaheim.consegne 
-    WHERE data_registrazione::DATE = ?::DATE
+    WHERE data_registrazione >= ?
     ORDER BY 1, 2;
 """
 QUERY_INSERT_DISCARD_CONSEGNE = """
+    WITH messaggio AS (
+        INSERT INTO vanaheim.messaggi (
+            genere,
+            testo,
+            numero_documento,
+            genere_documento,
+            data_documento,
+            anno,
+            sorgente,
+            pagina,
+            errore
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    )
     INSERT INTO vanaheim.discard_consegne (
         numero_documento, 
         genere_documento,
@@ -98,9 +220,9 @@ QUERY_INSERT_DISCARD_CONSEGNE = """
         targa,
         sorgente,
         id_messaggio 
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT id FROM messaggio));
 """
-QUERY_CHK_DISCARD_CONSEGNE = """
+QUERY_LOAD_DISCARD_CONSEGNE = """
     SELECT numero_documento,
         genere_documento,
         data_documento,
@@ -109,20 +231,44 @@ QUERY_CHK_DISCARD_CONSEGNE = """
         quantita,
         data_consegna,
         targa,
-        id_messaggio 
-    FROM vanaheim.discard_consegne 
-    WHERE stato IS TRUE 
-        AND sorgente = ?;
+        id_messaggio,
+        sorgente
+    FROM vanaheim.discard_consegne
+    WHERE stato IS TRUE
+    ORDER BY id;
 """
 
-ENUM_TARGA = [
-    'ES745WH',
-    'FC065ZW'
-]
+QUERY_LOAD_CHECKPOINT = """
+    SELECT sha256,
+        pagina,
+        pagine_scartate
+    FROM vanaheim.checkpoint_consegne
+    WHERE sorgente = ?
+        AND stato IS TRUE;
+"""
+QUERY_SAVE_CHECKPOINT = """
+    INSERT INTO vanaheim.checkpoint_consegne (
+        sorgente,
+        sha256,
+        pagina,
+        pagine_scartate
+    ) VALUES (?, ?, ?, ?)
+    ON CONFLICT (sorgente) DO UPDATE
+    SET sha256 = EXCLUDED.sha256,
+        pagina = EXCLUDED.pagina,
+        pagine_scartate = EXCLUDED.pagine_scartate,
+        stato = TRUE,
+        data_checkpoint = NOW();
+"""
+QUERY_CLOSE_CHECKPOINT = """
+    UPDATE vanaheim.checkpoint_consegne
+    SET stato = FALSE
+    WHERE sorgente = ?;
+"""
 
 PATTERN_MESSAGE_DISCARD = {
     'genere': 'DISCARD',
-    'testo': 'Page %(page)d of doc %(doc)s discarded for error on %(pattern)s [numero: %(numero_documento)d, genere: %(genere_documento)s, data: %(data_documento)s]'
+    'testo': 'Page %(page)d of doc %(doc)s discarded for error on %(pattern)s [numero: %(numero_documento)s, genere: %(genere_documento)s, data: %(data_documento)s]'
 }
 PATTERN_MESSAGE_GAPS = {
     'genere': 'GAP',
@@ -134,350 +280,779 @@ PATTERN_MESSAGE_SIMILARITY_CRASH = {
 }
 
 
-def doc_scanner(working_doc: str, cursor: Cursor, recording_begin: datetime = datetime.now()) -> tuple[int, int]:
+def doc_scanner(working_doc: str, cursor: Cursor, recording_begin: datetime = datetime.now(), pool: Executor = None, duplicates: dict = None) -> tuple[int, int]:
     """Parse the information from pdf document and save on database.
 
+    The pages are read and parsed by doc_reader(), in parallel if a process pool is given, while the
+    duplicate, discard and insert logic is applied here one page at a time in page order.
+
+    The records are saved every RECORDING_CHECKPOINT_PAGES pages and the last saved page is kept in a checkpoint, so
+    a doc left as '.recording' by an interrupted run starts again from the next page if its content is unchanged.
+
     :param str working_doc: Path to the pdf document.
     :param Cursor cursor: The cursor to the database.
     :param datetime recording_begin: The starting timestamp of the process, defaults to now().
+    :param Executor pool: The process pool used to extract the pages, defaults to None (serial extraction).
+    :param dict duplicates: The duplicate index of the session from duplicate_ini(), defaults to None (new index).
     :return: A tuple containing the number of document page and number of discarded page.
     """
     logger = logger_ini(PATH_LOG, 'recording_doc')
+    duplicates = duplicates if duplicates is not None else duplicate_ini()
     # working_doc: percorso con suffisso '.recording' (es. c:/source/vanaheim/DDTs/2024_01_DDT_0001_0267.pdf.recording)
     # doc: raw PDF doc
-    doc = pypdfium2.PdfDocument(working_doc)
+    with perf_timer('open_pdf'):
+        doc = pypdfium2.PdfDocument(working_doc)
     # doc_pages: numero totale di pagine di working_doc
     doc_pages = len(doc)
+    # working_doc_name: basename del doc in registrazione working_doc (es. 2024_01_DDT_0001_0267.pdf)
+    working_doc_name = working_doc.replace('.recording', '').split('/')[-1]
+    # checkpoint: ultima pagina salvata di working_doc in una registrazione precedente
+    with perf_timer('hash_pdf'):
+        checkpoint = checkpoint_load(cursor, working_doc)
+    if checkpoint['page']:
+        logger.info(f"resuming {working_doc_name} from page {checkpoint['page'] + 1}...")
+    # leggo il registro delle targhe, se non è stato letto di recente
+    PLATE_MATCHER.load(cursor)
+
     # discarded_pages: dizionario con informazioni sulle pagine in errore
     discarded_pages = {
         # number: numero di pagine in errore
-        'number': 0,
+        'number': checkpoint['discarded'],
         # is_discarded: vero se un'estrazione su page è in errore
         'is_discarded': False,
         # discard_message: messaggio da salvare se is_discarded è vero
         'discard_message': None
     }
 
-    # working_doc_name: basename del doc in registrazione working_doc (es. 2024_01_DDT_0001_0267.pdf)
-    working_doc_name = working_doc.replace('.recording', '').split('/')[-1]
+    # staging: record da salvare al prossimo checkpoint in un'unica transazione
+    staging = staging_ini()
 
     # working_page: numero di pagina in registrazione
-    # page: raw PDF page
-    for working_page, page in enumerate(doc, start=1):
-        logger.info(f'scanning on page {working_page} of {working_doc_name}...')
-        text = page.get_textpage().get_text_bounded()
-
-        # doc_info: dizionario con informazioni estratte da page
-        doc_info = {}
-
-        # estrazione numero_documento, genere_documento e data_documento
-        search = re.search(PATTERN_NUMERO_DATA, text)
-        doc_info['numero_documento'] = int(search.group(1).replace('.', '')) if search else None
-        doc_info['genere_documento'] = search.group(2).upper() if search else None
-        doc_info['data_documento'] = datetime.strptime(search.group(3)[6:] + '-' + search.group(3)[3:5] + '-' + search.group(3)[0:2], '%Y-%m-%d').date() if search else None
-
-        if not search:
-            logger.warning(f"discarding page {working_page} of {working_doc_name} for error on PATTERN_NUMERO_DATA...")
-            if not discarded_pages['is_discarded']:
-                discarded_pages['discard_message'] = (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
-                    'page': working_page,
-                    'doc': working_doc_name,
-                    'pattern': 'PATTERN_NUMERO_DATA',
-                    'numero_documento': None,
-                    'genere_documento': None,
-                    'data_documento': None
-                })
-            discarded_pages['is_discarded'] = True
+    # doc_record: informazioni estratte dalla pagina (PageRecord)
+    # errors: elenco dei pattern in errore sulla pagina
+    # cache_hits, cache_misses: contatori della cache dei testi all'inizio del doc
+    cache_hits, cache_misses = PAGE_CACHE.hits, PAGE_CACHE.misses
+    for working_page, doc_record, errors in doc_reader(working_doc, doc, pool, checkpoint['page'] + 1, checkpoint['sha256']):
+        # salvo le pagine precedenti se completano un checkpoint
+        if working_page > checkpoint['page'] + 1 and not (working_page - 1) % RECORDING_CHECKPOINT_PAGES:
+            doc_flush(working_doc, doc, cursor, staging, discarded_pages, duplicates, checkpoint, working_page - 1)
+            staging = staging_ini()
 
-        # estrazione sede_consegna
-        search = re.search(PATTERN_SEDE_DX, text)
-        if search:
-            doc_info['ragione_sociale'] = search.group(1).upper().strip()
-            doc_info['sede_consegna'] = search.group(3).upper().strip()
-
-            logger.warning(f"error on PATTERN_SEDE_DX on page {working_page} of {working_doc_name}... moving on PATTERN_SEDE_SX!")
-        else:
-            search = re.search(PATTERN_SEDE_SX, text)
-            doc_info['ragione_sociale'] = search.group(1).upper().strip() if search else None
-            doc_info['sede_consegna'] = search.group(3).upper().strip() if search else None
-
-            if not search:
-                logger.warning(f"discarding page {working_page} of {working_doc_name} for error on PATTERN_SEDE...")
-                if not discarded_pages['is_discarded']:
-                    discarded_pages['discard_message'] = (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
-                        'page': working_page,
-                        'doc': working_doc_name,
-                        'pattern': 'PATTERN_SEDE',
-                        'numero_documento': doc_info['numero_documento'],
-                        'genere_documento': doc_info['genere_documento'],
-                        'data_documento': doc_info['data_documento']
-                    })
-                discarded_pages['is_discarded'] = True
-
-        # estrazione quantità
-        search = re.search(PATTERN_QUANTITA, text)
-        doc_info['quantita'] = int(search.group(3).replace('.', '')) if search else None
-
-        if not search:
-            logger.warning(f"discarding page {working_page} of {working_doc_name} for error on PATTERN_QUANTITA...")
-            if not discarded_pages['is_discarded']:
-                discarded_pages['discard_message'] = (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
-                    'page': working_page,
-                    'doc': working_doc_name,
-                    'pattern': 'PATTERN_QUANTITA',
-                    'numero_documento': doc_info['numero_documento'],
-                    'genere_documento': doc_info['genere_documento'],
-                    'data_documento': doc_info['data_documento']
-                })
-            discarded_pages['is_discarded'] = True
+        logger.log(RECORDING_PAGE_LOG_LEVEL, 'scanning on page %d of %s...', working_page, working_doc_name)
+        perf_count('pages')
+        discarded_pages['is_discarded'] = False
 
-        # duplico data_documento in data_consegna
-        doc_info['data_consegna'] = doc_info['data_documento']
+        for pattern in errors:
+            logger.warning('discarding page %d of %s for error on %s...', working_page, working_doc_name, pattern)
+        if errors:
+            discarded_pages['discard_message'] = message_gnr(PATTERN_MESSAGE_DISCARD, {
+                'page': working_page,
+                'doc': working_doc_name,
+                'pattern': errors[0],
+                'numero_documento': doc_record.numero_documento,
+                'genere_documento': doc_record.genere_documento,
+                'data_documento': doc_record.data_documento
+            })
+            discarded_pages['is_discarded'] = True
 
-        # estrazione targa
-        search = re.search(PATTERN_TARGA, text)
-        if search:
-            targa = search.group(1).upper()
-            doc_info['targa'] = targa if targa in ENUM_TARGA else check_similarity(targa)
+        # verifica targa
+        if doc_record.targa:
+            doc_record = doc_record if doc_record.targa in PLATE_MATCHER else doc_record._replace(targa=check_similarity(doc_record.targa))
 
-            if doc_info['targa'] not in ENUM_TARGA and sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_SIMILARITY_CRASH['genere'], PATTERN_MESSAGE_SIMILARITY_CRASH['testo'] % {
-                'targa': doc_info['targa'],
-                'page': working_page,
-                'doc': working_doc_name
-            })) != 1:
-                logger.error('error on saving similarity crash message record...')
-        else:
-            doc_info['targa'] = None
-
-            logger.warning(f"discarding page {working_page} of {working_doc_name} for error on PATTERN_TARGA...")
-            if not discarded_pages['is_discarded']:
-                discarded_pages['discard_message'] = (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
+            if doc_record.targa not in PLATE_MATCHER:
+                staging['messaggi'].append(message_gnr(PATTERN_MESSAGE_SIMILARITY_CRASH, {
+                    'targa': doc_record.targa,
                     'page': working_page,
-                    'doc': working_doc_name,
-                    'pattern': 'PATTERN_TARGA',
-                    'numero_documento': doc_info['numero_documento'],
-                    'genere_documento': doc_info['genere_documento'],
-                    'data_documento': doc_info['data_documento']
-                })
-            discarded_pages['is_discarded'] = True
+                    'doc': working_doc_name
+                }))
 
         # controllo se page è in errore
         if discarded_pages['is_discarded']:
-            is_many_discard = re.findall(r'_P\d{3}', working_doc_name)
-            chk_discard = sqlmng.conx_read(cursor, QUERY_CHK_DISCARD_CONSEGNE, [re.sub(r'(_P\d{3}){2,}', is_many_discard[0], working_doc_name) if len(is_many_discard) > 1 else working_doc_name]).fetchone()
+            chk_discard = check_discard(cursor, duplicates, working_doc_name)
 
             # controllo se esiste record di scarto
             if chk_discard:
                 if None not in chk_discard:
                     # controllo se è un duplicato
-                    chk_dup = sqlmng.conx_read(cursor, QUERY_CHK_DUPLICATE, (
+                    chk_dup = (chk_discard.numero_documento, chk_discard.genere_documento, chk_discard.data_documento.year) in staging['keys'] or check_duplicate(cursor, duplicates, (
                         working_doc_name,
                         working_page,
                         chk_discard.numero_documento,
                         chk_discard.genere_documento,
                         chk_discard.data_documento.year
-                    )).fetchone()[0]
+                    ))
 
                     if chk_dup:
-                        discarded_pages['number'] += 1
-                        discarded_doc = discard_doc(working_doc, working_page)
-                        discarded_doc_name = discarded_doc.split('/')[-1]
-
-                        logger.warning(f"discarding page {working_page} of {working_doc_name} because already recorded... [{discarded_doc_name}]")
-                        if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
-                            'page': working_page,
-                            'doc': working_doc_name,
-                            'pattern': 'QUERY_CHK_DUPLICATE',
-                            'numero_documento': doc_info['numero_documento'],
-                            'genere_documento': doc_info['genere_documento'],
-                            'data_documento': doc_info['data_documento']
-                        })) != 1:
-                            logger.error('error on saving discard message record...')
-                        continue
-                    # salvo record di scarto in vanaheim.consegne
-                    elif sqlmng.conx_write(cursor, QUERY_INSERT_CONSEGNE, (
-                        *chk_discard[:-1],
-                        working_doc_name,
-                        working_page,
-                        recording_begin
-                    )) != 1:
                         discarded_pages['number'] += 1
                         # discarded_doc: percorso del doc di scarto (es. c:/source/vanaheim/DDTs/discarded/2024_01_DDT_0001_0267_P005.pdf)
-                        discarded_doc = discard_doc(working_doc, working_page)
+                        discarded_doc = discard_name(working_doc, working_page)
+                        staging['discard_pages'].append(working_page)
                         # discarded_doc_name: basename del doc di scarto (es. 2024_01_DDT_0001_0267_P005.pdf)
                         discarded_doc_name = discarded_doc.split('/')[-1]
 
-                        logger.error(f"discarding page {working_page} of {working_doc_name} for error on saving record from discard_consegne... [{discarded_doc_name}]")
-                        if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
+                        logger.warning('discarding page %d of %s because already recorded... [%s]', working_page, working_doc_name, discarded_doc_name)
+                        staging['messaggi'].append(message_gnr(PATTERN_MESSAGE_DISCARD, {
                             'page': working_page,
                             'doc': working_doc_name,
-                            'pattern': 'QUERY_INSERT_CONSEGNE from discard_consegne',
-                            'numero_documento': doc_info['numero_documento'],
-                            'genere_documento': doc_info['genere_documento'],
-                            'data_documento': doc_info['data_documento']
-                        })) != 1:
-                            logger.error('error on saving discard message record...')
-                    elif sqlmng.conx_write(cursor, QUERY_UPDATE_MESSAGGI, chk_discard.id_messaggio) != 1:
-                        logger.error(f'error on update message status... [message id: {chk_discard.id_messaggio}]')
+                            'pattern': 'QUERY_CHK_DUPLICATE',
+                            'numero_documento': doc_record.numero_documento,
+                            'genere_documento': doc_record.genere_documento,
+                            'data_documento': doc_record.data_documento
+                        }))
+                    else:
+                        # salvo record di scarto in vanaheim.consegne, senza id_messaggio e sorgente
+                        staging['consegne'][working_page] = (
+                            *chk_discard[:-2],
+                            working_doc_name,
+                            working_page,
+                            recording_begin
+                        )
+                        staging['keys'].add((chk_discard.numero_documento, chk_discard.genere_documento, chk_discard.data_documento.year))
+                        staging['update_messaggi'][working_page] = (chk_discard.id_messaggio, )
+                        # il record di scarto riconciliato non è più attivo, come dopo QUERY_UPDATE_MESSAGGI
+                        duplicates['discards'].pop(discard_source(working_doc_name), None)
                 else:
                     logger.warning(f'found NULL cell on saving consegne from discard_consegne in doc {working_doc_name}... skipping record!')
             else:
                 discarded_pages['number'] += 1
-                discarded_doc = discard_doc(working_doc, working_page)
+                discarded_doc = discard_name(working_doc, working_page)
+                staging['discard_pages'].append(working_page)
                 discarded_doc_name = discarded_doc.split('/')[-1]
 
-                if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, discarded_pages['discard_message']) != 1:
-                    logger.error('error on saving discard message record...')
-                else:
-                    doc_info['sorgente'] = discarded_doc_name
-                    doc_info['id_messaggio'] = cursor.fetchone()[0]
-                    logger.info(doc_info)
-
-                    if sqlmng.conx_write(cursor, QUERY_INSERT_DISCARD_CONSEGNE, [value for value in doc_info.values()]) != 1:
-                        logger.error(f'error on saving discard_consegne record... [message id: {doc_info['id_messaggio']}]')
+                logger.log(RECORDING_PAGE_LOG_LEVEL, '%s [sorgente: %s]', doc_record, discarded_doc_name)
 
-            discarded_pages['is_discarded'] = False
+                # salvo messaggio e record di scarto in vanaheim.discard_consegne
+                staging['discard_consegne'].append((*discarded_pages['discard_message'], *doc_record, discarded_doc_name))
             continue
 
-        doc_info['sorgente'] = working_doc_name
-        doc_info['pagina'] = working_page
-        doc_info['data_registrazione'] = recording_begin
-        logger.info(doc_info)
+        logger.log(RECORDING_PAGE_LOG_LEVEL, '%s [sorgente: %s, pagina: %d]', doc_record, working_doc_name, working_page)
 
         # controllo se è un duplicato
-        chk_dup = sqlmng.conx_read(cursor, QUERY_CHK_DUPLICATE, (
-            doc_info['sorgente'],
-            doc_info['pagina'],
-            doc_info['numero_documento'],
-            doc_info['genere_documento'],
-            doc_info['data_documento'].year
-        )).fetchone()[0]
+        chk_dup = (doc_record.numero_documento, doc_record.genere_documento, doc_record.data_documento.year) in staging['keys'] or check_duplicate(cursor, duplicates, (
+            working_doc_name,
+            working_page,
+            doc_record.numero_documento,
+            doc_record.genere_documento,
+            doc_record.data_documento.year
+        ))
 
         if chk_dup:
             discarded_pages['number'] += 1
-            discarded_doc = discard_doc(working_doc, working_page)
+            discarded_doc = discard_name(working_doc, working_page)
+            staging['discard_pages'].append(working_page)
             discarded_doc_name = discarded_doc.split('/')[-1]
 
-            logger.warning(f"discarding page {working_page} of {working_doc_name} because already recorded... [{discarded_doc_name}]")
-            if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
+            logger.warning('discarding page %d of %s because already recorded... [%s]', working_page, working_doc_name, discarded_doc_name)
+            staging['messaggi'].append(message_gnr(PATTERN_MESSAGE_DISCARD, {
                 'page': working_page,
                 'doc': working_doc_name,
                 'pattern': 'QUERY_CHK_DUPLICATE',
-                'numero_documento': doc_info['numero_documento'],
-                'genere_documento': doc_info['genere_documento'],
-                'data_documento': doc_info['data_documento']
-            })) != 1:
-                logger.error('error on saving discard message record...')
+                'numero_documento': doc_record.numero_documento,
+                'genere_documento': doc_record.genere_documento,
+                'data_documento': doc_record.data_documento
+            }))
             continue
+
         # salvo record in vanaheim.consegne
-        elif sqlmng.conx_write(cursor, QUERY_INSERT_CONSEGNE, [value for value in doc_info.values()]) != 1:
+        staging['consegne'][working_page] = (*doc_record, working_doc_name, working_page, recording_begin)
+        staging['keys'].add((doc_record.numero_documento, doc_record.genere_documento, doc_record.data_documento.year))
+
+    # salvo le pagine rimaste e porto il checkpoint all'ultima pagina
+    doc_flush(working_doc, doc, cursor, staging, discarded_pages, duplicates, checkpoint, doc_pages)
+    doc.close()
+
+    logger.info(f'page cache on {working_doc_name}... [{PAGE_CACHE.hits - cache_hits} hits, {PAGE_CACHE.misses - cache_misses} misses]')
+    return doc_pages, discarded_pages['number']
+
+
+def staging_ini() -> dict:
+    """Initialize the records of the pages to be saved by doc_flush() in a single transaction.
+
+    :return: The empty staging area.
+    """
+    return {
+        # messaggi: parametri di QUERY_INSERT_MESSAGGI
+        'messaggi': [],
+        # discard_consegne: parametri di QUERY_INSERT_DISCARD_CONSEGNE
+        'discard_consegne': [],
+        # consegne: parametri di QUERY_INSERT_CONSEGNE per ogni pagina
+        'consegne': {},
+        # update_messaggi: parametri di QUERY_UPDATE_MESSAGGI per ogni pagina
+        'update_messaggi': {},
+        # keys: chiavi (numero_documento, genere_documento, anno) dei record in consegne non ancora salvati
+        'keys': set(),
+        # discard_pages: numeri di pagina da estrarre in PATH_DISCARDED_DIR
+        'discard_pages': []
+    }
+
+
+def doc_flush(working_doc: str, doc: pypdfium2.PdfDocument, cursor: Cursor, staging: dict, discarded_pages: dict, duplicates: dict, checkpoint: dict, last_page: int) -> None:
+    """Save the staged records of a pdf document in a single transaction, then move its checkpoint to last_page.
+
+    On a database error the transaction is rolled back, the document closed and the error raised again.
+
+    :param str working_doc: Path to the pdf document.
+    :param PdfDocument doc: The pdf document already opened.
+    :param Cursor cursor: The cursor to the database.
+    :param dict staging: The records to be saved, from staging_ini().
+    :param dict discarded_pages: The discarded pages information of doc_scanner().
+    :param dict duplicates: The duplicate index from duplicate_ini().
+    :param dict checkpoint: The checkpoint of the document from checkpoint_load().
+    :param int last_page: The last page number included in staging.
+    """
+    logger = logger_ini(PATH_LOG, 'recording_doc')
+    working_doc_name = working_doc.replace('.recording', '').split('/')[-1]
+
+    # salvo i record delle pagine in un'unica transazione
+    try:
+        # verifico i duplicati registrati da altri processi dopo il caricamento dell'indice
+        sqlmng.conx_write(cursor, QUERY_LOCK_CONSEGNE)
+        for working_page in check_duplicate_many(cursor, staging['consegne'].values()):
+            record = staging['consegne'].pop(working_page)
+            staging['update_messaggi'].pop(working_page, None)
+
             discarded_pages['number'] += 1
-            discarded_doc = discard_doc(working_doc, working_page)
+            discarded_doc = discard_name(working_doc, working_page)
+            staging['discard_pages'].append(working_page)
             discarded_doc_name = discarded_doc.split('/')[-1]
 
-            logger.error(f"discarding page {working_page} of {working_doc_name} for error on saving record... [{discarded_doc_name}]")
-            if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_DISCARD['genere'], PATTERN_MESSAGE_DISCARD['testo'] % {
+            logger.warning('discarding page %d of %s because already recorded by another process... [%s]', working_page, working_doc_name, discarded_doc_name)
+            staging['messaggi'].append(message_gnr(PATTERN_MESSAGE_DISCARD, {
                 'page': working_page,
                 'doc': working_doc_name,
-                'pattern': 'QUERY_INSERT_CONSEGNE',
-                'numero_documento': doc_info['numero_documento'],
-                'genere_documento': doc_info['genere_documento'],
-                'data_documento': doc_info['data_documento']
-            })) != 1:
-                logger.error('error on saving discard message record...')
-
-        # controllo se bisogna aggiornare un gap message
-        chk_gap = sqlmng.conx_read(cursor, QUERY_CHK_RECORD_GAP, (
-            doc_info['numero_documento'],
-            doc_info['data_documento'].year
-        )).fetchone()
-        if chk_gap and sqlmng.conx_write(cursor, QUERY_UPDATE_MESSAGGI, [chk_gap.id]) != 1:
-            logger.error(f'error on update message status... [message id: {chk_gap.id}]')
+                'pattern': 'QUERY_CHK_DUPLICATE',
+                'numero_documento': record[0],
+                'genere_documento': record[1],
+                'data_documento': record[2]
+            }))
+
+        sqlmng.conx_write_many(cursor, QUERY_INSERT_MESSAGGI, staging['messaggi'], fast=True)
+        sqlmng.conx_write_many(cursor, QUERY_INSERT_DISCARD_CONSEGNE, staging['discard_consegne'])
+        sqlmng.conx_write_many(cursor, QUERY_INSERT_CONSEGNE, list(staging['consegne'].values()), fast=True)
+        sqlmng.conx_write_many(cursor, QUERY_UPDATE_MESSAGGI, list(staging['update_messaggi'].values()), fast=True)
+        # disattivo i gap message dei numeri registrati con un'unica query
+        gap_close(cursor, ((record[2].year, record[0]) for record in staging['consegne'].values()))
+
+        # salvo il checkpoint con i record, così una ripresa non rilegge mai pagine già confermate
+        checkpoint_save(cursor, working_doc, {**checkpoint, 'page': last_page, 'discarded': discarded_pages['number']})
+
+        # estraggo le pagine di scarto dal doc ancora aperto prima di confermare i record che le riferiscono
+        with perf_timer('discard_export'):
+            discard_doc(working_doc, staging['discard_pages'], doc, checkpoint['sha256'])
+        sqlmng.conx_commit(cursor)
+    except Error:
+        cursor.rollback()
+        doc.close()
+        # i record di scarto riconciliati tornano attivi, quindi vanno riletti
+        duplicates['discards'] = None
+        logger.error(f"error on saving records of {working_doc_name}... rolling back pages after {checkpoint['page']}!")
+        raise
+
+    perf_count('records_saved', len(staging['consegne']))
+    perf_count('records_discarded', len(staging['discard_pages']))
+    # aggiorno l'indice dei duplicati con i record salvati
+    duplicate_add(duplicates, staging['consegne'].values())
+    checkpoint.update(page=last_page, discarded=discarded_pages['number'])
+
+
+def doc_reader(working_doc: str, doc: pypdfium2.PdfDocument, pool: Executor = None, first_page: int = 1, working_hash: str = None) -> Iterator[tuple[int, PageRecord, list[str]]]:
+    """Read the pages of a pdf document and parse their information, yielding them in page order.
+
+    :param str working_doc: Path to the pdf document.
+    :param PdfDocument doc: The pdf document already opened, used for the serial extraction.
+    :param Executor pool: The process pool used to extract the pages, defaults to None (serial extraction).
+    :param int first_page: The number of the first page to be read, defaults to 1.
+    :param str working_hash: The sha256 of the pdf document to use the page text cache, defaults to None (no cache).
+    :return: An iterator of tuples containing the page number, the page record and the failed patterns.
+    """
+    if not pool:
+        for working_page in range(first_page, len(doc) + 1):
+            yield working_page, *page_scan(doc, working_page, working_hash)
+        return
+
+    # chunks: gruppi di pagine consecutive assegnate ai processi (es. [range(1, 17), range(17, 33), ...])
+    chunks = [range(page, min(page + RECORDING_CHUNK_SIZE, len(doc) + 1)) for page in range(first_page, len(doc) + 1, RECORDING_CHUNK_SIZE)]
+
+    # pool.map restituisce i risultati nell'ordine dei chunks
+    for pages, (res, hits, misses, metrics) in zip(chunks, pool.map(doc_extractor, [working_doc] * len(chunks), chunks, [working_hash] * len(chunks))):
+        # riporto i contatori della cache e le metriche del processo
+        PAGE_CACHE.hits += hits
+        PAGE_CACHE.misses += misses
+        perf_merge(metrics)
+        for working_page, page_info in zip(pages, res):
+            yield working_page, *page_info
+
+
+def doc_extractor(working_doc: str, pages: range, working_hash: str = None) -> tuple[list[tuple[PageRecord, list[str]]], int, int, dict]:
+    """Extract and parse a range of pages of a pdf document, used as a worker of the process pool.
+
+    :param str working_doc: Path to the pdf document.
+    :param range pages: The page numbers to be extracted, starting from 1.
+    :param str working_hash: The sha256 of the pdf document to use the page text cache, defaults to None (no cache).
+    :return: A tuple containing the page record and the failed patterns of every page, the cache hits and misses, and the metrics of the worker.
+    """
+    # azzero le metriche ereditate dal processo principale o già riportate
+    perf_snapshot(reset=True)
+    cache_hits, cache_misses = PAGE_CACHE.hits, PAGE_CACHE.misses
+    with perf_timer('open_pdf'):
+        doc = pypdfium2.PdfDocument(working_doc)
+    res = [page_scan(doc, page, working_hash) for page in pages]
 
     doc.close()
-    return doc_pages, discarded_pages['number']
+    return res, PAGE_CACHE.hits - cache_hits, PAGE_CACHE.misses - cache_misses, perf_snapshot(reset=True)
+
+
+def page_scan(doc: pypdfium2.PdfDocument, working_page: int, working_hash: str = None) -> tuple[PageRecord, list[str]]:
+    """Get the text of a page and parse its information.
+
+    :param PdfDocument doc: The pdf document already opened.
+    :param int working_page: The page number, starting from 1.
+    :param str working_hash: The sha256 of the pdf document, defaults to None (no cache).
+    :return: A tuple containing the page record and the list of failed patterns.
+    """
+    text = page_text(doc, working_page, working_hash)
+
+    start = time.perf_counter()
+    res = DOC_EXTRACTOR.scan(text)
+    perf_add('match_regex', start)
+    return res
+
+
+def page_text(doc: pypdfium2.PdfDocument, working_page: int, working_hash: str = None) -> str:
+    """Get the text of a page from the page text cache, extracting it with pdfium and caching it when missing.
+
+    :param PdfDocument doc: The pdf document already opened.
+    :param int working_page: The page number, starting from 1.
+    :param str working_hash: The sha256 of the pdf document, defaults to None (no cache).
+    :return: The text of the page.
+    """
+    text = PAGE_CACHE.get(working_hash, working_page) if working_hash else None
+    if text is None:
+        start = time.perf_counter()
+        text = doc[working_page - 1].get_textpage().get_text_bounded()
+        perf_add('extract_text', start)
+        if working_hash:
+            PAGE_CACHE.put(working_hash, working_page, text)
+    return text
+
+
+def duplicate_ini() -> dict:
+    """Initialize an empty duplicate index, filled on demand by check_duplicate() and duplicate_add().
+
+    :return: The duplicate index.
+    """
+    return {
+        # years: anni di data_documento già caricati nell'indice
+        'years': set(),
+        # sources: sorgenti già caricate nell'indice
+        'sources': set(),
+        # pages: chiavi (sorgente, pagina) dei record in vanaheim.consegne
+        'pages': set(),
+        # docs: chiavi (numero_documento, genere_documento, anno) dei record in vanaheim.consegne
+        'docs': set(),
+        # discards: record di scarto attivi di vanaheim.discard_consegne per sorgente normalizzata, caricati al primo scarto
+        'discards': None,
+        # discards_loaded: istante dell'ultimo caricamento di discards (time.monotonic())
+        'discards_loaded': None
+    }
+
+
+def check_duplicate(cursor: Cursor, duplicates: dict, key: tuple) -> bool:
+    """Check if a record is already saved in vanaheim.consegne, loading its year and source into the index when missing.
+
+    :param Cursor cursor: The cursor to the database.
+    :param dict duplicates: The duplicate index from duplicate_ini().
+    :param tuple key: The record key as (sorgente, pagina, numero_documento, genere_documento, anno).
+    :return: True if the record is a duplicate.
+    """
+    sorgente, pagina, numero_documento, genere_documento, anno = key
+
+    if anno not in duplicates['years']:
+        duplicates['docs'].update((row.numero_documento, row.genere_documento, anno) for row in sqlmng.conx_stream(cursor, QUERY_LOAD_DUPLICATE_DOCS, [anno]))
+        duplicates['years'].add(anno)
 
+    if sorgente not in duplicates['sources']:
+        duplicates['pages'].update((sorgente, row.pagina) for row in sqlmng.conx_stream(cursor, QUERY_LOAD_DUPLICATE_PAGES, [sorgente]))
+        duplicates['sources'].add(sorgente)
 
-def discard_doc(working_doc: str, working_page: int) -> str:
-    """Generate a new pdf document by extracting a single page from another pdf document.
+    return (sorgente, pagina) in duplicates['pages'] or (numero_documento, genere_documento, anno) in duplicates['docs']
+
+
+def check_discard(cursor: Cursor, duplicates: dict, working_doc_name: str):
+    """Find the active record of vanaheim.discard_consegne of a discarded doc, from the records loaded once in the index.
+
+    Only a discard doc (with the '_P{NNN}' suffix) can have a record, since vanaheim.discard_consegne is keyed by the
+    names of the discard docs, so an original doc gets None without reading the records. The records are loaded again
+    only if the one of a discard doc is missing or has NULL cells and the last load is older than
+    RECORDING_DISCARD_REFRESH seconds, so the corrections saved on the database during a long session are found.
+
+    :param Cursor cursor: The cursor to the database.
+    :param dict duplicates: The duplicate index from duplicate_ini().
+    :param str working_doc_name: The name of the doc (e.g. 2024_01_DDT_0001_0267_P005.pdf).
+    :return: The row of QUERY_LOAD_DISCARD_CONSEGNE, or None if the doc has no active discard record.
+    """
+    # un doc originario non ha record di scarto: il suo mancato riscontro è il caso normale e non ricarica i record
+    if not re.search(r'_P\d{3}', working_doc_name):
+        return None
+
+    sorgente = discard_source(working_doc_name)
+    chk_discard = duplicates['discards'].get(sorgente) if duplicates['discards'] is not None else None
+
+    if duplicates['discards'] is None or ((chk_discard is None or None in chk_discard) and time.monotonic() - duplicates['discards_loaded'] > RECORDING_DISCARD_REFRESH):
+        duplicates['discards'] = {}
+        for row in sqlmng.conx_stream(cursor, QUERY_LOAD_DISCARD_CONSEGNE):
+            # a parità di sorgente vale il record di scarto meno recente
+            duplicates['discards'].setdefault(discard_source(row.sorgente), row)
+        duplicates['discards_loaded'] = time.monotonic()
+        chk_discard = duplicates['discards'].get(sorgente)
+
+    return chk_discard
+
+
+def discard_source(working_doc_name: str) -> str:
+    """Normalize the name of a discarded doc, keeping only the first page suffix of a discard of a discard.
+
+    :param str working_doc_name: The name of the doc (e.g. 2024_01_DDT_0001_0267_P005_P001.pdf).
+    :return: The name of the first discard (e.g. 2024_01_DDT_0001_0267_P005.pdf).
+    """
+    return re.sub(r'(_P\d{3})(_P\d{3})+', r'\1', working_doc_name)
+
+
+def check_duplicate_many(cursor: Cursor, records: Iterable[tuple]) -> list[int]:
+    """Check with a single query which records are already saved in vanaheim.consegne.
+
+    :param Cursor cursor: The cursor to the database.
+    :param Iterable[tuple] records: The records as parameters of QUERY_INSERT_CONSEGNE.
+    :return: The page numbers of the duplicated records.
+    """
+    args = [value for record in records for value in (record[8], record[9], record[0], record[1], record[2].year)]
+    if not args:
+        return []
+
+    query = QUERY_CHK_DUPLICATE_MANY % {'values': ', '.join(['(?::VARCHAR, ?::INTEGER, ?::INTEGER, ?::CHAR(2), ?::INTEGER)'] * (len(args) // 5))}
+    return [row.pagina for row in sqlmng.conx_read(cursor, query, args).fetchall()]
+
+
+def gap_close(cursor: Cursor, keys: Iterable[tuple[int, int]]) -> int:
+    """Disable the active gap messages of the recorded numbers, with a query every RECORDING_GAP_CHUNK numbers.
+
+    :param Cursor cursor: The cursor to the database.
+    :param Iterable[tuple[int, int]] keys: The (anno, numero_documento) keys of the recorded numbers.
+    :return: The number of disabled gap messages.
+    """
+    keys = sorted(set(keys))
+    closed = 0
+    for pos in range(0, len(keys), RECORDING_GAP_CHUNK):
+        chunk = keys[pos:pos + RECORDING_GAP_CHUNK]
+        query = QUERY_CLOSE_RECORD_GAPS % {'values': ', '.join(['(?::INTEGER, ?::INTEGER)'] * len(chunk))}
+        closed += sqlmng.conx_write(cursor, query, [value for key in chunk for value in key])
+    return closed
+
+
+def duplicate_add(duplicates: dict, records: Iterable[tuple]) -> None:
+    """Add the saved records to the duplicate index.
+
+    :param dict duplicates: The duplicate index from duplicate_ini().
+    :param Iterable[tuple] records: The records as parameters of QUERY_INSERT_CONSEGNE.
+    """
+    for record in records:
+        duplicates['pages'].add((record[8], record[9]))
+        duplicates['docs'].add((record[0], record[1], record[2].year))
+
+
+def gap_checker(cursor: Cursor, recording_begin: datetime) -> list[tuple[int, int]]:
+    """Find the new gaps of numero_documento in vanaheim.consegne, looking only at the years and number ranges recorded since recording_begin.
+
+    A recorded number can only open gaps up to the nearest numbers already saved in its year, so every touched year is
+    checked from the saved number before the lowest recorded one to the saved number after the highest recorded one.
+
+    :param Cursor cursor: The cursor to the database.
+    :param datetime recording_begin: The starting timestamp of the recording session.
+    :return: A list of tuples containing numero_documento and year of every gap without a discard or gap message.
+    """
+    gaps = []
+
+    # ranges: per ogni anno registrato l'intervallo di numero_documento da verificare, letti prima delle altre query
+    ranges = sqlmng.conx_read(cursor, QUERY_GAP_RANGES, [recording_begin]).fetchall()
+    for row in ranges:
+        # numbers: numeri registrati, scartati o con un gap message attivo nell'intervallo
+        numbers = {num.numero for num in sqlmng.conx_stream(cursor, QUERY_GAP_NUMBERS, (
+            row.anno, row.min_num, row.max_num,
+            row.anno, row.min_num, row.max_num,
+            row.anno, row.min_num, row.max_num
+        ))}
+        gaps.extend((numero, row.anno) for numero in range(row.min_num, row.max_num + 1) if numero not in numbers)
+
+    return gaps
+
+
+def gap_left_checker(cursor: Cursor, keys: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Find the gaps opened by numbers no longer recorded (e.g. a misread numero_documento corrected by a backfill).
+
+    A number left by its record is a gap if it's between two saved numbers of its year, as in gap_checker(), and it has
+    no record, discard or gap message. The numbers are checked with a query every RECORDING_GAP_CHUNK numbers.
+
+    :param Cursor cursor: The cursor to the database.
+    :param Iterable[tuple[int, int]] keys: The (anno, numero_documento) keys of the numbers left.
+    :return: A list of tuples containing numero_documento and year of every gap without a discard or gap message.
+    """
+    keys = sorted(set(keys))
+    gaps = []
+    for pos in range(0, len(keys), RECORDING_GAP_CHUNK):
+        chunk = keys[pos:pos + RECORDING_GAP_CHUNK]
+        query = QUERY_GAP_LEFT % {'values': ', '.join(['(?::INTEGER, ?::INTEGER)'] * len(chunk))}
+        gaps.extend((row.numero, row.anno) for row in sqlmng.conx_read(cursor, query, [value for key in chunk for value in key]).fetchall())
+    return gaps
+
+
+def message_gnr(pattern: dict, values: dict) -> tuple:
+    """Build the parameters of QUERY_INSERT_MESSAGGI from a message pattern, saving the values of the text also as columns.
+
+    :param dict pattern: The message pattern (PATTERN_MESSAGE_*).
+    :param dict values: The values of the message text.
+    :return: A tuple with the parameters of QUERY_INSERT_MESSAGGI.
+    """
+    # anno: esplicito nei gap message, altrimenti l'anno di data_documento
+    anno = values.get('anno', values['data_documento'].year if values.get('data_documento') else None)
+
+    return (
+        pattern['genere'],
+        pattern['testo'] % values,
+        values.get('numero_documento'),
+        values.get('genere_documento'),
+        values.get('data_documento'),
+        anno,
+        values.get('doc'),
+        values.get('page'),
+        values.get('pattern')
+    )
+
+
+def checkpoint_load(cursor: Cursor, working_doc: str) -> dict:
+    """Read the checkpoint of a pdf document from vanaheim.checkpoint_consegne, ignoring it if the content of the document has changed.
+
+    :param Cursor cursor: The cursor to the database.
+    :param str working_doc: Path to the pdf document.
+    :return: The checkpoint, with page 0 if the document has no valid checkpoint.
+    """
+    logger = logger_ini(PATH_LOG, 'recording_doc')
+    checkpoint = {'sha256': doc_hash(working_doc), 'page': 0, 'discarded': 0}
+    saved = sqlmng.conx_read(cursor, QUERY_LOAD_CHECKPOINT, [checkpoint_name(working_doc)]).fetchone()
+    if not saved:
+        return checkpoint
+
+    if saved.sha256 != checkpoint['sha256']:
+        logger.warning(f"found checkpoint of a different content for {checkpoint_name(working_doc)}... starting from page 1!")
+        return checkpoint
+    return {**checkpoint, 'page': saved.pagina, 'discarded': saved.pagine_scartate}
+
+
+def checkpoint_save(cursor: Cursor, working_doc: str, checkpoint: dict) -> None:
+    """Write the checkpoint of a pdf document in the current transaction, so it's committed with the records of its pages.
+
+    :param Cursor cursor: The cursor to the database.
+    :param str working_doc: Path to the pdf document.
+    :param dict checkpoint: The checkpoint from checkpoint_load().
+    """
+    sqlmng.conx_write(cursor, QUERY_SAVE_CHECKPOINT, [checkpoint_name(working_doc), checkpoint['sha256'], checkpoint['page'], checkpoint['discarded']])
+
+
+def checkpoint_close(cursor: Cursor, working_doc: str) -> None:
+    """Disable the checkpoint of a recorded pdf document, so a new copy of it is worked again from page 1.
+
+    :param Cursor cursor: The cursor to the database.
+    :param str working_doc: Path to the pdf document.
+    """
+    sqlmng.conx_write(cursor, QUERY_CLOSE_CHECKPOINT, [checkpoint_name(working_doc)])
+    sqlmng.conx_commit(cursor)
+
+
+def checkpoint_name(working_doc: str) -> str:
+    """Get the key of the checkpoint of a pdf document, the sorgente of its records.
+
+    :param str working_doc: Path to the pdf document.
+    :return: The key of the checkpoint.
+    """
+    # es. 2024_01_DDT_0001_0267.pdf
+    return working_doc.removesuffix('.recording').split('/')[-1]
+
+
+def discard_doc(working_doc: str, working_pages: list[int], doc: pypdfium2.PdfDocument = None, working_hash: str = None) -> list[str]:
+    """Generate a new pdf document for every page extracted from another pdf document.
+
+    If the sha256 of the source is given, the cached text of every page is also cached for the new document, so it
+    isn't extracted again when the new document is recorded.
 
     :param str working_doc: Path to the source pdf document.
-    :param int working_page: Page number which must be extracted.
-    :return: The name of the new document.
+    :param list[int] working_pages: Page numbers which must be extracted.
+    :param PdfDocument doc: The source pdf document already opened, defaults to None (opened from working_doc).
+    :param str working_hash: The sha256 of the source pdf document, defaults to None (no cache).
+    :return: The names of the new documents.
     """
     # working_doc: percorso con suffisso '.recording' (es. c:/source/vanaheim/DDTs/2024_01_DDT_0001_0267.pdf.recording)
-    # working_page: numero di pagina in errore
-    # doc: raw PDF doc
-    doc = pypdfium2.PdfDocument(working_doc)
-    # discard: nuovo raw PDF doc
-    discard = pypdfium2.PdfDocument.new()
+    # working_pages: numeri di pagina in errore
+    # source: raw PDF doc
+    source = doc if doc else pypdfium2.PdfDocument(working_doc)
+    # discard_docs: percorsi dei nuovi doc
+    discard_docs = []
 
-    discard.import_pages(doc, [working_page - 1])
-    # discard_doc: percorso del nuovo doc (es. c:/source/vanaheim/DDTs/discarded/2024_01_DDT_0001_0267_P005.pdf)
-    discard_doc = f"{PATH_DISCARDED_DIR}/{working_doc.split('/')[-1].split('.')[0]}_P{working_page:0>3}.pdf"
-    discard.save(discard_doc)
+    for working_page in working_pages:
+        # discard: nuovo raw PDF doc
+        discard = pypdfium2.PdfDocument.new()
+        discard.import_pages(source, [working_page - 1])
 
-    discard.close()
-    doc.close()
-    return discard_doc
+        discard_docs.append(discard_name(working_doc, working_page))
+        discard.save(discard_docs[-1])
+        discard.close()
+
+        # text: testo della pagina già estratto, valido anche per il nuovo doc
+        text = PAGE_CACHE.get(working_hash, working_page, count=False) if working_hash else None
+        if text is not None:
+            PAGE_CACHE.put(doc_hash(discard_docs[-1]), 1, text)
+
+    if not doc:
+        source.close()
+    return discard_docs
+
+
+def discard_name(working_doc: str, working_page: int) -> str:
+    """Get the path of the pdf document generated by discard_doc() for a single page.
+
+    :param str working_doc: Path to the source pdf document.
+    :param int working_page: Page number which must be extracted.
+    :return: The path of the new document.
+    """
+    # es. c:/source/vanaheim/DDTs/discarded/2024_01_DDT_0001_0267_P005.pdf
+    return f"{PATH_DISCARDED_DIR}/{working_doc.split('/')[-1].split('.')[0]}_P{working_page:0>3}.pdf"
 
 
 def check_similarity(doc_targa: str) -> str:
-    """Check the plate similarity with the plates in recording_doc.ENUM_TARGA list, in order to get the correct plate.
+    """Check the plate similarity with the plates of the vanaheim.targhe registry, in order to get the correct plate.
 
     :param str doc_targa: The starting plate.
     :return: The plate most similar, or the starting plate if the similarity index is lower than 50%.
     """
     logger = logger_ini(PATH_LOG, 'recording_doc')
-    logger.info(f'checking similarity for {doc_targa}...')
+    logger.log(RECORDING_PAGE_LOG_LEVEL, 'checking similarity for %s...', doc_targa)
+
+    start = time.perf_counter()
+    res = PLATE_MATCHER.match(doc_targa)
+
+    perf_add('similarity', start)
+    return res
+
+
+def doc_recording(doc: str, cursor: Cursor, recording_begin: datetime, pool: Executor = None, duplicates: dict = None) -> bool:
+    """Record a doc of PATH_WORKING_DIR, moving it to PATH_RECORDED_DIR when all its pages are committed.
+
+    The doc is renamed with the '.recording' suffix while it's worked, and left so if a transaction fails. A doc
+    already with the suffix, left by an interrupted run, is resumed from the page after its checkpoint. A doc which
+    can't be worked for any other error (e.g. a corrupt pdf) is moved to PATH_FAILED_DIR with the '.failed' suffix, so
+    the next runs don't stop on it again; its checkpoint is kept for when it's put back in PATH_WORKING_DIR.
+
+    :param str doc: The name of the doc in PATH_WORKING_DIR (es. 2024_01_DDT_0001_0267.pdf or 2024_01_DDT_0001_0267.pdf.recording).
+    :param Cursor cursor: The cursor to the database.
+    :param datetime recording_begin: The registration timestamp of the records.
+    :param Executor pool: The processes for the page extraction, defaults to None for the serial extraction.
+    :param dict duplicates: The index of the saved records achieved from duplicate_ini(), defaults to None.
+    :return: True if the doc has been recorded.
+    """
+    logger = logger_ini(PATH_LOG, 'recording_doc')
+    # is_resumed: vero se doc è rimasto in registrazione da un'esecuzione interrotta
+    is_resumed = doc.endswith('.recording')
+    doc = doc.removesuffix('.recording')
+    if not re.search(PATTERN_WORKING_DOC, doc):
+        logger.info(f'error on PATTERN_WORKING_DOC for {doc}... skipping doc!')
+        return False
 
-    enum = dict.fromkeys(ENUM_TARGA, 0.0)
-    for targa in enum:
-        enum[targa] = SequenceMatcher(None, targa, doc_targa).ratio()
+    logger.info(f"{'resuming' if is_resumed else 'working on'} doc {doc}...")
+    # working_doc: percorso con suffisso '.recording' (es. c:/source/vanaheim/DDTs/2024_01_DDT_0001_0267.pdf.recording)
+    working_doc = f'{PATH_WORKING_DIR}/{doc}.recording'
+    if not is_resumed:
+        os.rename(f'{PATH_WORKING_DIR}/{doc}', working_doc)
 
-    max_score = sorted(enum, key=enum.get, reverse=True)[0]
-    return max_score if enum[max_score] > 0.5 else doc_targa
+    # worked_pages: numero totale di pagine di working_doc
+    # discarded_pages: numero di pagine in errore in working_doc
+    # is_failed: vero se working_doc non è registrabile per un errore diverso da quelli del database
+    is_failed = False
+    try:
+        with perf_timer('doc_scanner'):
+            worked_pages, discarded_pages = doc_scanner(working_doc, cursor, recording_begin, pool, duplicates)
+    except Error as err:
+        cursor.connection.rollback()
+        logger.error(f'error on recording doc {doc}... leaving doc as recording! [{err}]')
+        return False
+    except Exception as err:
+        cursor.connection.rollback()
+        logger.error(f'unexpected error on recording doc {doc}... moving doc to failed! [{err!r}]', exc_info=True)
+        is_failed = True
+
+    # sposto il doc fuori dall'eccezione, quando il pdf aperto da doc_scanner è già stato rilasciato
+    if is_failed:
+        os.makedirs(PATH_FAILED_DIR, exist_ok=True)
+        os.replace(working_doc, f'{PATH_FAILED_DIR}/{doc}.failed')
+        perf_count('docs_failed')
+        return False
+
+    logger.info(f'worked {worked_pages} pages on {doc} [{discarded_pages} discarded pages]')
+    checkpoint_close(cursor, working_doc)
+    os.rename(working_doc, f'{PATH_RECORDED_DIR}/{doc}.recorded')
+    perf_count('docs_recorded')
+    return True
+
+
+def session_closing(cursor: Cursor, recording_begin: datetime) -> list[tuple[int, int]]:
+    """Save the gap messages of the records registered since recording_begin and find the months to be refreshed.
+
+    :param Cursor cursor: The cursor to the database.
+    :param datetime recording_begin: The starting timestamp of the recording session.
+    :return: The list of (anno, mese) tuples of the records registered since recording_begin.
+    """
+    # verifico gaps di numero_documento in vanaheim.consegne
+    with perf_timer('gap_check'):
+        gaps = gap_checker(cursor, recording_begin)
+    sqlmng.conx_write_many(cursor, QUERY_INSERT_MESSAGGI, [message_gnr(PATTERN_MESSAGE_GAPS, {
+        'numero_documento': numero,
+        'anno': anno
+    }) for numero, anno in gaps], fast=True)
+    sqlmng.conx_commit(cursor)
+
+    return [(row.anno, row.mese) for row in sqlmng.conx_read(cursor, QUERY_OVERVIEW_DATE, [recording_begin]).fetchall()]
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record the DDTs of the working folder into vanaheim.consegne.')
+    parser.add_argument('--workers', type=int, default=RECORDING_WORKERS, help='processes for the page extraction (1 for the serial extraction)')
+    args = parser.parse_args()
+
     logger = logger_ini(PATH_LOG, 'recording_doc')
     # docs: elenco dei doc in PATH_WORKING_DIR (es. [2024_01_DDT_0001_0267.pdf, ...])
     docs = sorted(next(os.walk(PATH_WORKING_DIR), (None, None, []))[2])
     logger.info(f'DDTs dir content {docs}')
 
     recording_begin = datetime.now()
-    cursor, conn = sqlmng.conx_ini(save_changes=True)
-    # doc: un singolo doc dell'elenco (es. 2024_01_DDT_0001_0267.pdf)
-    for doc in docs:
-        if not re.search(PATTERN_WORKING_DOC, doc):
-            logger.info(f'error on PATTERN_WORKING_DOC for {doc}... skipping doc!')
-            continue
+    with perf_profile(f'{PATH_METRICS}.prof', RECORDING_PROFILE), perf_timer('session'):
+        with sqlmng.conx_session() as (cursor, _):
+            # pool: processi per l'estrazione delle pagine, assente se l'estrazione è seriale
+            pool = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+            # duplicates: indice dei record già registrati, caricato per anno e sorgente durante la sessione
+            duplicates = duplicate_ini()
+            # recorded: doc registrati nella sessione
+            recorded = [doc for doc in docs if doc_recording(doc, cursor, recording_begin, pool, duplicates)]
 
-        logger.info(f'working on doc {doc}...')
-        # working_doc: percorso con suffisso '.recording' (es. c:/source/vanaheim/DDTs/2024_01_DDT_0001_0267.pdf.recording)
-        working_doc = f'{PATH_WORKING_DIR}/{doc}.recording'
-        os.rename(f'{PATH_WORKING_DIR}/{doc}', working_doc)
+            if pool:
+                pool.shutdown()
 
-        # worked_pages: numero totale di pagine di working_doc
-        # discarded_pages: numero di pagine in errore in working_doc
-        worked_pages, discarded_pages = doc_scanner(working_doc, cursor, recording_begin)
+            overviews = session_closing(cursor, recording_begin)
 
-        logger.info(f'worked {worked_pages} pages on {doc} [{discarded_pages} discarded pages]')
-        os.rename(working_doc, f'{PATH_RECORDED_DIR}/{doc}.recorded')
+        # aggiorno overview dei doc registrati, riusando la connessione rilasciata al pool
+        with perf_timer('overview'):
+            overview_batch(overviews)
 
-    # verifico gaps di numero_documento in vanaheim.consegne
-    gaps = sqlmng.conx_read(cursor, QUERY_CHK_GAPS).fetchall()
-    for row in gaps:
-        if sqlmng.conx_write(cursor, QUERY_INSERT_MESSAGGI, (PATTERN_MESSAGE_GAPS['genere'], PATTERN_MESSAGE_GAPS['testo'] % {
-            'numero_documento': row.numero,
-            'anno': row.anno
-        })) != 1:
-            logger.error('error on saving gap message record...')
-
-    # aggiorno overview dei doc registrati
-    overviews = sqlmng.conx_read(cursor, QUERY_OVERVIEW_DATE, [recording_begin]).fetchall()
-    for row in overviews:
-        overview_gnr(row.anno, row.mese)
-
-    cursor.close()
-    conn.close()
+    # salvo le metriche della sessione accanto al log
+    perf_dump(f'{PATH_METRICS}.json', {
+        'session': recording_begin,
+        'docs': recorded,
+        'cache': {'hits': PAGE_CACHE.hits, 'misses': PAGE_CACHE.misses}
+    })
+    logger.info(f'saving session metrics... [{PATH_METRICS}.json]')
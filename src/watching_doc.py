@@ -0,0 +1,318 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from overview_doc import overview_batch
+from pyodbc import Error
+from queue import Empty, Full, Queue
+from recording_doc import PATH_WORKING_DIR, PATTERN_WORKING_DOC, RECORDING_WORKERS, doc_recording, duplicate_ini, session_closing
+from share import sqlmng
+from share.common import logger_ini
+from share.perfmng import perf_dump, perf_timer
+from threading import Condition, Event, Lock, Thread
+import ctypes
+import os
+import re
+import select
+import signal
+import sys
+import time
+
+__version__ = '1.3.0'
+
+PATH_PRJ = 'c:/source/vanaheim'
+PATH_LOG = f"{PATH_PRJ}/log/vanaheim_{date.today().strftime('%Y_%m_%d')}.log"
+
+# WATCH_DEBOUNCE: secondi per cui dimensione e data di modifica di un doc devono restare invariate prima della registrazione
+WATCH_DEBOUNCE = 5
+# WATCH_POLL: secondi tra due letture di PATH_WORKING_DIR se inotify non è disponibile o ci sono doc in scrittura
+WATCH_POLL = 2
+# WATCH_IDLE: secondi tra due letture di controllo di PATH_WORKING_DIR con inotify e nessun doc in scrittura
+WATCH_IDLE = 60
+# WATCH_QUEUE_SIZE: numero massimo di doc in attesa di registrazione
+WATCH_QUEUE_SIZE = 64
+# WATCH_COALESCE: secondi senza nuove registrazioni prima di verificare i gap e aggiornare le overview
+WATCH_COALESCE = 30
+# WATCH_COALESCE_MAX: secondi massimi di attesa dalla prima registrazione non ancora verificata
+WATCH_COALESCE_MAX = 600
+# WATCH_RETRY: secondi prima di ritentare un doc lasciato in registrazione da un errore del database, raddoppiati a ogni errore
+WATCH_RETRY = 30
+# WATCH_RETRY_MAX: secondi massimi di attesa tra due tentativi dello stesso doc
+WATCH_RETRY_MAX = 900
+
+# IN_*: costanti di inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o0004000
+IN_CLOEXEC = 0o2000000
+
+
+def inotify_ini(path: str) -> int | None:
+    """Start watching a directory with inotify for created, written and moved in files.
+
+    :param str path: Path to the directory.
+    :return: The inotify file descriptor, or None if inotify isn't available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+
+    if libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def inotify_wait(fd: int, timeout: float) -> bool:
+    """Wait for inotify events and discard them, the directory is read again by the caller.
+
+    :param int fd: The inotify file descriptor achieved from inotify_ini() calling.
+    :param float timeout: Maximum seconds to wait.
+    :return: True if there was at least one event.
+    """
+    ready, _, _ = select.select([fd], [], [], timeout)
+    if not ready:
+        return False
+
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+    return True
+
+
+def watch_loop(queue: Queue, stop: Event) -> None:
+    """Watch PATH_WORKING_DIR and put on queue the docs whose size and modification time are stable for WATCH_DEBOUNCE seconds.
+
+    The directory is read again on every inotify event, or every WATCH_POLL seconds without inotify. When the queue
+    is full the docs are left in the directory and put on the queue by a later reading.
+
+    :param Queue queue: The queue of the doc names to be recorded.
+    :param Event stop: The event which ends the loop.
+    """
+    logger = logger_ini(PATH_LOG, 'watching_doc')
+    fd = inotify_ini(PATH_WORKING_DIR)
+    logger.info(f'watching {PATH_WORKING_DIR}... [{"inotify" if fd is not None else "polling"}]')
+
+    # pending: doc in scrittura, come tuple (firma del file, istante in cui la firma è cambiata)
+    pending = {}
+    # queued: doc già messi in coda e ancora presenti in PATH_WORKING_DIR
+    queued = set()
+    # ignored: doc che non rispettano PATTERN_WORKING_DOC, segnalati una sola volta
+    ignored = set()
+
+    while not stop.is_set():
+        now = time.monotonic()
+        docs = {entry.name for entry in os.scandir(PATH_WORKING_DIR) if entry.is_file()}
+        queued &= docs
+        ignored &= docs
+
+        for doc in sorted(docs - queued - ignored):
+            if not re.search(PATTERN_WORKING_DOC, doc):
+                if not doc.endswith('.recording'):
+                    logger.info(f'error on PATTERN_WORKING_DOC for {doc}... skipping doc!')
+                ignored.add(doc)
+                continue
+
+            try:
+                stat = os.stat(f'{PATH_WORKING_DIR}/{doc}')
+            except FileNotFoundError:
+                continue
+
+            # stamp: firma del file, invariata a scrittura terminata
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            if doc not in pending or pending[doc][0] != stamp:
+                pending[doc] = (stamp, now)
+                continue
+            if now - pending[doc][1] < WATCH_DEBOUNCE:
+                continue
+
+            try:
+                queue.put(doc, timeout=WATCH_POLL)
+            except Full:
+                logger.warning(f'recording queue full... delaying doc {doc}!')
+                break
+            queued.add(doc)
+            pending.pop(doc)
+
+        pending = {doc: value for doc, value in pending.items() if doc in docs and doc not in queued}
+
+        if fd is None:
+            stop.wait(WATCH_POLL)
+        else:
+            inotify_wait(fd, WATCH_POLL if pending else WATCH_IDLE)
+
+    if fd is not None:
+        os.close(fd)
+
+
+def closing_request(closing: dict, recording_begin: datetime) -> None:
+    """Ask the closing loop for the gap check and the overview refresh of the records registered since recording_begin.
+
+    :param dict closing: The state shared with closing_loop().
+    :param datetime recording_begin: The registration timestamp of the records.
+    """
+    with closing['condition']:
+        if closing['since'] is None:
+            closing['since'] = recording_begin
+            closing['first'] = time.monotonic()
+        closing['since'] = min(closing['since'], recording_begin)
+        closing['last'] = time.monotonic()
+        closing['condition'].notify()
+
+
+def closing_loop(closing: dict, stop: Event) -> None:
+    """Run session_closing() and overview_batch() once for the requests of closing_request() close in time.
+
+    The requests are coalesced until WATCH_COALESCE seconds pass without new ones, or WATCH_COALESCE_MAX seconds pass
+    from the first one. The pending requests are served before the loop ends, and the metrics gathered since the
+    previous closing are saved next to the log after every closing.
+
+    :param dict closing: The state shared with closing_request(), with the lock held while recording a doc.
+    :param Event stop: The event which ends the loop.
+    """
+    logger = logger_ini(PATH_LOG, 'watching_doc')
+
+    while True:
+        with closing['condition']:
+            if closing['since'] is None:
+                if stop.is_set():
+                    return
+                closing['condition'].wait(WATCH_POLL)
+                continue
+
+            now = time.monotonic()
+            # delay: secondi di attesa residui prima di servire le richieste
+            delay = min(WATCH_COALESCE - (now - closing['last']), WATCH_COALESCE_MAX - (now - closing['first']))
+            if delay > 0 and not stop.is_set():
+                closing['condition'].wait(min(delay, WATCH_POLL))
+                continue
+
+            since = closing['since']
+            closing['since'] = None
+
+        try:
+            # nessun doc viene registrato durante la verifica dei gap
+            with closing['lock'], sqlmng.conx_session() as (cursor, _):
+                overviews = session_closing(cursor, since)
+        except Error as err:
+            if stop.is_set():
+                logger.error(f'error on checking gaps since {since}... skipping check! [{err}]')
+                return
+            logger.error(f'error on checking gaps since {since}... retrying later! [{err}]')
+            closing_request(closing, since)
+            stop.wait(WATCH_POLL)
+            continue
+
+        with perf_timer('overview'):
+            overview_batch(overviews)
+
+        # salvo le metriche accumulate dalla chiusura precedente accanto al log
+        metrics_path = f"{PATH_PRJ}/log/vanaheim_{datetime.now().strftime('%Y_%m_%d_%H%M%S')}_watching.json"
+        perf_dump(metrics_path, {'session': since})
+        logger.info(f'saving session metrics... [{metrics_path}]')
+
+
+def retry_request(retries: dict, doc: str) -> float | None:
+    """Schedule a new attempt of a doc left as '.recording' in PATH_WORKING_DIR, waiting twice as long after every failure.
+
+    :param dict retries: The docs to be attempted again, as (failed attempts, monotonic time of the next attempt).
+    :param str doc: The name of the doc, with or without the '.recording' suffix.
+    :return: The seconds before the next attempt, or None if the doc isn't left as '.recording'.
+    """
+    # working_doc: nome del doc in registrazione (es. 2024_01_DDT_0001_0267.pdf.recording)
+    working_doc = f"{doc.removesuffix('.recording')}.recording"
+    attempts = retries.pop(working_doc, (0, 0.0))[0]
+    if not os.path.isfile(f'{PATH_WORKING_DIR}/{working_doc}'):
+        return None
+
+    delay = min(WATCH_RETRY * 2 ** attempts, WATCH_RETRY_MAX)
+    retries[working_doc] = (attempts + 1, time.monotonic() + delay)
+    return delay
+
+
+def watch_folder() -> None:
+    """Record the docs written in PATH_WORKING_DIR until SIGTERM or SIGINT, as they are completed.
+
+    The docs are recorded one at a time on a pooled database session, which is opened again after a database error.
+    An unexpected error on a doc is logged and the watch goes on with the next one, while an error escaping the loop
+    still stops closing_loop() and the process pool before being raised. A doc left as '.recording' by a database
+    error is attempted again after WATCH_RETRY seconds, doubled at every failure up to WATCH_RETRY_MAX.
+    """
+    logger = logger_ini(PATH_LOG, 'watching_doc')
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    queue = Queue(WATCH_QUEUE_SIZE)
+    # closing: richieste di verifica gap e aggiornamento overview, condivise con closing_loop
+    closing = {'since': None, 'first': 0.0, 'last': 0.0, 'condition': Condition(), 'lock': Lock()}
+    watcher = Thread(target=watch_loop, args=(queue, stop), name='watch_loop', daemon=True)
+    closer = Thread(target=closing_loop, args=(closing, stop), name='closing_loop')
+    watcher.start()
+    closer.start()
+
+    # pool: processi per l'estrazione delle pagine, assente se l'estrazione è seriale
+    pool = ProcessPoolExecutor(RECORDING_WORKERS) if RECORDING_WORKERS > 1 else None
+    # duplicates: indice dei record già registrati, caricato per anno e sorgente durante il servizio
+    duplicates = duplicate_ini()
+    # orphans: doc lasciati in registrazione da un'esecuzione interrotta, ripresi prima dei nuovi
+    orphans = sorted(doc for doc in os.listdir(PATH_WORKING_DIR) if doc.endswith('.recording'))
+    # retries: doc lasciati in registrazione da un errore del database, come (tentativi falliti, istante del prossimo tentativo)
+    retries = {}
+    try:
+        while not stop.is_set():
+            try:
+                with sqlmng.conx_session() as (cursor, _):
+                    while not stop.is_set():
+                        # due: doc da ritentare con l'attesa trascorsa, ripresi dopo gli interrotti e prima dei nuovi
+                        due = sorted((at, name) for name, (_, at) in retries.items() if at <= time.monotonic())
+                        try:
+                            doc = orphans.pop(0) if orphans else due[0][1] if due else queue.get(timeout=WATCH_POLL)
+                        except Empty:
+                            continue
+
+                        recording_begin = datetime.now()
+                        recorded = False
+                        try:
+                            with closing['lock']:
+                                recorded = doc_recording(doc, cursor, recording_begin, pool, duplicates)
+                        except OSError as err:
+                            logger.error(f'error on moving doc {doc}... skipping doc! [{err}]')
+                            continue
+                        except Error:
+                            raise
+                        except Exception as err:
+                            logger.error(f'unexpected error on doc {doc}... skipping doc! [{err!r}]', exc_info=True)
+                            continue
+                        finally:
+                            # un doc rimasto in registrazione non viene più letto da watch_loop: lo ritento con attesa crescente
+                            if recorded:
+                                retries.pop(f"{doc.removesuffix('.recording')}.recording", None)
+                            else:
+                                delay = retry_request(retries, doc)
+                                if delay is not None:
+                                    logger.warning(f'doc {doc} left as recording... retrying in {delay} seconds!')
+                        if recorded:
+                            closing_request(closing, recording_begin)
+            except Error as err:
+                logger.error(f'error on database session... reconnecting! [{err}]')
+                stop.wait(WATCH_POLL)
+    finally:
+        # fermo closing_loop, che serve le richieste in attesa, anche se il ciclo termina per un errore
+        logger.info('stopping watch...')
+        stop.set()
+        if pool:
+            pool.shutdown()
+        closer.join()
+
+
+if __name__ == '__main__':
+    watch_folder()